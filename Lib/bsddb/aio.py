@@ -0,0 +1,398 @@
+"""
+Copyright (c) 2008-2020, Jesus Cea Avion <jcea@jcea.es>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+    1. Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+    copyright notice, this list of conditions and the following
+    disclaimer in the documentation and/or other materials provided
+    with the distribution.
+
+    3. Neither the name of Jesus Cea Avion nor the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+    CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+    INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+    EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+    TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+    DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+    TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+    THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+    SUCH DAMAGE.
+    """
+
+"""
+asyncio front-end for DB, DBCursor, DBShelf and DBTxn objects.
+
+Berkeley DB calls block, so the wrappers in this module run them in a
+bounded pool of threads and return awaitables.  Every method of the
+wrapped object is available, returning an awaitable instead of the
+result:
+
+    d = aio.AsyncDB(database)
+    await d.put(b"key", b"data")
+    data = await d.get(b"key")
+    async for key, data in d.cursor():
+        ...
+
+Calls issued while a previous one is still running are queued and run
+back to back by the same worker thread, so bursts of small requests
+don't pay a thread handoff each.  Handles opened without DB_THREAD, and
+cursors, are never used by two threads at the same time.
+
+This module requires Python 3.5 or newer.
+"""
+
+import sys
+import collections
+import threading
+import asyncio
+from concurrent import futures
+
+absolute_import = (sys.version_info[0] >= 3)
+if absolute_import :
+    from . import db
+else :
+    import db
+
+# Size of the thread pool shared by default by every wrapper
+DEFAULT_WORKERS = 8
+# Concurrent calls allowed on a handle opened with DB_THREAD
+DEFAULT_CONCURRENCY = 4
+# Queued calls run by a worker thread before delivering their results
+DEFAULT_BATCH = 64
+# Records read in advance by cursor iteration
+DEFAULT_PREFETCH = 64
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+def _running_loop():
+    """Return the loop running the calling coroutine or callback.  Calls
+    made before the loop runs use the loop of the current thread."""
+    try:
+        return asyncio.get_running_loop()
+    except (AttributeError, RuntimeError):
+        # Python < 3.7, or no loop running yet
+        return asyncio.get_event_loop()
+
+def get_executor():
+    """Return the thread pool used by the wrappers when none is given,
+    creating it with DEFAULT_WORKERS threads the first time."""
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = futures.ThreadPoolExecutor(DEFAULT_WORKERS)
+        return _default_executor
+
+
+def _deliver(results):
+    for future, result, exception in results:
+        if future.cancelled():
+            continue
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+
+class _Runner(object):
+    """Run calls in an executor, at most 'lanes' of them at the same
+    time.  Calls queued while the lanes are busy are run in batches by
+    the worker threads already running."""
+    def __init__(self, executor, lanes=1, batch=DEFAULT_BATCH):
+        self._executor = executor
+        self._lanes = lanes
+        self._batch = batch
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._active = 0
+
+    def run(self, function, *args, **kwargs):
+        loop = _running_loop()
+        future = loop.create_future()
+        with self._lock:
+            self._pending.append((future, function, args, kwargs))
+            start = self._active < self._lanes
+            if start:
+                self._active += 1
+        if start:
+            self._executor.submit(self._drain, loop)
+        return future
+
+    def _drain(self, loop):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._active -= 1
+                    return
+                batch = []
+                while self._pending and len(batch) < self._batch:
+                    batch.append(self._pending.popleft())
+            results = []
+            for future, function, args, kwargs in batch:
+                if future.cancelled():
+                    continue
+                try:
+                    results.append((future, function(*args, **kwargs), None))
+                except Exception as exception:
+                    results.append((future, None, exception))
+            loop.call_soon_threadsafe(_deliver, results)
+
+
+def _unwrap_txns(args, kwargs):
+    """Replace the AsyncTxn arguments, positional or not, by their DBTxn."""
+    for name, value in kwargs.items():
+        if isinstance(value, AsyncTxn):
+            kwargs[name] = value.txn
+    return [arg.txn if isinstance(arg, AsyncTxn) else arg for arg in args]
+
+
+class _AsyncWrapper(object):
+    def __getattr__(self, name):
+        """Methods of the wrapped object are run in the thread pool."""
+        if name.startswith("_"):
+            raise AttributeError(name)
+        function = getattr(self._obj, name)
+        if not callable(function):
+            return function
+        def wrapper(*args, **kwargs):
+            args = _unwrap_txns(args, kwargs)
+            return self._runner.run(function, *args, **kwargs)
+        wrapper.__name__ = name
+        return wrapper
+
+
+#---------------------------------------------------------------------------
+
+class AsyncDB(_AsyncWrapper):
+    """Wrap an open DB so its methods return awaitables.
+
+    If the DB was opened with DB_THREAD up to 'concurrency' calls run
+    at the same time, otherwise calls run one after another.  'batch'
+    is the number of queued calls a worker thread runs in a row.
+    """
+    def __init__(self, database, executor=None,
+                 concurrency=DEFAULT_CONCURRENCY, batch=DEFAULT_BATCH):
+        self._obj = database
+        self._executor = executor or get_executor()
+        self._batch = batch
+        self._free_threaded = bool(database.get_open_flags() & db.DB_THREAD)
+        if not self._free_threaded:
+            concurrency = 1
+        self._runner = _Runner(self._executor, concurrency, batch)
+
+    def _get_many(self, keys, txn):
+        get = self._obj.get
+        return [get(key, txn=txn) for key in keys]
+
+    def get_many(self, keys, txn=None):
+        """Look up several keys with a single thread handoff, returning
+        the list of their values (None for missing keys)."""
+        if isinstance(txn, AsyncTxn):
+            txn = txn.txn
+        return self._runner.run(self._get_many, list(keys), txn)
+
+    def _put_many(self, items, txn, flags):
+        put = self._obj.put
+        for key, data in items:
+            put(key, data, txn=txn, flags=flags)
+
+    def put_many(self, items, txn=None, flags=0):
+        """Store several (key, data) pairs with a single thread handoff."""
+        if isinstance(txn, AsyncTxn):
+            txn = txn.txn
+        return self._runner.run(self._put_many, list(items), txn, flags)
+
+    def cursor(self, txn=None, flags=0, prefetch=DEFAULT_PREFETCH):
+        """Return an AsyncCursor.  The cursor itself is opened by the
+        first call made on it."""
+        if isinstance(txn, AsyncTxn):
+            txn = txn.txn
+        if self._free_threaded:
+            runner = _Runner(self._executor, 1, self._batch)
+        else:
+            # The cursor can't be used while another thread uses the DB
+            runner = self._runner
+        return AsyncCursor(self._obj.cursor, (txn, flags), runner, prefetch)
+
+
+class AsyncShelf(AsyncDB):
+    """Wrap an open DBShelf so its methods return awaitables.  Values
+    are pickled and unpickled in the worker threads, and cursors return
+    unpickled values."""
+
+
+#---------------------------------------------------------------------------
+
+class AsyncCursor(_AsyncWrapper):
+    """A cursor whose methods return awaitables.  Calls on a cursor are
+    always run one after another.
+
+    'async for' walks the records from the first one, reading 'prefetch'
+    of them at a time in advance.
+    """
+    def __init__(self, factory, args, runner, prefetch=DEFAULT_PREFETCH):
+        self._factory = factory
+        self._args = args
+        self._cursor = None
+        self._runner = runner
+        self.prefetch = max(1, prefetch)
+        self._buffer = collections.deque()
+        self._started = False
+        self._exhausted = False
+        self._fetching = None
+
+    @property
+    def _obj(self):
+        # Only called from the worker threads, one at a time
+        if self._cursor is None:
+            self._cursor = self._factory(*self._args)
+        return self._cursor
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        def wrapper(*args, **kwargs):
+            args = _unwrap_txns(args, kwargs)
+            def call():
+                return getattr(self._obj, name)(*args, **kwargs)
+            return self._runner.run(call)
+        wrapper.__name__ = name
+        return wrapper
+
+    def close(self):
+        def close():
+            if self._cursor is not None:
+                self._cursor.close()
+        self._exhausted = True
+        self._buffer.clear()
+        return self._runner.run(close)
+
+    #----------------------------------------------
+    # Iteration
+
+    def _fetch(self, n):
+        cursor = self._obj
+        records = []
+        if self._started:
+            move = getattr(cursor, "next")
+        else:
+            move = cursor.first
+            self._started = True
+        try:
+            while len(records) < n:
+                rec = move()
+                if rec is None:
+                    break
+                records.append(rec)
+                move = getattr(cursor, "next")
+        except db.DBNotFoundError:
+            pass
+        return records
+
+    def _start_fetch(self):
+        self._fetching = self._runner.run(self._fetch, self.prefetch)
+        self._fetching.add_done_callback(self._fetched)
+
+    def _fetched(self, fetch):
+        self._fetching = None
+        if fetch.cancelled() or fetch.exception() is not None:
+            return
+        records = fetch.result()
+        if len(records) < self.prefetch:
+            self._exhausted = True
+        self._buffer.extend(records)
+
+    def _read_ahead(self):
+        if (len(self._buffer) <= self.prefetch // 2 and
+                not self._exhausted and self._fetching is None):
+            self._start_fetch()
+
+    def _serve(self, waiter):
+        if waiter.done():
+            return
+        if self._buffer:
+            waiter.set_result(self._buffer.popleft())
+            self._read_ahead()
+        elif self._exhausted:
+            waiter.set_exception(StopAsyncIteration())
+        else:
+            if self._fetching is None:
+                self._start_fetch()
+            self._fetching.add_done_callback(
+                    lambda fetch: self._fetch_done(fetch, waiter))
+
+    def _fetch_done(self, fetch, waiter):
+        if waiter.done():
+            return
+        if fetch.cancelled():
+            waiter.cancel()
+        elif fetch.exception() is not None:
+            waiter.set_exception(fetch.exception())
+        else:
+            self._serve(waiter)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        waiter = _running_loop().create_future()
+        self._serve(waiter)
+        return waiter
+
+
+#---------------------------------------------------------------------------
+
+class AsyncTxn(_AsyncWrapper):
+    """Wrap a DBTxn so commit(), abort() and its other methods return
+    awaitables.  AsyncTxn objects can be given as the 'txn' keyword
+    argument of the other wrappers.
+
+    Used in an 'async with' block, the transaction is committed at the
+    end of the block, or aborted if an exception is raised.
+    """
+    def __init__(self, txn, executor=None):
+        self.txn = self._obj = txn
+        self._runner = _Runner(executor or get_executor(), 1)
+
+    @classmethod
+    def begin(cls, dbenv, parent=None, flags=0, executor=None):
+        """Begin a transaction in dbenv, returning an awaitable that
+        gives its AsyncTxn."""
+        if isinstance(parent, AsyncTxn):
+            parent = parent.txn
+        runner = _Runner(executor or get_executor(), 1)
+        future = runner.run(dbenv.txn_begin, parent, flags)
+        result = _running_loop().create_future()
+        def wrap(begun):
+            if result.cancelled():
+                return
+            if begun.exception() is not None:
+                result.set_exception(begun.exception())
+            else:
+                result.set_result(cls(begun.result(), executor))
+        future.add_done_callback(wrap)
+        return result
+
+    def __aenter__(self):
+        future = _running_loop().create_future()
+        future.set_result(self)
+        return future
+
+    def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            return self.commit()
+        return self.abort()
@@ -142,6 +142,8 @@ class DB(MutableMapping):
         return self._cobj.consume(*args, **kwargs)
     def consume_wait(self, *args, **kwargs):
         return self._cobj.consume_wait(*args, **kwargs)
+    def consume_many(self, *args, **kwargs):
+        return self._cobj.consume_many(*args, **kwargs)
     def cursor(self, *args, **kwargs):
         return self._cobj.cursor(*args, **kwargs)
     def delete(self, *args, **kwargs):
@@ -156,6 +158,8 @@ class DB(MutableMapping):
         return self._cobj.get_both(*args, **kwargs)
     def get_byteswapped(self, *args, **kwargs):
         return self._cobj.get_byteswapped(*args, **kwargs)
+    def get_into(self, *args, **kwargs):
+        return self._cobj.get_into(*args, **kwargs)
     def get_size(self, *args, **kwargs):
         return self._cobj.get_size(*args, **kwargs)
     def get_type(self, *args, **kwargs):
@@ -233,6 +237,8 @@ class DBSequence:
         return self._cobj.close(*args, **kwargs)
     def get(self, *args, **kwargs):
         return self._cobj.get(*args, **kwargs)
+    def get_block(self, *args, **kwargs):
+        return self._cobj.get_block(*args, **kwargs)
     def get_dbp(self, *args, **kwargs):
         return self._cobj.get_dbp(*args, **kwargs)
     def get_key(self, *args, **kwargs):
@@ -0,0 +1,301 @@
+"""
+Copyright (c) 2008-2020, Jesus Cea Avion <jcea@jcea.es>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+    1. Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+    copyright notice, this list of conditions and the following
+    disclaimer in the documentation and/or other materials provided
+    with the distribution.
+
+    3. Neither the name of Jesus Cea Avion nor the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+    CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+    INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+    EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+    TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+    DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+    TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+    THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+    SUCH DAMAGE.
+    """
+
+
+"""
+Sampling profiler for the statistics of a DBEnv.
+
+DBEnv.lock_stat(), mutex_stat(), txn_stat() and memp_stat() return
+counters accumulated since the environment was opened.  A Profiler
+polls them at a fixed interval from a background thread and keeps a
+time series, giving the change of every counter between two samples
+and its rate per second:
+
+    profiler = dbprofile.Profiler(env, interval=1.0)
+    profiler.start()
+    ...
+    profiler.stop()
+    for row in profiler.series():
+        print(row["time"], row["lock.nconflicts.rate"])
+    profiler.to_json(open("stats.json", "w"))
+    profiler.to_csv(open("stats.csv", "w"))
+
+Every row of the series is a flat dictionary with the time of the
+sample, the 'interval' since the previous one and, for each statistic
+"group.name" (e.g. "lock.ndeadlocks", "mpool.cache_miss"), its value,
+its "group.name.delta" and its "group.name.rate".  The memory pool
+statistics of each database file are named "mpool[file].name".
+
+Lock errors can be traced back to the Python code that got them:
+
+    with profiler.watch():          # or as a @profiler.watch() decorator
+        d.put(key, data, txn=txn)
+
+counts the DBLockDeadlockError and DBLockNotGrantedError exceptions
+raised inside the block by call site ("file:line function", the
+innermost Python frame of the traceback), both in total (errors()) and
+in every sample ("errors" and "errors[file:line function]").
+"""
+
+import sys
+import time
+import numbers
+import json
+import csv
+import functools
+import traceback
+
+absolute_import = (sys.version_info[0] >= 3)
+if absolute_import :
+    from . import db
+else :
+    import db
+
+try:
+    import threading
+except ImportError:
+    # Python built without thread support
+    import dummy_threading as threading
+
+# Statistics sampled when none are given
+DEFAULT_STATS = ("lock", "mutex", "txn", "mpool")
+# Exceptions counted by watch()
+LOCK_ERRORS = (db.DBLockDeadlockError, db.DBLockNotGrantedError)
+
+
+def _numbers(prefix, stats, into):
+    for name, value in stats.items():
+        # Skip the LSNs and lists of active transactions
+        if isinstance(value, numbers.Number):
+            into["%s.%s" % (prefix, name)] = value
+
+
+def call_site(tb):
+    """Return "file:line function" for the innermost frame of the
+    traceback 'tb'."""
+    filename, lineno, function, text = traceback.extract_tb(tb)[-1]
+    return "%s:%d %s" % (filename, lineno, function)
+
+
+class Profiler(object):
+    """Sample the statistics of the DBEnv 'env' every 'interval' seconds.
+
+    'stats' are the groups of statistics read: "lock", "mutex", "txn"
+    and/or "mpool".  Only the last 'max_samples' samples are kept, if
+    given.  'clear' resets the counters of Berkeley DB (DB_STAT_CLEAR)
+    on every sample, so they count only since the previous one and the
+    values are taken as the deltas.
+    """
+    def __init__(self, env, interval=1.0, stats=DEFAULT_STATS,
+                 max_samples=None, clear=False):
+        for name in stats:
+            if name not in DEFAULT_STATS:
+                raise ValueError("unknown statistics %r" % (name,))
+        self.env = env
+        self.interval = interval
+        self.stats = tuple(stats)
+        self.max_samples = max_samples
+        self.clear = clear
+        self._lock = threading.Lock()
+        self._samples = []
+        self._errors = {}
+        self._new_errors = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    #----------------------------------------------
+    # Sampling
+
+    def _read(self):
+        flags = self.clear and db.DB_STAT_CLEAR or 0
+        values = {}
+        if "lock" in self.stats:
+            _numbers("lock", self.env.lock_stat(flags), values)
+        if "mutex" in self.stats:
+            _numbers("mutex", self.env.mutex_stat(flags), values)
+        if "txn" in self.stats:
+            _numbers("txn", self.env.txn_stat(flags), values)
+        if "mpool" in self.stats:
+            stats, files = self.env.memp_stat(flags)
+            _numbers("mpool", stats, values)
+            for filename, stats in files.items():
+                _numbers("mpool[%s]" % (filename,), stats, values)
+        return values
+
+    def sample(self):
+        """Read the statistics now, add them to the time series and
+        return the raw sample, a dictionary with the 'time' and the
+        value of every statistic."""
+        values = self._read()
+        with self._lock:
+            values["time"] = time.time()
+            values["errors"] = sum(self._new_errors.values())
+            for site, count in self._new_errors.items():
+                values["errors[%s]" % (site,)] = count
+            self._new_errors = {}
+            self._samples.append(values)
+            if self.max_samples is not None and \
+                    len(self._samples) > self.max_samples:
+                del self._samples[:-self.max_samples]
+        return values
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Start sampling in a background thread."""
+        if self._thread is not None:
+            raise RuntimeError("the profiler is already running")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="dbprofile.Profiler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread, taking a last sample."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.sample()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def samples(self):
+        """Return the list of raw samples."""
+        with self._lock:
+            return list(self._samples)
+
+    def series(self):
+        """Return the time series, a list of rows with the value, delta
+        and rate of every statistic.  The first sample has no deltas
+        and rates."""
+        rows = []
+        previous = None
+        for sample in self.samples():
+            row = {"time": sample["time"]}
+            if previous is not None:
+                interval = sample["time"] - previous["time"]
+                row["interval"] = interval
+            for name, value in sample.items():
+                if name == "time":
+                    continue
+                row[name] = value
+                if previous is None:
+                    continue
+                if name.startswith("errors") or self.clear:
+                    # Already counted since the previous sample
+                    delta = value
+                else:
+                    delta = value - previous.get(name, 0)
+                row[name + ".delta"] = delta
+                if interval > 0:
+                    row[name + ".rate"] = delta / float(interval)
+            rows.append(row)
+            previous = sample
+        return rows
+
+    #----------------------------------------------
+    # Lock errors
+
+    def record_error(self, exception, tb):
+        """Count a lock error raised at the traceback 'tb'."""
+        site = call_site(tb)
+        with self._lock:
+            self._errors[site] = self._errors.get(site, 0) + 1
+            self._new_errors[site] = self._new_errors.get(site, 0) + 1
+
+    def errors(self):
+        """Return a dictionary with the number of lock errors counted
+        by watch() at every call site."""
+        with self._lock:
+            return dict(self._errors)
+
+    def watch(self, exceptions=LOCK_ERRORS):
+        """Return a context manager, also usable as a decorator,
+        counting the 'exceptions' raised inside it."""
+        return _Watch(self, exceptions)
+
+    #----------------------------------------------
+    # Export
+
+    def to_json(self, f):
+        """Write the time series to the text file 'f' as a JSON list of
+        rows."""
+        json.dump(self.series(), f, sort_keys=True)
+
+    def to_csv(self, f):
+        """Write the time series to the text file 'f' as CSV, one row
+        per sample."""
+        rows = self.series()
+        names = set()
+        for row in rows:
+            names.update(row)
+        names.discard("time")
+        names.discard("interval")
+        writer = csv.DictWriter(f, ["time", "interval"] + sorted(names))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+class _Watch(object):
+    def __init__(self, profiler, exceptions):
+        self._profiler = profiler
+        self._exceptions = exceptions
+
+    def __enter__(self):
+        return self._profiler
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None and issubclass(exc_type, self._exceptions):
+            self._profiler.record_error(exc_value, tb)
+        return False
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self:
+                return function(*args, **kwargs)
+        return wrapper
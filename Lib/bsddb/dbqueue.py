@@ -0,0 +1,449 @@
+"""
+Copyright (c) 2008-2020, Jesus Cea Avion <jcea@jcea.es>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+    1. Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+    copyright notice, this list of conditions and the following
+    disclaimer in the documentation and/or other materials provided
+    with the distribution.
+
+    3. Neither the name of Jesus Cea Avion nor the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+    CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+    INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+    EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+    TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+    DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+    TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+    THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+    SUCH DAMAGE.
+    """
+
+
+"""
+Persistent work queue with acknowledgements, built on a Queue database.
+
+    env = db.DBEnv()
+    env.set_lk_detect(db.DB_LOCK_DEFAULT)
+    env.open(home, db.DB_CREATE | db.DB_INIT_MPOOL | db.DB_INIT_LOCK |
+             db.DB_INIT_LOG | db.DB_INIT_TXN | db.DB_THREAD)
+    queue = dbqueue.WorkQueue(env, "jobs", max_size=256)
+
+    queue.put(b"job")                   # or queue.put_many(jobs)
+    message = queue.get(timeout=5)      # or queue.get_many(n, timeout=5)
+    ... process message.data ...
+    queue.ack(message)                  # or queue.nack(message, delay=10)
+
+The messages wait in a Queue database, "<name>.queue".  Getting a
+message moves it, in the same transaction, to the "<name>.leases"
+Btree with the deadline of its lease, indexed by deadline in the
+"<name>.deadlines" secondary database.  A message not acknowledged
+within 'visibility_timeout' seconds is put back in the queue and
+delivered again, counting its 'attempts'; after 'max_attempts'
+deliveries it goes to the dead letter queue ("<name>.dead", read with
+get_dead()) instead.  Nothing is lost if a consumer crashes, and any
+number of threads and processes can share the queue through the same
+environment.
+
+get() and get_many() wait for messages with DB_CONSUME_WAIT.  Every
+consumer puts back the expired messages at most once every
+'reap_interval' seconds, even while waiting.  The environment should
+run deadlock detection, and use DB_TIME_NOTGRANTED so that waits timing
+out aren't taken for deadlocks.
+
+Run "python -m bsddb3.dbqueue [processes [messages]]" for a
+multiprocess throughput benchmark.
+"""
+
+import sys
+import struct
+from time import time as _time, sleep as _sleep
+
+absolute_import = (sys.version_info[0] >= 3)
+if absolute_import :
+    from . import db, dbutils
+else :
+    import db, dbutils
+
+DEFAULT_MAX_SIZE = 1024
+DEFAULT_VISIBILITY_TIMEOUT = 30.0
+DEFAULT_REAP_INTERVAL = 1.0
+# Queued records per extent file; consumed extents are removed
+DEFAULT_EXTENT_SIZE = 1024
+# Expired leases put back in the queue in a single transaction
+REAP_BATCH = 1000
+# Shortest wait for messages between two checks for expired leases
+_MIN_WAIT = 0.01
+
+# Queue records: data size and deliveries, then the data
+_record = struct.Struct(">II")
+# Leases: deadline and deliveries, then the data
+_lease = struct.Struct(">dI")
+_deadline = struct.Struct(">d")
+_id = struct.Struct(">I")
+
+def _lease_deadline(key, data):
+    # Big endian positive doubles sort as their value
+    return data[:_deadline.size]
+
+
+class Message(object):
+    """A message got from a WorkQueue: the 'id' of its lease, its 'data'
+    and the number of times it has been delivered, 'attempts'."""
+    __slots__ = ("id", "data", "attempts")
+
+    def __init__(self, id, data, attempts):
+        self.id = id
+        self.data = data
+        self.attempts = attempts
+
+    def __repr__(self):
+        return "<Message %d attempts=%d %r>" % (self.id, self.attempts,
+                                                self.data)
+
+
+class WorkQueue(object):
+    """A work queue stored in the transactional environment 'env'.
+
+    Messages are byte strings of up to 'max_size' bytes, fixed when the
+    queue is created.  The leases of
+    the messages got last 'visibility_timeout' seconds; a message given
+    'max_attempts' times without being acknowledged goes to the dead
+    letter queue (None means no limit).
+    """
+    def __init__(self, env, name, max_size=DEFAULT_MAX_SIZE,
+                 visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT,
+                 max_attempts=None, reap_interval=DEFAULT_REAP_INTERVAL,
+                 extent_size=DEFAULT_EXTENT_SIZE):
+        self.env = env
+        self.name = name
+        self.max_size = max_size
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.reap_interval = reap_interval
+        self._next_reap = 0
+        self._dbs = []
+        try:
+            re_len = _record.size + max_size
+            self.queue = self._open(name + ".queue", db.DB_QUEUE,
+                                    re_len, extent_size)
+            # An existing queue keeps its size
+            self.max_size = self.queue.get_re_len() - _record.size
+            self.dead = self._open(name + ".dead", db.DB_QUEUE,
+                                   re_len, extent_size)
+            self.leases = self._open(name + ".leases", db.DB_BTREE)
+            self.deadlines = self._open(name + ".deadlines", db.DB_BTREE,
+                                        dupsort=True)
+            txn = env.txn_begin()
+            try:
+                self.leases.associate(self.deadlines, _lease_deadline,
+                                      db.DB_CREATE, txn=txn)
+            except:
+                txn.abort()
+                raise
+            txn.commit()
+        except:
+            self.close()
+            raise
+
+    def _open(self, filename, dbtype, re_len=None, extent_size=None,
+              dupsort=False):
+        d = db.DB(self.env)
+        self._dbs.insert(0, d)
+        if re_len is not None:
+            d.set_re_len(re_len)
+        if extent_size:
+            d.set_q_extentsize(extent_size)
+        if dupsort:
+            d.set_flags(db.DB_DUPSORT)
+        d.open(filename, dbtype,
+               db.DB_CREATE | db.DB_THREAD | db.DB_AUTO_COMMIT)
+        return d
+
+    def close(self):
+        """Close the databases of the queue."""
+        # The secondary database first
+        for d in self._dbs:
+            d.close()
+        self._dbs = []
+
+    def _transaction(self, function, txn):
+        if txn is not None:
+            return function(txn)
+        return dbutils.DeadlockWrapTxn(self.env, function)
+
+    def _pack(self, data, attempts=0):
+        if len(data) > self.max_size:
+            raise ValueError("message longer than %d bytes" % self.max_size)
+        return _record.pack(len(data), attempts) + data
+
+    #----------------------------------------------
+    # Producers
+
+    def put(self, data, txn=None):
+        """Add a message to the queue."""
+        self.queue.append(self._pack(data), txn=txn)
+
+    def put_many(self, messages, txn=None):
+        """Add several messages to the queue in a single transaction."""
+        records = [self._pack(data) for data in messages]
+        def put(txn):
+            for record in records:
+                self.queue.append(record, txn=txn)
+        self._transaction(put, txn)
+
+    #----------------------------------------------
+    # Consumers
+
+    def get(self, timeout=None, visibility_timeout=None):
+        """Return the next message, or None if none arrived in 'timeout'
+        seconds (None waits forever, 0 doesn't wait)."""
+        messages = self.get_many(1, timeout, visibility_timeout)
+        if messages:
+            return messages[0]
+        return None
+
+    def get_many(self, n, timeout=None, visibility_timeout=None):
+        """Return a list of up to n messages, waiting up to 'timeout'
+        seconds for the first one (None waits forever, 0 doesn't wait).
+        Their leases last 'visibility_timeout' seconds, by default the
+        one of the queue."""
+        if visibility_timeout is None:
+            visibility_timeout = self.visibility_timeout
+        end = None
+        if timeout is not None:
+            end = _time() + timeout
+        while True:
+            self._reap()
+            # Wake up to put back the expired messages
+            wait = max(self.reap_interval, _MIN_WAIT)
+            if end is not None:
+                wait = min(wait, end - _time())
+                if wait < _MIN_WAIT:
+                    # Too close to the deadline to block in consume_many()
+                    wait = 0
+            messages = self._lease(n, wait, visibility_timeout)
+            if messages:
+                return messages
+            # None on a lock conflict, or if the wait timed out as a deadlock
+            now = _time()
+            if end is not None and now >= end:
+                return []
+            if messages is None or not wait:
+                # Didn't block: back off before trying again
+                pause = _MIN_WAIT
+                if end is not None:
+                    pause = min(pause, end - now)
+                _sleep(pause)
+
+    def _lease(self, n, wait, visibility_timeout):
+        txn = self.env.txn_begin()
+        try:
+            if wait > 0:
+                records = self.queue.consume_many(n, txn=txn, wait=True,
+                                                  timeout=wait)
+            else:
+                records = self.queue.consume_many(n, txn=txn)
+            deadline = _time() + visibility_timeout
+            messages = []
+            for recno, record in records:
+                size, attempts = _record.unpack_from(record)
+                data = record[_record.size:_record.size + size]
+                attempts += 1
+                self.leases.put(_id.pack(recno),
+                                _lease.pack(deadline, attempts) + data,
+                                txn=txn)
+                messages.append(Message(recno, data, attempts))
+        except (db.DBLockDeadlockError, db.DBLockNotGrantedError):
+            txn.abort()
+            return None
+        except:
+            txn.abort()
+            raise
+        txn.commit()
+        return messages
+
+    def _key(self, message):
+        if isinstance(message, Message):
+            message = message.id
+        return _id.pack(message)
+
+    def ack(self, message, txn=None):
+        """Remove for good a message, or message id, got from the queue.
+        Return False if its lease had expired and it was put back in the
+        queue."""
+        key = self._key(message)
+        def delete(txn):
+            try:
+                self.leases.delete(key, txn=txn)
+            except db.DBNotFoundError:
+                return False
+            return True
+        return self._transaction(delete, txn)
+
+    def nack(self, message, delay=0, txn=None):
+        """Give back a message, or message id, got from the queue, to be
+        delivered again in 'delay' seconds.  Return False if its lease
+        had expired and it was already put back in the queue."""
+        key = self._key(message)
+        def requeue(txn):
+            lease = self.leases.get(key, txn=txn, flags=db.DB_RMW)
+            if lease is None:
+                return False
+            deadline, attempts = _lease.unpack_from(lease)
+            data = lease[_lease.size:]
+            if delay > 0:
+                # Let the lease expire then
+                self.leases.put(key,
+                                _lease.pack(_time() + delay, attempts) + data,
+                                txn=txn)
+            else:
+                self.leases.delete(key, txn=txn)
+                self._requeue(data, attempts, txn)
+            return True
+        return self._transaction(requeue, txn)
+
+    def _requeue(self, data, attempts, txn):
+        if self.max_attempts is not None and attempts >= self.max_attempts:
+            self.dead.append(self._pack(data, attempts), txn=txn)
+        else:
+            self.queue.append(self._pack(data, attempts), txn=txn)
+
+    def _reap(self):
+        now = _time()
+        if now >= self._next_reap:
+            self._next_reap = now + self.reap_interval
+            self.requeue_expired()
+
+    def requeue_expired(self):
+        """Put back in the queue, or in the dead letter queue, the
+        messages whose lease has expired.  Return how many there were."""
+        limit = _deadline.pack(_time())
+        def requeue(txn):
+            expired = []
+            cursor = self.deadlines.cursor(txn)
+            try:
+                rec = cursor.pget(db.DB_FIRST)
+                while rec is not None and rec[0] <= limit and \
+                        len(expired) < REAP_BATCH:
+                    expired.append(rec[1:])
+                    rec = cursor.pget(db.DB_NEXT)
+            finally:
+                cursor.close()
+            for key, lease in expired:
+                deadline, attempts = _lease.unpack_from(lease)
+                self.leases.delete(key, txn=txn)
+                self._requeue(lease[_lease.size:], attempts, txn)
+            return len(expired)
+        return dbutils.DeadlockWrapTxn(self.env, requeue)
+
+    def get_dead(self, n=1, txn=None):
+        """Remove and return up to n messages from the dead letter
+        queue."""
+        messages = []
+        for recno, record in self.dead.consume_many(n, txn=txn):
+            size, attempts = _record.unpack_from(record)
+            data = record[_record.size:_record.size + size]
+            messages.append(Message(recno, data, attempts))
+        return messages
+
+    def stat(self):
+        """Return a dictionary with the number of messages 'queued', in
+        flight ('leased') and 'dead'."""
+        return {"queued": len(self.queue), "leased": len(self.leases),
+                "dead": len(self.dead)}
+
+
+#---------------------------------------------------------------------------
+# Benchmark
+
+def _benchmark_env(home):
+    env = db.DBEnv()
+    env.set_lk_detect(db.DB_LOCK_DEFAULT)
+    env.set_flags(db.DB_TIME_NOTGRANTED, True)
+    # Measure the queue, not the disk
+    env.set_flags(db.DB_TXN_WRITE_NOSYNC, True)
+    env.set_cachesize(0, 64 * 1024 * 1024)
+    env.open(home, db.DB_CREATE | db.DB_INIT_MPOOL | db.DB_INIT_LOCK |
+             db.DB_INIT_LOG | db.DB_INIT_TXN | db.DB_THREAD)
+    return env
+
+def _benchmark_producer(home, messages, batch, size, results):
+    env = _benchmark_env(home)
+    queue = WorkQueue(env, "benchmark", max_size=size)
+    data = b"x" * size
+    for i in range(0, messages, batch):
+        queue.put_many([data] * min(batch, messages - i))
+    results.put(("put", messages, _time()))
+    queue.close()
+    env.close()
+
+def _benchmark_consumer(home, batch, size, results):
+    env = _benchmark_env(home)
+    queue = WorkQueue(env, "benchmark", max_size=size)
+    count = 0
+    last = _time()
+    while True:
+        messages = queue.get_many(batch, timeout=2)
+        if not messages:
+            break
+        with dbutils.transactional(env) as txn:
+            for message in messages:
+                queue.ack(message, txn=txn)
+        count += len(messages)
+        last = _time()
+    results.put(("get", count, last))
+    queue.close()
+    env.close()
+
+def _benchmark(processes=4, messages=100000, batch=100, size=100):
+    import tempfile, shutil, multiprocessing
+    home = tempfile.mkdtemp()
+    try:
+        env = _benchmark_env(home)
+        WorkQueue(env, "benchmark", max_size=size).close()
+        results = multiprocessing.Queue()
+        workers = []
+        for i in range(processes):
+            workers.append(multiprocessing.Process(
+                target=_benchmark_producer,
+                args=(home, messages // processes, batch, size, results)))
+            workers.append(multiprocessing.Process(
+                target=_benchmark_consumer,
+                args=(home, batch, size, results)))
+        start = _time()
+        for worker in workers:
+            worker.start()
+        totals = {"put": 0, "get": 0}
+        ends = {"put": start, "get": start}
+        for worker in workers:
+            kind, count, end = results.get()
+            totals[kind] += count
+            ends[kind] = max(ends[kind], end)
+        for worker in workers:
+            worker.join()
+        for kind in ("put", "get"):
+            elapsed = max(ends[kind] - start, 1e-9)
+            print("%s %d messages of %d bytes in %.2f s: %d messages/s" %
+                  (kind, totals[kind], size, elapsed,
+                   totals[kind] / elapsed))
+        env.close()
+    finally:
+        shutil.rmtree(home)
+
+if __name__ == '__main__':
+    _benchmark(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,274 @@
+"""
+Copyright (c) 2008-2020, Jesus Cea Avion <jcea@jcea.es>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+    1. Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+    copyright notice, this list of conditions and the following
+    disclaimer in the documentation and/or other materials provided
+    with the distribution.
+
+    3. Neither the name of Jesus Cea Avion nor the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+    CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+    INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+    EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+    TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+    DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+    TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+    THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+    SUCH DAMAGE.
+    """
+
+
+"""
+Parallel scans of Btree databases.
+
+partition_ranges() splits the keys of a Btree database into ranges
+holding about the same number of records, using DB.key_range() to
+locate the boundaries without reading the records:
+
+    for start, stop in dbscan.partition_ranges(database, 8):
+        ...
+
+parallel_scan() reads every range with its own cursor, in a thread or
+in a process per range, and calls a function with an iterator over the
+(key, data) records of each range, returning the results in key order:
+
+    def total(records):
+        return sum(len(data) for key, data in records)
+
+    size = sum(dbscan.parallel_scan(database, total, 8))
+
+The records are read with DBCursor.next_many(), so the threads only
+hold the GIL to build the Python objects.  In a process, 'function'
+must be picklable, and the database is opened again read only, in the
+environment given.
+
+The boundaries are found by bisection over the keys seen as numbers, so
+they are only meaningful with the default byte order of the keys.
+"""
+
+import sys
+
+absolute_import = (sys.version_info[0] >= 3)
+if absolute_import :
+    from . import db
+else :
+    import db
+
+try:
+    import threading
+except ImportError:
+    # Python built without thread support
+    import dummy_threading as threading
+
+# Bytes read by every bulk fetch
+DEFAULT_BUFSIZE = 64 * 1024
+# Bisection steps to find every boundary
+_STEPS = 48
+
+
+def _key_to_number(key, length):
+    number = 0
+    for byte in bytearray(key.ljust(length, b"\0")):
+        number = (number << 8) | byte
+    return number
+
+def _number_to_key(number, length):
+    key = bytearray(length)
+    for i in range(length - 1, -1, -1):
+        key[i] = number & 0xff
+        number >>= 8
+    return bytes(key)
+
+
+def _edge(database, txn, last):
+    cursor = database.cursor(txn)
+    try:
+        try:
+            if last:
+                record = cursor.last()
+            else:
+                record = cursor.first()
+        except db.DBNotFoundError:
+            record = None
+    finally:
+        cursor.close()
+    return record and record[0]
+
+def _ceiling(cursor, key):
+    # The first key >= 'key', or None
+    try:
+        record = cursor.set_range(key)
+    except db.DBNotFoundError:
+        record = None
+    return record and record[0]
+
+
+def partition_ranges(database, n, txn=None):
+    """Split the keys of the Btree 'database' into at most 'n' ranges of
+    about the same number of records.  Return a list of (start, stop)
+    tuples, the range holding the keys from 'start' included to 'stop'
+    excluded.  The 'start' of the first range and the 'stop' of the last
+    one are None."""
+    if n < 1:
+        raise ValueError("n must be >= 1")
+    if database.get_type() != db.DB_BTREE:
+        raise TypeError("partition_ranges() needs a Btree database")
+    first = _edge(database, txn, False)
+    last = _edge(database, txn, True)
+    if first is None or first == last:
+        return [(None, None)]
+
+    # Some bytes past the longest key to split between close keys
+    length = max(len(first), len(last)) + 2
+    low = _key_to_number(first, length)
+    high = _key_to_number(last, length)
+    boundaries = []
+    cursor = database.cursor(txn)
+    try:
+        for i in range(1, n):
+            target = float(i) / n
+            lo, hi = low, high
+            for step in range(_STEPS):
+                if hi - lo <= 1:
+                    break
+                middle = (lo + hi) // 2
+                less = database.key_range(_number_to_key(middle, length),
+                                          txn=txn)[0]
+                if less < target:
+                    lo = middle
+                else:
+                    hi = middle
+            # Start the range at a key of the database
+            key = _ceiling(cursor, _number_to_key(hi, length).rstrip(b"\0"))
+            if key is None:
+                break
+            if key != first and (not boundaries or key > boundaries[-1]):
+                boundaries.append(key)
+            # The next boundaries are after this one
+            low = hi
+    finally:
+        cursor.close()
+
+    starts = [None] + boundaries
+    stops = boundaries + [None]
+    return list(zip(starts, stops))
+
+
+def scan_range(database, start=None, stop=None, txn=None,
+               bufsize=DEFAULT_BUFSIZE):
+    """Generate the (key, data) records of 'database' from the key
+    'start' included (the first one if None) to 'stop' excluded (the
+    last one if None), read in bulk fetches of 'bufsize' bytes."""
+    cursor = database.cursor(txn)
+    try:
+        if start is not None:
+            try:
+                record = cursor.set_range(start)
+            except db.DBNotFoundError:
+                record = None
+            if record is None or (stop is not None and record[0] >= stop):
+                return
+            yield record
+        while True:
+            records = cursor.next_many(bufsize, stop)
+            if not records:
+                return
+            for record in records:
+                yield record
+    finally:
+        cursor.close()
+
+
+def _scan_thread(database, function, ranges, i, bufsize, results, errors):
+    start, stop = ranges[i]
+    try:
+        results[i] = function(scan_range(database, start, stop,
+                                         bufsize=bufsize))
+    except Exception, e:
+        errors[i] = e
+
+def _scan_process(args):
+    home, filename, dbname, start, stop, function, bufsize = args
+    env = None
+    if home is not None:
+        env = db.DBEnv()
+        env.open(home, db.DB_JOINENV)
+    database = db.DB(env)
+    try:
+        database.open(filename, dbname, db.DB_UNKNOWN, db.DB_RDONLY)
+        return function(scan_range(database, start, stop, bufsize=bufsize))
+    finally:
+        database.close()
+        if env is not None:
+            env.close()
+
+def parallel_scan(database, function, n_workers=4, processes=False,
+                  env=None, ranges=None, bufsize=DEFAULT_BUFSIZE):
+    """Call 'function' with an iterator over the records of each of the
+    'ranges' of 'database' (by default, n_workers ranges given by
+    partition_ranges()) in 'n_workers' threads, or processes if
+    'processes' is true, and return the list of the results, in the
+    order of the ranges.
+
+    With threads, 'database' must have been opened with DB_THREAD.  With
+    processes, 'env' is the environment 'database' was opened in, if
+    any, and the processes join it.  The first exception raised by
+    'function' is raised again.
+    """
+    if ranges is None:
+        ranges = partition_ranges(database, n_workers)
+    if processes:
+        import multiprocessing
+        home = None
+        if env is not None:
+            home = env.db_home
+            if not isinstance(home, str):
+                home = home.decode(sys.getfilesystemencoding())
+        filename, dbname = database.get_dbname()
+        pool = multiprocessing.Pool(n_workers)
+        try:
+            return pool.map(_scan_process,
+                    [(home, filename, dbname, start, stop, function, bufsize)
+                     for start, stop in ranges])
+        finally:
+            pool.close()
+            pool.join()
+
+    results = [None] * len(ranges)
+    errors = [None] * len(ranges)
+    pending = list(range(len(ranges)))
+    lock = threading.Lock()
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                i = pending.pop(0)
+            _scan_thread(database, function, ranges, i, bufsize, results,
+                         errors)
+    threads = [threading.Thread(target=worker, name="dbscan.parallel_scan")
+               for i in range(min(n_workers, len(ranges)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for error in errors:
+        if error is not None:
+            raise error
+    return results
@@ -25,6 +25,9 @@
 # "from bsddb.dbutils import *"
 #
 from time import sleep as _sleep
+from time import time as _time
+import random as _random
+import functools as _functools
 
 import sys
 absolute_import = (sys.version_info[0] >= 3)
@@ -33,6 +36,12 @@ if absolute_import :
 else :
     import db
 
+try:
+    import threading as _threading
+except ImportError:
+    # Python built without thread support
+    import dummy_threading as _threading
+
 # always sleep at least N seconds between retrys
 _deadlock_MinSleepTime = 1.0/128
 # never sleep more than N seconds between retrys
@@ -42,6 +51,126 @@ _deadlock_MaxSleepTime = 3.14159
 # each retry
 _deadlock_VerboseFile = None
 
+# Process wide retry statistics, see deadlock_stats()
+_stats_lock = _threading.Lock()
+_stats = {}
+
+def reset_deadlock_stats():
+    """Set the counters returned by deadlock_stats() to zero."""
+    with _stats_lock:
+        _stats.update(deadlocks=0, retries=0, failures=0, sleep_time=0.0)
+
+reset_deadlock_stats()
+
+def deadlock_stats():
+    """Return a dictionary with the number of 'deadlocks' (exceptions
+    caught), 'retries' and 'failures' (given up after the last retry)
+    of DeadlockWrap() and DeadlockWrapTxn() in this process, and the
+    total 'sleep_time' in seconds spent waiting to retry."""
+    with _stats_lock:
+        return dict(_stats)
+
+def _count(**kwargs):
+    with _stats_lock:
+        for name, value in kwargs.items():
+            _stats[name] += value
+
+
+class RetryPolicy(object):
+    """How DeadlockWrap() and DeadlockWrapTxn() wait before retrying an
+    operation that failed with one of 'exceptions'.
+
+    The sleep time starts at 'min_sleep' seconds and is doubled after
+    each retry, up to 'max_sleep'.  'jitter' randomizes it, so threads
+    that deadlocked together don't retry at the same time:
+
+        None             no randomization
+        "full"           random between 0 and the doubled sleep time
+        "decorrelated"   random between 'min_sleep' and three times the
+                         previous sleep time, up to 'max_sleep'
+
+    The operation is retried up to 'max_retries' times (-1 means no
+    limit), as long as less than 'budget' seconds, if given, have gone by
+    since the first attempt; then the exception is reraised.  The sleep
+    times default to the module variables _deadlock_MinSleepTime and
+    _deadlock_MaxSleepTime.
+    """
+    def __init__(self, jitter="full", min_sleep=None, max_sleep=None,
+                 max_retries=-1, budget=None,
+                 exceptions=(db.DBLockDeadlockError,)):
+        if jitter not in (None, "full", "decorrelated"):
+            raise ValueError("unknown jitter %r" % (jitter,))
+        self.jitter = jitter
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self.max_retries = max_retries
+        self.budget = budget
+        self.exceptions = exceptions
+
+    def sleeps(self):
+        """Generate the successive sleep times."""
+        base = self.min_sleep
+        if base is None:
+            base = _deadlock_MinSleepTime
+        cap = self.max_sleep
+        if cap is None:
+            cap = _deadlock_MaxSleepTime
+        backoff = sleeptime = min(base, cap)
+        while True:
+            if self.jitter == "full":
+                sleeptime = _random.uniform(0, backoff)
+            elif self.jitter == "decorrelated":
+                sleeptime = min(cap, _random.uniform(base, sleeptime * 3))
+            else:
+                sleeptime = backoff
+            yield sleeptime
+            # exponential backoff in the sleep time
+            backoff = min(cap, backoff * 2)
+
+    def __call__(self, function, *args, **kwargs):
+        """Call function(*args, **kwargs), retrying it as needed, and
+        return its result."""
+        return self._run(function, args, kwargs)
+
+    def _run(self, function, args, kwargs, max_retries=None):
+        retries = _Retries(self, max_retries)
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except self.exceptions:
+                if not retries.wait():
+                    raise
+
+
+class _Retries(object):
+    """The retries left for an operation following a RetryPolicy."""
+    def __init__(self, policy, max_retries=None):
+        if max_retries is None:
+            max_retries = policy.max_retries
+        self.left = max_retries
+        self.budget = policy.budget
+        self.sleeps = policy.sleeps()
+        self.start = _time()
+
+    def wait(self):
+        """Called when the operation failed: sleep and return True if it
+        must be retried, return False to give up."""
+        sleeptime = next(self.sleeps)
+        if self.left == 0 or (self.budget is not None and
+                _time() + sleeptime - self.start > self.budget):
+            _count(deadlocks=1, failures=1)
+            return False
+        if _deadlock_VerboseFile:
+            _deadlock_VerboseFile.write(
+                'dbutils.DeadlockWrap: sleeping %1.3f\n' % sleeptime)
+        _sleep(sleeptime)
+        _count(deadlocks=1, retries=1, sleep_time=sleeptime)
+        self.left -= 1
+        return True
+
+# Policy used when none is given
+default_retry_policy = RetryPolicy()
+
 
 def DeadlockWrap(function, *_args, **_kwargs):
     """DeadlockWrap(function, *_args, **_kwargs) - automatically retries
@@ -53,30 +182,622 @@ def DeadlockWrap(function, *_args, **_kwargs):
 
     A 'max_retries' parameter may optionally be passed to prevent it
     from retrying forever (in which case the exception will be reraised).
+    A 'retry_policy' parameter may give a RetryPolicy to use instead of
+    default_retry_policy.
 
         d = DB(...)
         d.open(...)
         DeadlockWrap(d.put, "foo", data="bar")  # set key "foo" to "bar"
     """
-    sleeptime = _deadlock_MinSleepTime
-    max_retries = _kwargs.get('max_retries', -1)
-    if 'max_retries' in _kwargs:
-        del _kwargs['max_retries']
-    while True:
+    max_retries = _kwargs.pop('max_retries', None)
+    policy = _kwargs.pop('retry_policy', None) or default_retry_policy
+    return policy._run(function, _args, _kwargs, max_retries)
+
+
+def DeadlockWrapTxn(dbenv, function, *_args, **_kwargs):
+    """DeadlockWrapTxn(dbenv, function, *_args, **_kwargs) - calls
+    function(txn, *_args, **_kwargs) with a new transaction of dbenv,
+    committed when it returns, and returns its result.
+
+    If the function raises an exception the transaction is aborted.  If
+    it is a deadlock the whole function is run again, in a new
+    transaction, as DeadlockWrap() would do.  'max_retries' and
+    'retry_policy' are used as in DeadlockWrap(); 'parent' and
+    'txn_flags' are given to dbenv.txn_begin().
+
+        def transfer(txn, amount):
+            ...
+        DeadlockWrapTxn(dbenv, transfer, 100, max_retries=10)
+    """
+    max_retries = _kwargs.pop('max_retries', None)
+    policy = _kwargs.pop('retry_policy', None) or default_retry_policy
+    parent = _kwargs.pop('parent', None)
+    flags = _kwargs.pop('txn_flags', 0)
+    def attempt():
+        txn = dbenv.txn_begin(parent, flags)
         try:
-            return function(*_args, **_kwargs)
-        except db.DBLockDeadlockError:
-            if _deadlock_VerboseFile:
-                _deadlock_VerboseFile.write(
-                    'dbutils.DeadlockWrap: sleeping %1.3f\n' % sleeptime)
-            _sleep(sleeptime)
-            # exponential backoff in the sleep time
-            sleeptime *= 2
-            if sleeptime > _deadlock_MaxSleepTime:
-                sleeptime = _deadlock_MaxSleepTime
-            max_retries -= 1
-            if max_retries == -1:
+            result = function(txn, *_args, **_kwargs)
+        except:
+            txn.abort()
+            raise
+        txn.commit()
+        return result
+    return policy._run(attempt, (), {}, max_retries)
+
+
+# Transactions begun by transactional() in each thread
+_txn_local = _threading.local()
+
+def _txn_stack():
+    try:
+        return _txn_local.stack
+    except AttributeError:
+        _txn_local.stack = []
+        return _txn_local.stack
+
+
+class transactional(object):
+    """transactional(env, retries=-1, flags=0, parent=None, snapshot=False,
+    policy=None) - run code in a transaction of env, committed at the
+    end, or aborted if an exception is raised.
+
+    Used as a decorator, the function gets the transaction as its 'txn'
+    keyword argument.  If the call fails with DBLockDeadlockError or
+    DBLockNotGrantedError the transaction is aborted and the function
+    called again in a new one, up to 'retries' times (-1 means no limit),
+    sleeping as told by 'policy', a RetryPolicy:
+
+        @transactional(env, retries=10)
+        def transfer(src, dst, amount, txn=None):
+            ...
+
+    Used as a context manager it runs the block once.  To retry a block
+    iterate over it, using each attempt as a context manager:
+
+        with transactional(env) as txn:
+            ...
+
+        for attempt in transactional(env, retries=10):
+            with attempt as txn:
+                ...
+
+    A transaction begun while another one begun by transactional() in
+    the same env is running in the thread is its child, unless 'parent'
+    is given.  'flags' are given to env.txn_begin(); 'snapshot' adds
+    DB_TXN_SNAPSHOT, for transactions that only read databases opened
+    with DB_MULTIVERSION, and so never wait for writers.
+    """
+    def __init__(self, env, retries=-1, flags=0, parent=None,
+                 snapshot=False, policy=None):
+        self.env = env
+        self.retries = retries
+        self.flags = flags
+        if snapshot:
+            self.flags |= db.DB_TXN_SNAPSHOT
+        self.parent = parent
+        if policy is None:
+            policy = RetryPolicy(exceptions=(db.DBLockDeadlockError,
+                                             db.DBLockNotGrantedError))
+        self.policy = policy
+
+    def _begin(self):
+        stack = _txn_stack()
+        parent = self.parent
+        if parent is None:
+            for env, txn in reversed(stack):
+                if env is self.env:
+                    parent = txn
+                    break
+        txn = self.env.txn_begin(parent, self.flags)
+        stack.append((self.env, txn))
+        return txn
+
+    def _end(self, commit):
+        env, txn = _txn_stack().pop()
+        if commit:
+            txn.commit()
+        else:
+            txn.abort()
+
+    def __enter__(self):
+        return self._begin()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._end(exc_type is None)
+        return False
+
+    def __iter__(self):
+        retries = _Retries(self.policy, self.retries)
+        while True:
+            attempt = _TxnAttempt(self, retries)
+            yield attempt
+            if attempt.done:
+                return
+
+    def __call__(self, function):
+        @_functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            for attempt in self:
+                with attempt as txn:
+                    kwargs['txn'] = txn
+                    return function(*args, **kwargs)
+        return wrapper
+
+
+class _TxnAttempt(object):
+    def __init__(self, transaction, retries):
+        self._transaction = transaction
+        self._retries = retries
+        # No more attempts are needed unless this one fails and is retried
+        self.done = True
+
+    def __enter__(self):
+        return self._transaction._begin()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._transaction._end(exc_type is None)
+        if (exc_type is not None and
+                issubclass(exc_type, self._transaction.policy.exceptions) and
+                self._retries.wait()):
+            self.done = False
+            return True
+        return False
+
+
+class _GroupRequest(object):
+    def __init__(self, function, args, kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+        self.error = None
+        self.event = _threading.Event()
+
+    def finish(self, result, error):
+        self.result = result
+        self.error = error
+        self.event.set()
+
+
+class GroupCommit(object):
+    """Group the small transactions submitted by many threads, so that
+    they share the cost of flushing the log to disk.
+
+        group = GroupCommit(env, window=0.01)
+        group.put(d, key, data)     # returns when the write is durable
+        group.submit(function, *args, **kwargs)
+        group.close()
+
+    submit() runs function(txn, *args, **kwargs) and returns its result
+    once the transaction is on disk.  By default a background thread
+    runs the functions submitted during up to 'window' seconds, at most
+    'max_batch' of them, in a single transaction, each one in a child
+    transaction so that an exception only undoes its own writes; the
+    submitters are woken when that transaction is committed.
+
+    If 'nosync' is true every function runs in its own transaction, in
+    the submitting thread, committed with DB_TXN_WRITE_NOSYNC, and a
+    background thread flushes the log every 'window' seconds while
+    there are commits waiting for it.
+
+    Deadlocks are retried as told by 'policy', a RetryPolicy; in a group
+    the whole transaction is run again.
+    """
+    def __init__(self, env, window=0.005, max_batch=1000, nosync=False,
+                 policy=None):
+        self.env = env
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.nosync = nosync
+        self.policy = policy or default_retry_policy
+        self._cond = _threading.Condition()
+        self._closing = False
+        # The exception that stopped the background thread
+        self._failure = None
+        # Requests waiting to be run in a group
+        self._pending = []
+        # Number of commits done and known to be on disk, in nosync mode
+        self._committed = 0
+        self._flushed = 0
+        # nosync requests running, not committed yet
+        self._running = 0
+        # [first, last, error, waiters] for the commits whose flush failed
+        self._flush_errors = []
+        if nosync:
+            target = self._run_flusher
+        else:
+            target = self._run_groups
+        self._thread = _threading.Thread(target=target,
+                                         name="GroupCommit")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _check_open(self):
+        # Must be called with self._cond held
+        if self._failure is not None:
+            raise self._failure
+        if self._closing:
+            raise ValueError("GroupCommit is closed")
+
+    def submit(self, function, *args, **kwargs):
+        """Run function(txn, *args, **kwargs) and return its result when
+        its transaction is durable."""
+        if self.nosync:
+            with self._cond:
+                self._check_open()
+                self._running += 1
+            return self._submit_nosync(function, args, kwargs)
+        request = _GroupRequest(function, args, kwargs)
+        with self._cond:
+            self._check_open()
+            self._pending.append(request)
+            self._cond.notify()
+        request.event.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def put(self, d, key, data, flags=0):
+        """Store data under key in the database d."""
+        def put(txn):
+            return d.put(key, data, txn=txn, flags=flags)
+        return self.submit(put)
+
+    def delete(self, d, key):
+        """Remove key from the database d."""
+        def delete(txn):
+            return d.delete(key, txn=txn)
+        return self.submit(delete)
+
+    def close(self):
+        """Wait for the pending requests and stop the background
+        thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _stopped(self, error):
+        """Fail the requests still waiting when the background thread
+        dies of 'error', and the ones submitted later."""
+        with self._cond:
+            self._failure = error
+            self._closing = True
+            pending = self._pending
+            self._pending = []
+            self._cond.notify_all()
+        for request in pending:
+            request.finish(None, error)
+
+    #----------------------------------------------
+    # Groups of requests in a single transaction
+
+    def _run_groups(self):
+        cond = self._cond
+        try:
+            while True:
+                with cond:
+                    while not self._pending and not self._closing:
+                        cond.wait()
+                    if not self._pending:
+                        return
+                    # Let more requests arrive
+                    deadline = _time() + self.window
+                    while len(self._pending) < self.max_batch and \
+                            not self._closing:
+                        remaining = deadline - _time()
+                        if remaining <= 0:
+                            break
+                        cond.wait(remaining)
+                    group = self._pending[:self.max_batch]
+                    del self._pending[:self.max_batch]
+                self._commit_group(group)
+        except:
+            self._stopped(sys.exc_info()[1])
+            raise
+
+    def _commit_group(self, group):
+        def attempt():
+            txn = self.env.txn_begin()
+            results = []
+            try:
+                for request in group:
+                    child = self.env.txn_begin(txn)
+                    try:
+                        result = request.function(child, *request.args,
+                                                  **request.kwargs)
+                    except self.policy.exceptions:
+                        child.abort()
+                        raise
+                    except Exception, e:
+                        child.abort()
+                        results.append((request, None, e))
+                    else:
+                        child.commit()
+                        results.append((request, result, None))
+            except:
+                txn.abort()
+                raise
+            txn.commit()
+            return results
+        try:
+            results = self.policy._run(attempt, (), {})
+        except:
+            # Even KeyboardInterrupt or SystemExit, raised again once
+            # the submitters are told
+            error = sys.exc_info()[1]
+            for request in group:
+                request.finish(None, error)
+            if not isinstance(error, Exception):
                 raise
+            return
+        for request, result, error in results:
+            request.finish(result, error)
+
+    #----------------------------------------------
+    # DB_TXN_WRITE_NOSYNC commits and periodic log flushes
+
+    def _submit_nosync(self, function, args, kwargs):
+        def attempt():
+            txn = self.env.txn_begin(None, db.DB_TXN_WRITE_NOSYNC)
+            try:
+                result = function(txn, *args, **kwargs)
+            except:
+                txn.abort()
+                raise
+            txn.commit()
+            return result
+        cond = self._cond
+        try:
+            result = self.policy._run(attempt, (), {})
+        except:
+            with cond:
+                self._running -= 1
+                cond.notify_all()
+            raise
+        with cond:
+            self._running -= 1
+            self._committed += 1
+            ticket = self._committed
+            cond.notify_all()
+            while self._flushed < ticket:
+                if self._failure is not None:
+                    raise self._failure
+                cond.wait()
+            for failed in self._flush_errors:
+                first, last, error, waiters = failed
+                if first <= ticket <= last:
+                    # The last waiter of the range forgets it
+                    if waiters == 1:
+                        self._flush_errors.remove(failed)
+                    else:
+                        failed[3] -= 1
+                    raise error
+        return result
+
+    def _run_flusher(self):
+        cond = self._cond
+        try:
+            while True:
+                with cond:
+                    while self._flushed == self._committed:
+                        if self._closing and not self._running:
+                            return
+                        cond.wait()
+                if not self._closing:
+                    _sleep(self.window)
+                with cond:
+                    first = self._flushed + 1
+                    target = self._committed
+                try:
+                    self.env.log_flush()
+                    error = None
+                except:
+                    error = sys.exc_info()[1]
+                with cond:
+                    if error is not None:
+                        self._flush_errors.append([first, target, error,
+                                                   target - first + 1])
+                    self._flushed = target
+                    cond.notify_all()
+                if error is not None and not isinstance(error, Exception):
+                    raise error
+        except:
+            self._stopped(sys.exc_info()[1])
+            raise
+
+
+class SequenceAllocator(object):
+    """Hand out the values of the DBSequence 'sequence' from blocks of
+    'block_size' values reserved with DBSequence.get_block(), so that
+    most calls to get() don't reach Berkeley DB.
+
+        allocator = SequenceAllocator(sequence, block_size=10000)
+        value = allocator.get()
+        allocator.close()
+
+    A background thread reserves the next block, with 'flags' given to
+    get_block(), as soon as fewer than 'low_water' values (by default a
+    quarter of a block) are left in the current one.  The values
+    reserved but not handed out are lost when the allocator is closed,
+    like those cached by the sequence itself.
+
+    'refills' counts the blocks reserved and 'waits' the calls to get()
+    that had to wait for one.
+    """
+    def __init__(self, sequence, block_size=1000, low_water=None, flags=0):
+        if block_size < 1:
+            raise ValueError("block_size must be >= 1")
+        if low_water is None:
+            low_water = block_size // 4
+        self.sequence = sequence
+        self.block_size = block_size
+        self.low_water = max(1, low_water)
+        self.flags = flags
+        self.refills = 0
+        self.waits = 0
+        self._cond = _threading.Condition()
+        self._value = 0
+        self._step = 1
+        self._left = 0
+        # Block reserved in advance, as a (first, last) tuple
+        self._spare = None
+        self._wanted = True
+        self._error = None
+        self._closed = False
+        self._thread = _threading.Thread(target=self._refill,
+                                         name="SequenceAllocator")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get(self):
+        """Return the next value of the sequence."""
+        cond = self._cond
+        with cond:
+            waited = False
+            while not self._left:
+                if self._spare is not None:
+                    first, last = self._spare
+                    self._spare = None
+                    self._value = first
+                    self._step = last < first and -1 or 1
+                    self._left = abs(last - first) + 1
+                elif self._error is not None:
+                    error, self._error = self._error, None
+                    raise error
+                elif self._closed:
+                    raise ValueError("SequenceAllocator is closed")
+                else:
+                    if not waited:
+                        waited = True
+                        self.waits += 1
+                    self._wanted = True
+                    cond.notify_all()
+                    cond.wait()
+            value = self._value
+            self._value += self._step
+            self._left -= 1
+            if self._left < self.low_water and self._spare is None and \
+                    not self._wanted:
+                self._wanted = True
+                cond.notify_all()
+            return value
+
+    def _refill(self):
+        cond = self._cond
+        while True:
+            with cond:
+                while not self._wanted and not self._closed:
+                    cond.wait()
+                if self._closed:
+                    return
+            try:
+                block = self.sequence.get_block(self.block_size,
+                                                flags=self.flags)
+            except Exception, e:
+                block = None
+                error = e
+            with cond:
+                self._wanted = False
+                if block is None:
+                    self._error = error
+                else:
+                    self._spare = block
+                    self.refills += 1
+                cond.notify_all()
+
+    def close(self):
+        """Stop the background thread.  The sequence is left open."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def fill_factor(database, txn=None):
+    """Return the fraction of the leaf pages (bucket pages for Hash) of
+    the Btree, Recno or Hash 'database' used by data, or None if it has
+    none.  DB.stat() walks the whole database to compute it."""
+    stats = database.stat(txn=txn)
+    if "leaf_pgfree" in stats:
+        size = stats["leaf_pg"] * stats["pagesize"]
+        free = stats["leaf_pgfree"]
+    else:
+        size = stats["buckets"] * stats["pagesize"]
+        free = stats["bfree"]
+    if not size:
+        return None
+    return 1 - free / float(size)
+
+
+class Compactor(object):
+    """Compact 'database' a slice at a time with DB.compact_incremental(),
+    keeping the key where the next slice resumes in the open DB 'state'
+    under the key 'name', so the compaction goes on across runs and
+    processes:
+
+        compactor = Compactor(database, state)
+        # Every night
+        result = compactor.run(budget_pages=10000, budget_seconds=60)
+
+    When the whole database has been compacted the next run starts again
+    from the beginning.
+    """
+    def __init__(self, database, state, name=b"compact"):
+        self.database = database
+        self.state = state
+        self.name = name
+
+    def resume_key(self, txn=None):
+        """Return the key where the next run starts, or None for the
+        beginning of the database."""
+        value = self.state.get(self.name, txn=txn)
+        if value is None:
+            return None
+        if value[:1] == b"r":
+            return int(value[1:])
+        return value[1:]
+
+    def run(self, budget_pages=0, budget_seconds=0, fill=False, txn=None,
+            **kwargs):
+        """Compact the next slice, freeing at most about 'budget_pages'
+        pages or running about 'budget_seconds' seconds, and save where
+        the next run resumes.  Return the result of compact_incremental(),
+        with 'done' True if the end of the database was reached and, if
+        'fill' is true, the 'fill' factor of the database afterwards.
+        The other keyword arguments are given to compact_incremental()."""
+        result = self.database.compact_incremental(budget_pages,
+                budget_seconds, start=self.resume_key(txn=txn), txn=txn,
+                **kwargs)
+        key = result["next"]
+        if key is None:
+            try:
+                self.state.delete(self.name, txn=txn)
+            except db.DBNotFoundError:
+                pass
+        elif isinstance(key, bytes):
+            self.state.put(self.name, b"k" + key, txn=txn)
+        else:
+            self.state.put(self.name, ("r%d" % key).encode("ascii"),
+                           txn=txn)
+        result["done"] = key is None
+        if fill:
+            result["fill"] = fill_factor(self.database, txn=txn)
+        return result
 
 
 #------------------------------------------------------------------------
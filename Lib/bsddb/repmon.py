@@ -0,0 +1,343 @@
+"""
+Copyright (c) 2008-2020, Jesus Cea Avion <jcea@jcea.es>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+    1. Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+    copyright notice, this list of conditions and the following
+    disclaimer in the documentation and/or other materials provided
+    with the distribution.
+
+    3. Neither the name of Jesus Cea Avion nor the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+    CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+    INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+    EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+    TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+    DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+    TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+    THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+    SUCH DAMAGE.
+    """
+
+
+"""
+Replication lag and throughput monitor.
+
+DBEnv.rep_stat() and repmgr_stat() return counters accumulated since
+the environment was opened.  A Monitor samples them, together with
+repmgr_site_list(), for the sites of a replication group opened in this
+process and turns them into reports: the lag of every site behind the
+master, the rate of messages, log records and bulk transfers, and the
+duration of the elections held since the previous sample:
+
+    monitor = repmon.Monitor({"master": master_env,
+                              "replica": replica_env}, interval=1.0)
+    for report in monitor.reports():
+        print(report["sites"]["replica"]["lag"])
+
+or, from a background thread:
+
+    monitor.start(callback)
+    ...
+    monitor.stop()
+
+Every report is a dictionary with the 'time' of the sample, the
+'interval' since the previous one (None for the first), the name of
+the 'master' site (None if no monitored site is the master), the new
+'elections', a list of {"site", "duration", "won"} dictionaries, and
+the 'sites', a dictionary with, for every site:
+
+    "status"        "master", "client" or None.
+    "next_lsn"      The next LSN expected or written, a (file, offset)
+                    tuple, and "max_perm_lsn" the largest permanent LSN.
+    "lag"           The bytes of log behind the master, or None if the
+                    master is not monitored.
+    "stats"         The raw rep_stat() counters, with the repmgr_stat()
+                    ones prefixed by "repmgr." when the Replication
+                    Manager is used.
+    "name.rate"     The rate per second of every counter in RATES.
+    "remote"        The repmgr_site_list() of the site, a dictionary of
+                    (host, port, status) tuples by envid.
+
+The lag is computed from the LSNs, taking every log file as
+'log_size' bytes long (by default, the maximum log file size of the
+master), so it is exact only within the same log file.
+"""
+
+import sys
+import time
+
+absolute_import = (sys.version_info[0] >= 3)
+if absolute_import :
+    from . import db
+else :
+    import db
+
+try:
+    import threading
+except ImportError:
+    # Python built without thread support
+    import dummy_threading as threading
+
+# Counters whose rate is reported
+RATES = ("msgs_sent", "msgs_processed", "msgs_send_failures", "log_records",
+         "txns_applied", "bulk_fills", "bulk_transfers", "bulk_records",
+         "bulk_overflows", "nthrottles", "pg_records",
+         "repmgr.perm_failed", "repmgr.msgs_dropped",
+         "repmgr.connection_drop", "repmgr.connect_fail")
+
+
+def lsn_lag(ahead, behind, log_size):
+    """Return the bytes of log between the (file, offset) LSNs 'behind'
+    and 'ahead', or 0 if 'behind' is not behind."""
+    lag = (ahead[0] - behind[0]) * log_size + ahead[1] - behind[1]
+    return max(lag, 0)
+
+
+class Monitor(object):
+    """Sample the replication statistics of the DBEnv objects 'sites', a
+    dictionary of environments by name (or a single DBEnv, named
+    "local"), every 'interval' seconds.  'log_size' is the size assumed
+    for the log files when computing the lag.
+    """
+    def __init__(self, sites, interval=1.0, log_size=None):
+        if not isinstance(sites, dict):
+            sites = {"local": sites}
+        self.sites = sites
+        self.interval = interval
+        self.log_size = log_size
+        self._previous = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    #----------------------------------------------
+    # Sampling
+
+    def _read(self, env):
+        stats = env.rep_stat()
+        try:
+            repmgr = env.repmgr_stat()
+            remote = env.repmgr_site_list()
+        except db.DBError:
+            # The Replication Manager is not in use
+            repmgr = {}
+            remote = {}
+        for name, value in repmgr.items():
+            stats["repmgr." + name] = value
+        return stats, remote
+
+    def sample(self):
+        """Read the statistics of every site now and return the report."""
+        with self._lock:
+            now = time.time()
+            raw = {}
+            for name, env in self.sites.items():
+                raw[name] = self._read(env)
+            previous = self._previous
+            self._previous = (now, raw)
+
+        report = {"time": now, "interval": None, "master": None,
+                  "elections": [], "sites": {}}
+        if previous is not None:
+            report["interval"] = now - previous[0]
+        for name, (stats, remote) in raw.items():
+            if stats["status"] == db.DB_REP_MASTER:
+                status = "master"
+                report["master"] = name
+            elif stats["status"] == db.DB_REP_CLIENT:
+                status = "client"
+            else:
+                status = None
+            site = {"status": status, "stats": stats, "remote": remote,
+                    "next_lsn": stats["next_lsn"],
+                    "max_perm_lsn": stats["max_perm_lsn"], "lag": None}
+            report["sites"][name] = site
+            if previous is None or name not in previous[1]:
+                continue
+            before = previous[1][name][0]
+            interval = report["interval"]
+            for counter in RATES:
+                if counter not in stats:
+                    continue
+                delta = stats[counter] - before.get(counter, 0)
+                if delta < 0:
+                    # The counters were cleared since the previous sample
+                    delta = stats[counter]
+                if interval > 0:
+                    site[counter + ".rate"] = delta / float(interval)
+            if stats["elections"] != before["elections"]:
+                report["elections"].append({"site": name,
+                    "duration": stats["election_sec"] +
+                                stats["election_usec"] / 1e6,
+                    "won": stats["elections_won"] !=
+                           before["elections_won"]})
+
+        master = report["master"]
+        if master is not None:
+            log_size = self.log_size
+            if log_size is None:
+                log_size = self.sites[master].get_lg_max()
+            ahead = report["sites"][master]["next_lsn"]
+            for site in report["sites"].values():
+                site["lag"] = lsn_lag(ahead, site["next_lsn"], log_size)
+        return report
+
+    def reports(self, count=None):
+        """Generate a report every 'interval' seconds, 'count' of them
+        or forever."""
+        while count is None or count > 0:
+            yield self.sample()
+            if count is not None:
+                count -= 1
+                if not count:
+                    return
+            time.sleep(self.interval)
+
+    #----------------------------------------------
+    # Background sampling
+
+    def _run(self, callback):
+        while not self._stop.is_set():
+            callback(self.sample())
+            self._stop.wait(self.interval)
+
+    def start(self, callback):
+        """Call 'callback' with a new report every 'interval' seconds
+        from a background thread."""
+        if self._thread is not None:
+            raise RuntimeError("the monitor is already running")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(callback,),
+                                        name="repmon.Monitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+
+#---------------------------------------------------------------------------
+# Benchmark: python -m bsddb3.repmon [replicas [records]]
+#
+# A master and its replicas are opened in this process and connected as
+# in test_replication: every site has a queue of incoming messages and a
+# thread processing them.
+
+def _benchmark_site(home, envid, queues):
+    env = db.DBEnv()
+    env.set_flags(db.DB_TXN_WRITE_NOSYNC, True)
+    env.set_cachesize(0, 64 * 1024 * 1024)
+    env.open(home, db.DB_CREATE | db.DB_INIT_TXN | db.DB_INIT_LOG |
+             db.DB_INIT_MPOOL | db.DB_INIT_LOCK | db.DB_INIT_REP |
+             db.DB_RECOVER | db.DB_THREAD)
+
+    def transport(dbenv, control, rec, lsn, to, flags):
+        if to == db.DB_EID_BROADCAST:
+            for other, inbox in queues.items():
+                if other != envid:
+                    inbox.put((control, rec, envid))
+        else:
+            queues[to].put((control, rec, envid))
+    env.rep_set_transport(envid, transport)
+
+    def process():
+        import Queue
+        inbox = queues[envid]
+        while True:
+            message = inbox.get()
+            batch = []
+            while message is not None:
+                batch.append(message)
+                try:
+                    message = inbox.get_nowait()
+                except Queue.Empty:
+                    break
+            if batch:
+                env.rep_process_messages(batch)
+            if message is None:
+                return
+    thread = threading.Thread(target=process)
+    thread.daemon = True
+    thread.start()
+    return env, thread
+
+def _benchmark(replicas=2, records=20000, size=100):
+    import tempfile, shutil, Queue
+    homes = [tempfile.mkdtemp() for i in range(replicas + 1)]
+    queues = dict([(envid, Queue.Queue())
+                   for envid in range(1, replicas + 2)])
+    sites = {}
+    threads = []
+    try:
+        for envid, home in zip(sorted(queues), homes):
+            env, thread = _benchmark_site(home, envid, queues)
+            sites[envid == 1 and "master" or "replica%d" % (envid - 1,)] = env
+            threads.append(thread)
+        sites["master"].rep_start(flags=db.DB_REP_MASTER)
+        for name, env in sites.items():
+            if name != "master":
+                env.rep_start(flags=db.DB_REP_CLIENT)
+
+        monitor = Monitor(sites, interval=0.5)
+        def show(report):
+            for name in sorted(report["sites"]):
+                site = report["sites"][name]
+                print("%6.2f %-9s lag %9s msgs %8.0f/s bulk %6.0f/s" %
+                      (report["time"] - start, name, site["lag"],
+                       site.get("msgs_processed.rate", 0) +
+                       site.get("msgs_sent.rate", 0),
+                       site.get("bulk_transfers.rate", 0)))
+            for election in report["elections"]:
+                print("election on %(site)s: %(duration).3f s" % election)
+
+        start = time.time()
+        monitor.start(show)
+        d = db.DB(sites["master"])
+        d.open("benchmark", db.DB_BTREE, db.DB_CREATE | db.DB_AUTO_COMMIT)
+        data = b"x" * size
+        for i in range(records):
+            txn = sites["master"].txn_begin()
+            d.put(("%010d" % i).encode("ascii"), data, txn=txn)
+            txn.commit()
+        written = time.time()
+        d.close()
+        while max([site["lag"] for site in
+                   monitor.sample()["sites"].values()]):
+            time.sleep(0.01)
+        caught_up = time.time()
+        monitor.stop()
+        print("%d records written in %.2f s: %d records/s, replicas "
+              "caught up %.2f s later" % (records, written - start,
+              records / max(written - start, 1e-9), caught_up - written))
+    finally:
+        for inbox in queues.values():
+            inbox.put(None)
+        for thread in threads:
+            thread.join()
+        for env in sites.values():
+            env.close()
+        for home in homes:
+            shutil.rmtree(home)
+
+if __name__ == '__main__':
+    _benchmark(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,175 @@
+"""
+Copyright (c) 2008-2020, Jesus Cea Avion <jcea@jcea.es>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+    1. Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+    copyright notice, this list of conditions and the following
+    disclaimer in the documentation and/or other materials provided
+    with the distribution.
+
+    3. Neither the name of Jesus Cea Avion nor the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+    CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+    INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+    EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+            TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+            DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+    TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+    THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+    SUCH DAMAGE.
+    """
+
+"""
+TestCases for the asyncio front-end.
+"""
+
+import sys
+import unittest
+
+from test_all import db, dbshelve, test_support, verbose, \
+        get_new_environment_path
+
+try:
+    import asyncio
+    from bsddb3 import aio
+except (ImportError, SyntaxError):
+    aio = None
+
+#----------------------------------------------------------------------
+
+class AsyncTestCase(unittest.TestCase):
+    dbflags = db.DB_CREATE | db.DB_THREAD
+
+    def setUp(self):
+        if sys.version_info[0] >= 3 :
+            from test_all import do_proxy_db_py3k
+            self._flag_proxy_db_py3k = do_proxy_db_py3k(False)
+        self.homeDir = get_new_environment_path()
+        self.env = db.DBEnv()
+        self.env.open(self.homeDir, db.DB_CREATE | db.DB_INIT_MPOOL |
+                      db.DB_INIT_LOCK | db.DB_INIT_LOG | db.DB_INIT_TXN |
+                      db.DB_THREAD)
+        self.d = db.DB(self.env)
+        self.d.open("test.db", dbtype=db.DB_BTREE,
+                    flags=self.dbflags | db.DB_AUTO_COMMIT)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        if sys.version_info[0] >= 3 :
+            from test_all import do_proxy_db_py3k
+            do_proxy_db_py3k(self._flag_proxy_db_py3k)
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        self.d.close()
+        self.env.close()
+        test_support.rmtree(self.homeDir)
+
+    def run_async(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def mk(self, i):
+        return ("%04d" % i).encode("ascii")
+
+    def test01_get_put(self):
+        d = aio.AsyncDB(self.d)
+        self.run_async(asyncio.gather(
+            *[d.put(self.mk(i), self.mk(i * 2)) for i in range(200)]))
+        self.assertEqual(self.mk(84), self.run_async(d.get(self.mk(42))))
+        self.assertEqual([self.mk(2), None],
+                         self.run_async(d.get_many([self.mk(1), b"x"])))
+        self.run_async(d.put_many([(b"a", b"1"), (b"b", b"2")]))
+        self.assertEqual(b"2", self.d.get(b"b"))
+        self.assertRaises(db.DBNotFoundError, self.run_async,
+                          d.delete(b"x"))
+        self.assertEqual(202, len(self.d))
+
+    def test02_cursor(self):
+        for i in range(500):
+            self.d.put(self.mk(i), self.mk(i))
+        d = aio.AsyncDB(self.d)
+
+        for prefetch in (1, 7, 64, 1000):
+            cursor = d.cursor(prefetch=prefetch)
+            records = []
+            it = cursor.__aiter__()
+            while True:
+                try:
+                    records.append(self.run_async(it.__anext__()))
+                except StopAsyncIteration:
+                    break
+            self.run_async(cursor.close())
+            self.assertEqual([(self.mk(i), self.mk(i)) for i in range(500)],
+                             records)
+
+        cursor = d.cursor()
+        self.assertEqual((self.mk(10), self.mk(10)),
+                         self.run_async(cursor.set(self.mk(10))))
+        self.run_async(cursor.close())
+
+    def test03_txn(self):
+        d = aio.AsyncDB(self.d)
+        txn = self.run_async(aio.AsyncTxn.begin(self.env))
+        self.run_async(d.put(b"key", b"data", txn=txn))
+        self.run_async(txn.abort())
+        self.assertEqual(None, self.d.get(b"key"))
+
+        txn = self.run_async(aio.AsyncTxn.begin(self.env))
+        self.run_async(d.put(b"key", b"data", txn=txn))
+        self.run_async(txn.commit())
+        self.assertEqual(b"data", self.d.get(b"key"))
+
+        # Transactions given as positional arguments
+        txn = self.run_async(aio.AsyncTxn.begin(self.env))
+        self.run_async(d.put(b"key", b"other", txn))
+        self.assertEqual(b"other", self.run_async(d.get(b"key", None, txn)))
+        self.run_async(txn.commit())
+        self.assertEqual(b"other", self.d.get(b"key"))
+
+    def test04_shelf(self):
+        shelf = dbshelve.DBShelf(self.env)
+        shelf.open("shelf.db", dbtype=db.DB_HASH,
+                   flags=db.DB_CREATE | db.DB_AUTO_COMMIT)
+        try:
+            s = aio.AsyncShelf(shelf)
+            self.run_async(s.put(b"key", {"a": [1, 2]}))
+            self.assertEqual({"a": [1, 2]}, self.run_async(s.get(b"key")))
+            cursor = s.cursor()
+            self.assertEqual((b"key", {"a": [1, 2]}),
+                             self.run_async(cursor.first()))
+            self.run_async(cursor.close())
+        finally:
+            shelf.close()
+
+
+class AsyncNoThreadTestCase(AsyncTestCase):
+    # Without DB_THREAD every call is serialized
+    dbflags = db.DB_CREATE
+
+
+#----------------------------------------------------------------------
+
+def test_suite():
+    suite = unittest.TestSuite()
+    if aio is not None:
+        suite.addTest(unittest.makeSuite(AsyncTestCase))
+        suite.addTest(unittest.makeSuite(AsyncNoThreadTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -365,6 +365,254 @@ class EnvThreadHashShelveTestCase(BasicEnvShelveTestCase):
     dbflags = db.DB_CREATE | db.DB_THREAD
 
 
+#----------------------------------------------------------------------
+# test cases for a DBShelf using a SchemaCodec.
+
+class SchemaShelveTestCase(BasicShelveTestCase):
+    dbtype = db.DB_BTREE
+    dbflags = db.DB_CREATE
+
+    def setUp(self):
+        self.layoutsname = get_new_database_path()
+        BasicShelveTestCase.setUp(self)
+
+    def tearDown(self):
+        BasicShelveTestCase.tearDown(self)
+        test_support.unlink(self.layoutsname)
+
+    def do_open(self):
+        BasicShelveTestCase.do_open(self)
+        self.layouts = db.DB()
+        self.layouts.open(self.layoutsname, db.DB_BTREE, db.DB_CREATE)
+        self.d.codec = dbshelve.SchemaCodec(self.layouts)
+
+    def do_close(self):
+        self.d.close()
+        self.layouts.close()
+
+    def test05_schema(self):
+        if verbose:
+            print '\n', '-=' * 30
+            print "Running %s.test05_schema..." % self.__class__.__name__
+
+        d = self.d
+        for i in range(100):
+            d[self.mk('R%03d' % i)] = {'name': 'n%d' % i, 'size': i}
+        d[self.mk('Rorder')] = {'size': 1, 'name': 'order'}
+        d[self.mk('Rother')] = {1: 'not', 2: 'a layout'}
+        self.assertEqual(2, len(d.codec.layouts()))
+
+        self.do_close()
+        self.do_open()
+        d = self.d
+        self.assertEqual(2, len(d.codec.layouts()))
+        self.assertEqual({'name': 'n42', 'size': 42}, d[self.mk('R042')])
+        self.assertEqual({'size': 1, 'name': 'order'}, d[self.mk('Rorder')])
+        self.assertEqual({1: 'not', 2: 'a layout'}, d[self.mk('Rother')])
+        self.assertTrue(b'name' not in d.db[self.mk('R042')])
+
+        c = d.cursor()
+        key, value = c.set(self.mk('R007'))
+        self.assertEqual({'name': 'n7', 'size': 7}, value)
+        c.close()
+
+        # A second handle shares the layouts already stored
+        codec = dbshelve.SchemaCodec(self.layouts)
+        self.assertEqual(d.codec.layouts(), codec.layouts())
+        self.assertEqual(d.db[self.mk('R042')],
+                codec.dumps({'name': 'n42', 'size': 42}, d.protocol))
+
+
+#----------------------------------------------------------------------
+# test cases for a DBShelf using a CompressedCodec.
+
+class CompressedShelveTestCase(BasicShelveTestCase):
+    dbtype = db.DB_HASH
+    dbflags = db.DB_CREATE
+    method = "zlib"
+
+    def do_open(self):
+        BasicShelveTestCase.do_open(self)
+        # Compress everything, so all the basic tests go through it
+        self.d.codec = dbshelve.CompressedCodec(method=self.method,
+                                                threshold=0)
+
+    def test05_compression(self):
+        if verbose:
+            print '\n', '-=' * 30
+            print "Running %s.test05_compression..." % \
+                self.__class__.__name__
+
+        d = self.d
+        d.codec = dbshelve.CompressedCodec(method=self.method,
+                                           threshold=100)
+        big = 'spam' * 1000
+        d[self.mk('big')] = big
+        d[self.mk('small')] = 'eggs'
+        stats = d.codec.stats()
+        self.assertEqual(2, stats['records'])
+        self.assertEqual(1, stats['compressed'])
+        self.assertTrue(stats['ratio'] > 4)
+        self.assertTrue(len(d.db[self.mk('big')]) < len(big) // 4)
+
+        # Records written with or without compression stay readable
+        d.codec = dbshelve.PickleCodec()
+        d[self.mk('plain')] = big
+        d.codec = dbshelve.CompressedCodec(method="zlib")
+        self.assertEqual(big, d[self.mk('big')])
+        self.assertEqual('eggs', d[self.mk('small')])
+        self.assertEqual(big, d[self.mk('plain')])
+        c = d.cursor()
+        key, value = c.set(self.mk('big'))
+        self.assertEqual(big, value)
+        c.close()
+
+    def test06_stats_threads(self):
+        if verbose:
+            print '\n', '-=' * 30
+            print "Running %s.test06_stats_threads..." % \
+                self.__class__.__name__
+
+        from threading import Thread
+        codec = dbshelve.CompressedCodec(method=self.method, threshold=100)
+        def writer():
+            for i in range(500):
+                codec.dumps(['spam' * 50, 'eggs'][i % 2], 2)
+        threads = [Thread(target=writer) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = codec.stats()
+        self.assertEqual(2000, stats['records'])
+        self.assertEqual(1000, stats['compressed'])
+
+
+class BZ2CompressedShelveTestCase(CompressedShelveTestCase):
+    method = "bz2"
+
+
+#----------------------------------------------------------------------
+# test cases for DBShelf.create_index
+
+class IndexShelveTestCase(unittest.TestCase):
+    def setUp(self):
+        if sys.version_info[0] >= 3 :
+            from test_all import do_proxy_db_py3k
+            self._flag_proxy_db_py3k = do_proxy_db_py3k(False)
+        self.homeDir = get_new_environment_path()
+        self.env = db.DBEnv()
+        self.env.open(self.homeDir, db.DB_CREATE | db.DB_INIT_MPOOL)
+        self.d = dbshelve.DBShelf(self.env)
+        self.d.open("shelf.db", "values", db.DB_BTREE, db.DB_CREATE)
+
+    def tearDown(self):
+        if sys.version_info[0] >= 3 :
+            from test_all import do_proxy_db_py3k
+            do_proxy_db_py3k(self._flag_proxy_db_py3k)
+        self.d.close()
+        self.env.close()
+        test_support.rmtree(self.homeDir)
+
+    def mk(self, key):
+        if sys.version_info[0] < 3 :
+            return key
+        else :
+            return bytes(key, "iso8859-1")  # 8 bits
+
+    def populateDB(self):
+        for i in range(20):
+            self.d[self.mk('%02d' % i)] = {'n': i,
+                    'parity': ['even', 'odd'][i % 2],
+                    'address': {'city': 'c%d' % (i % 3)}}
+        self.d[self.mk('none')] = {'n': -1}
+        inst = DataClass()
+        inst.n = 100
+        inst.parity = 'even'
+        self.d[self.mk('instance')] = inst
+
+    def test01_index(self):
+        if verbose:
+            print '\n', '-=' * 30
+            print "Running %s.test01_index..." % self.__class__.__name__
+
+        self.populateDB()
+        parity = self.d.create_index("parity", "parity")
+        city = self.d.create_index("city", "address.city")
+        n = self.d.create_index("n", ["n"], unique=True)
+
+        c = parity.cursor()
+        key, value = c.set(dbshelve.index_key('even'))
+        self.assertEqual(11, c.count())
+        key, value = c.set(dbshelve.index_key('odd'))
+        self.assertEqual(10, c.count())
+        self.assertEqual(1, value['n'] % 2)
+        c.close()
+        self.assertEqual(21, len(parity))
+        self.assertEqual(20, len(city))
+        self.assertEqual({'city': 'c2'},
+                         city[dbshelve.index_key('c2')]['address'])
+        self.assertEqual(-1, n[dbshelve.index_key(-1)]['n'])
+        self.assertEqual(100, n[dbshelve.index_key(100)].n)
+
+        # New values are indexed as they are stored
+        self.d[self.mk('new')] = {'n': 1000, 'parity': 'odd'}
+        self.assertEqual(1000, n[dbshelve.index_key(1000)]['n'])
+        self.assertRaises(db.DBKeyExistError, self.d.put, self.mk('dup'),
+                          {'n': 1000})
+
+        # Integer keys sort numerically
+        c = n.cursor()
+        self.assertEqual(-1, c.first()[1]['n'])
+        self.assertEqual(1000, c.last()[1]['n'])
+        c.close()
+
+    def test02_index_schema(self):
+        if verbose:
+            print '\n', '-=' * 30
+            print "Running %s.test02_index_schema..." % \
+                self.__class__.__name__
+
+        layouts = db.DB(self.env)
+        layouts.open("shelf.db", "layouts", db.DB_BTREE, db.DB_CREATE)
+        try:
+            self.d.codec = dbshelve.SchemaCodec(layouts)
+            self.populateDB()
+            city = self.d.create_index("city", ("address", "city"))
+            c = city.cursor()
+            key, value = c.set(dbshelve.index_key('c0'))
+            self.assertEqual(7, c.count())
+            self.assertEqual(0, value['n'] % 3)
+            c.close()
+            self.d.close()
+        finally:
+            layouts.close()
+
+    def test03_index_unnamed(self):
+        if verbose:
+            print '\n', '-=' * 30
+            print "Running %s.test03_index_unnamed..." % \
+                self.__class__.__name__
+
+        # A shelf alone in its file keeps its indexes in another file
+        self.d.close()
+        self.d = dbshelve.open("plain.db", dbenv=self.env)
+        self.populateDB()
+        parity = self.d.create_index("parity", "parity")
+        self.assertEqual(11, len([v for k, v in parity.items()
+                                  if k == dbshelve.index_key('even')]))
+        self.assertTrue(os.path.exists(os.path.join(self.homeDir,
+                                                    "plain.db.parity.idx")))
+        self.d.close()
+
+        # The index is found again when the shelf is reopened
+        self.d = dbshelve.open("plain.db", dbenv=self.env)
+        parity = self.d.create_index("parity", "parity")
+        self.d[self.mk('new')] = {'n': 21, 'parity': 'odd'}
+        self.assertEqual(11, len([v for k, v in parity.items()
+                                  if k == dbshelve.index_key('odd')]))
+
+
 #----------------------------------------------------------------------
 # test cases for a DBShelf in a RECNO DB.
 
@@ -419,6 +667,10 @@ def test_suite():
     suite.addTest(unittest.makeSuite(EnvHashShelveTestCase))
     suite.addTest(unittest.makeSuite(EnvThreadBTreeShelveTestCase))
     suite.addTest(unittest.makeSuite(EnvThreadHashShelveTestCase))
+    suite.addTest(unittest.makeSuite(SchemaShelveTestCase))
+    suite.addTest(unittest.makeSuite(CompressedShelveTestCase))
+    suite.addTest(unittest.makeSuite(BZ2CompressedShelveTestCase))
+    suite.addTest(unittest.makeSuite(IndexShelveTestCase))
     suite.addTest(unittest.makeSuite(RecNoShelveTestCase))
 
     return suite
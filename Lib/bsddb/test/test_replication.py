@@ -376,15 +376,16 @@ class DBBaseReplication(DBReplication) :
         test_support.rmtree(self.homeDirClient)
         test_support.rmtree(self.homeDirMaster)
 
-    def basic_rep_threading(self) :
+    def basic_rep_threading(self, thread_do=None) :
         self.dbenvMaster.rep_start(flags=db.DB_REP_MASTER)
         self.dbenvClient.rep_start(flags=db.DB_REP_CLIENT)
 
-        def thread_do(env, q, envid, election_status, must_be_master) :
-            while True :
-                v=q.get()
-                if v is None : return
-                env.rep_process_message(v[0], v[1], envid)
+        if thread_do is None :
+            def thread_do(env, q, envid, election_status, must_be_master) :
+                while True :
+                    v=q.get()
+                    if v is None : return
+                    env.rep_process_message(v[0], v[1], envid)
 
         self.thread_do = thread_do
 
@@ -535,6 +536,183 @@ class DBBaseReplication(DBReplication) :
                 self.dbenvMaster.rep_get_clockskew())
         self.basic_rep_threading()
 
+    def test06_process_messages(self) :
+        results = []
+        def thread_do(env, q, envid, election_status, must_be_master) :
+            import Queue
+            while True :
+                v=q.get()
+                batch = []
+                while v is not None :
+                    batch.append((v[0], v[1], envid))
+                    try :
+                        v=q.get_nowait()
+                    except Queue.Empty :
+                        break
+                if batch :
+                    results.append(env.rep_process_messages(batch))
+                    self.assertEqual(len(batch), results[-1]["processed"])
+                if v is None : return
+
+        self.basic_rep_threading(thread_do)
+        import time
+        timeout = time.time()+10
+        while (time.time()<timeout) and not (self.confirmed_master and
+                self.client_startupdone) :
+            time.sleep(0.02)
+        self.assertTrue(time.time()<timeout)
+
+        self.dbMaster=db.DB(self.dbenvMaster)
+        txn=self.dbenvMaster.txn_begin()
+        self.dbMaster.open("test", db.DB_HASH, db.DB_CREATE, 0666, txn=txn)
+        txn.commit()
+
+        # The client acknowledges the permanent records
+        timeout = time.time()+10
+        while (time.time()<timeout) and \
+                not [r for r in results if r["isperm"] is not None] :
+            time.sleep(0.02)
+        self.assertTrue(time.time()<timeout)
+        self.assertEqual({"processed": 0, "newmaster": None,
+            "isperm": None, "notperm": None, "newsites": [],
+            "holdelection": False, "dupmaster": False,
+            "join_failure": False},
+            self.dbenvClient.rep_process_messages([]))
+        self.assertRaises(TypeError, self.dbenvClient.rep_process_messages,
+                [(1, 2)])
+
+        # A message without control data fails, the results of the
+        # messages before it come with the exception
+        try :
+            self.dbenvClient.rep_process_messages([(b"", b"", 0)])
+        except db.DBError, e :
+            self.assertEqual(0, e.result["processed"])
+            self.assertEqual(None, e.result["isperm"])
+        else :
+            self.fail("rep_process_messages() didn't fail")
+
+
+    def test07_monitor(self) :
+        from bsddb3 import repmon
+        self.assertEqual(0, repmon.lsn_lag((1, 100), (1, 100), 1000))
+        self.assertEqual(50, repmon.lsn_lag((1, 150), (1, 100), 1000))
+        self.assertEqual(1050, repmon.lsn_lag((2, 150), (1, 100), 1000))
+        self.assertEqual(0, repmon.lsn_lag((1, 100), (1, 150), 1000))
+
+        self.basic_rep_threading()
+        import time
+        timeout = time.time()+10
+        while (time.time()<timeout) and not (self.confirmed_master and
+                self.client_startupdone) :
+            time.sleep(0.02)
+        self.assertTrue(time.time()<timeout)
+
+        monitor = repmon.Monitor({"master": self.dbenvMaster,
+            "client": self.dbenvClient}, interval=0.05)
+        reports = []
+        monitor.start(reports.append)
+        self.dbMaster=db.DB(self.dbenvMaster)
+        txn=self.dbenvMaster.txn_begin()
+        self.dbMaster.open("test", db.DB_HASH, db.DB_CREATE, 0666, txn=txn)
+        txn.commit()
+        for i in range(100) :
+            txn=self.dbenvMaster.txn_begin()
+            self.dbMaster.put("%d" % i, "x"*100, txn=txn)
+            txn.commit()
+
+        # The client catches up
+        timeout = time.time()+10
+        while (time.time()<timeout) and \
+                monitor.sample()["sites"]["client"]["lag"] :
+            time.sleep(0.02)
+        self.assertTrue(time.time()<timeout)
+        monitor.stop()
+
+        self.assertTrue(len(reports) > 1)
+        report = reports[-1]
+        self.assertEqual("master", report["master"])
+        self.assertTrue(report["interval"] > 0)
+        self.assertEqual("master", report["sites"]["master"]["status"])
+        self.assertEqual("client", report["sites"]["client"]["status"])
+        self.assertEqual(0, report["sites"]["master"]["lag"])
+        self.assertTrue("msgs_sent.rate" in report["sites"]["master"])
+        self.assertTrue("msgs_processed.rate" in report["sites"]["client"])
+        self.assertTrue([r for r in reports
+            if r["sites"]["master"].get("msgs_sent.rate")])
+        self.assertEqual(None, reports[0]["interval"])
+        self.assertEqual([], reports[0]["elections"])
+
+        for report in monitor.reports(2) :
+            self.assertEqual(0, report["sites"]["client"]["lag"])
+
+
+class DBFdReplication(DBBaseReplication) :
+    # The same tests, with the messages written to pipes by the native
+    # transport, read in batches and put in the queues.
+    def setUp(self) :
+        DBBaseReplication.setUp(self)
+        from bsddb3 import reptransport
+        self.pipes = []
+        self.pumps = []
+        for env, envid, q in ((self.dbenvMaster, 13, self.m2c),
+                              (self.dbenvClient, 3, self.c2m)) :
+            r, w = os.pipe()
+            self.pipes.append((r, w))
+            env.rep_set_transport_fd(envid, w)
+            def pump(reader=reptransport.FrameReader(r), q=q) :
+                for batch in reader :
+                    for control, rec, lsn, envid, flags in batch :
+                        q.put((control, rec))
+            from threading import Thread
+            t = Thread(target=pump)
+            t.daemon = True
+            t.start()
+            self.pumps.append(t)
+
+    def tearDown(self) :
+        def dummy(*args) :
+            pass
+        self.dbenvMaster.rep_set_transport(13, dummy)
+        self.dbenvClient.rep_set_transport(3, dummy)
+        for r, w in self.pipes :
+            os.close(w)
+        for t in self.pumps :
+            t.join()
+        for r, w in self.pipes :
+            os.close(r)
+        DBBaseReplication.tearDown(self)
+
+    def test05_frames(self) :
+        from bsddb3 import reptransport
+        frames = reptransport.make_frame(b"control", b"", (1, 28), 3, 0) + \
+                reptransport.make_frame(b"", b"record", (2, 0),
+                        db.DB_EID_BROADCAST, db.DB_REP_PERMANENT)
+        self.assertEqual([(b"control", b"", (1, 28), 3, 0),
+                (b"", b"record", (2, 0), db.DB_EID_BROADCAST,
+                    db.DB_REP_PERMANENT)],
+                list(reptransport.split_frames(frames)))
+        self.assertRaises(ValueError, list,
+                reptransport.split_frames(frames[:-1]))
+
+        r, w = os.pipe()
+        try :
+            reader = reptransport.FrameReader(r)
+            self.assertEqual(b"", reader.read_raw(timeout=0))
+            os.write(w, frames[:10])
+            self.assertEqual([], reader.read_batch(timeout=0.1))
+            os.write(w, frames[10:])
+            self.assertEqual(frames, reader.read_raw())
+            os.write(w, frames[:-1])
+            os.close(w)
+            w = None
+            self.assertEqual(frames[:31], reader.read_raw())
+            self.assertRaises(ValueError, reader.read_raw)
+        finally :
+            if w is not None :
+                os.close(w)
+            os.close(r)
+
+
 #----------------------------------------------------------------------
 
 def test_suite():
@@ -552,6 +730,8 @@ def test_suite():
 
     if have_threads :
         suite.addTest(unittest.makeSuite(DBBaseReplication))
+        if hasattr(os, "pipe") :
+            suite.addTest(unittest.makeSuite(DBFdReplication))
 
     return suite
 
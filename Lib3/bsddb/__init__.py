@@ -64,7 +64,12 @@ error = db.DBError  # So bsddb.error will mean something...
 
 import sys, os
 
-from weakref import ref
+try:
+    import threading
+except ImportError:
+    # Python built without thread support
+    import dummy_threading as threading
+from weakref import ref, WeakSet
 
 if (sys.version_info[0] >= 3):
     from collections.abc import MutableMapping
@@ -73,50 +78,84 @@ else:
 
 class _iter_mixin(MutableMapping):
     def _make_iter_cursor(self):
-        cur = _DeadlockWrap(self.db.cursor)
+        # Must be called with self._lock held
+        cursors = self._thread_cursors()
+        cur = _DeadlockWrap(cursors.dbc.dup)
         key = id(cur)
-        self._cursor_refs[key] = ref(cur, self._gen_cref_cleaner(key))
+        cursors.refs[key] = ref(cur, cursors.gen_cref_cleaner(key))
         return cur
 
-    def _gen_cref_cleaner(self, key):
-        # use generate the function for the weakref callback here
-        # to ensure that we do not hold a strict reference to cur
-        # in the callback.
-        return lambda ref: self._cursor_refs.pop(key, None)
+    def _iter_step(self, cur, move, key, args):
+        """Move the iteration cursor 'cur' with 'move', reopening and
+        repositioning it on 'key' if a write in another thread closed
+        it.  Return the new cursor and the record."""
+        with self._lock:
+            if self._kill_iteration:
+                raise RuntimeError('Database changed size '
+                                   'during iteration.')
+            try:
+                return cur, _DeadlockWrap(move(cur), *args)
+            except _db.DBCursorClosedError:
+                if self.db is None:
+                    raise
+                cur = self._make_iter_cursor()
+                _DeadlockWrap(cur.set, key,0,0,0)
+                return cur, _DeadlockWrap(move(cur), *args)
+
+    def _snapshot_iter(self, keys_only):
+        # The snapshot transaction takes no locks, so concurrent writes
+        # neither wait for the cursor nor close it, and no deadlock is
+        # possible.  Old versions of the pages it reads are kept in the
+        # cache until the iteration ends.
+        txn = self.dbenv.txn_begin(flags=_db.DB_TXN_SNAPSHOT)
+        try:
+            cur = self.db.cursor(txn)
+            try:
+                if keys_only:
+                    args = (0,0,0)
+                else:
+                    args = ()
+                move = cur.first
+                while 1:
+                    try:
+                        rec = move(*args)
+                    except _db.DBNotFoundError:
+                        break
+                    if keys_only:
+                        yield rec[0]
+                    else:
+                        yield rec
+                    move = getattr(cur, "next")
+            finally:
+                cur.close()
+        finally:
+            txn.commit()
 
     def __iter__(self):
+        if self._snapshot:
+            for key in self._snapshot_iter(True):
+                yield key
+            return
         self._kill_iteration = False
         self._in_iter += 1
         try:
             try:
-                cur = self._make_iter_cursor()
-
-                # FIXME-20031102-greg: race condition.  cursor could
-                # be closed by another thread before this call.
-
-                # since we're only returning keys, we call the cursor
-                # methods with flags=0, dlen=0, dofs=0
-                key = _DeadlockWrap(cur.first, 0,0,0)[0]
+                with self._lock:
+                    cur = self._make_iter_cursor()
+                    # since we're only returning keys, we call the cursor
+                    # methods with flags=0, dlen=0, dofs=0
+                    key = _DeadlockWrap(cur.first, 0,0,0)[0]
                 yield key
 
-                next = getattr(cur, "next")
+                move = lambda cur: getattr(cur, "next")
                 while 1:
-                    try:
-                        key = _DeadlockWrap(next, 0,0,0)[0]
-                        yield key
-                    except _db.DBCursorClosedError:
-                        if self._kill_iteration:
-                            raise RuntimeError('Database changed size '
-                                               'during iteration.')
-                        cur = self._make_iter_cursor()
-                        # FIXME-20031101-greg: race condition.  cursor could
-                        # be closed by another thread before this call.
-                        _DeadlockWrap(cur.set, key,0,0,0)
-                        next = getattr(cur, "next")
+                    cur, rec = self._iter_step(cur, move, key, (0,0,0))
+                    key = rec[0]
+                    yield key
             except _db.DBNotFoundError:
                 pass
             except _db.DBCursorClosedError:
-                # the database was modified during iteration.  abort.
+                # the database was closed during iteration.  abort.
                 pass
         finally :
             self._in_iter -= 1
@@ -124,101 +163,173 @@ class _iter_mixin(MutableMapping):
     def iteritems(self):
         if not self.db:
             return
+        if self._snapshot:
+            for kv in self._snapshot_iter(False):
+                yield kv
+            return
         self._kill_iteration = False
         self._in_iter += 1
         try:
             try:
-                cur = self._make_iter_cursor()
-
-                # FIXME-20031102-greg: race condition.  cursor could
-                # be closed by another thread before this call.
-
-                kv = _DeadlockWrap(cur.first)
+                with self._lock:
+                    cur = self._make_iter_cursor()
+                    kv = _DeadlockWrap(cur.first)
                 key = kv[0]
                 yield kv
 
-                next = getattr(cur, "next")
+                move = lambda cur: getattr(cur, "next")
                 while 1:
-                    try:
-                        kv = _DeadlockWrap(next)
-                        key = kv[0]
-                        yield kv
-                    except _db.DBCursorClosedError:
-                        if self._kill_iteration:
-                            raise RuntimeError('Database changed size '
-                                               'during iteration.')
-                        cur = self._make_iter_cursor()
-                        # FIXME-20031101-greg: race condition.  cursor could
-                        # be closed by another thread before this call.
-                        _DeadlockWrap(cur.set, key,0,0,0)
-                        next = getattr(cur, "next")
+                    cur, kv = self._iter_step(cur, move, key, ())
+                    key = kv[0]
+                    yield kv
             except _db.DBNotFoundError:
                 pass
             except _db.DBCursorClosedError:
-                # the database was modified during iteration.  abort.
+                # the database was closed during iteration.  abort.
                 pass
         finally :
             self._in_iter -= 1
 
 
+class _ThreadCursors(object):
+    """The cursors used by one thread on a _DBWithCursor.
+
+    The iteration cursors are duplicates of dbc, so they all share its
+    locker: writes done by the thread through another duplicate don't
+    wait for the locks held by its own cursors.
+    """
+    def __init__(self):
+        # dbc is the cursor used to implement the
+        # first/next/previous/last/set_location methods.
+        self.dbc = None
+        self.saved_dbc_key = None
+        # the iteration cursors duplicated from dbc
+        self.refs = {}
+
+    def gen_cref_cleaner(self, key):
+        # use generate the function for the weakref callback here
+        # to ensure that we do not hold a strict reference to cur
+        # in the callback.  Neither to self, so the cursors of a thread
+        # are freed, and closed, as soon as it ends.
+        selfref = ref(self)
+        def cleaner(cref):
+            cursors = selfref()
+            if cursors is not None:
+                cursors.refs.pop(key, None)
+        return cleaner
+
+    def close(self, save=1):
+        for cref in list(self.refs.values()):
+            c = cref()
+            if c is not None:
+                _DeadlockWrap(c.close)
+        self.refs.clear()
+        if self.dbc is not None:
+            c = self.dbc
+            self.dbc = None
+            if save and self.saved_dbc_key is None:
+                try:
+                    self.saved_dbc_key = _DeadlockWrap(c.current, 0,0,0)[0]
+                except db.DBError:
+                    pass
+            _DeadlockWrap(c.close)
+
+
 class _DBWithCursor(_iter_mixin):
     """
     A simple wrapper around DB that makes it look like the bsddbobject in
     the old module.  It uses a cursor as needed to provide DB traversal.
     """
-    def __init__(self, db):
+    def __init__(self, db, dbenv=None):
         self.db = db
         self.db.set_get_returns_none(0)
-
-        # FIXME-20031101-greg: I believe there is still the potential
-        # for deadlocks in a multithreaded environment if someone
-        # attempts to use the any of the cursor interfaces in one
-        # thread while doing a put or delete in another thread.  The
-        # reason is that _checkCursor and _closeCursors are not atomic
-        # operations.  Doing our own locking around self.dbc,
-        # self.saved_dbc_key and self._cursor_refs could prevent this.
-        # TODO: A test case demonstrating the problem needs to be written.
-
-        # self.dbc is a DBCursor object used to implement the
-        # first/next/previous/last/set_location methods.
-        self.dbc = None
-        self.saved_dbc_key = None
-
-        # a collection of all DBCursor objects currently allocated
-        # by the _iter_mixin interface.
-        self._cursor_refs = {}
+        # If db was opened with DB_MULTIVERSION in the transactional
+        # environment dbenv, iterations read a snapshot of the database
+        # taken when they start.
+        self.dbenv = dbenv
+        self._snapshot = (dbenv is not None and
+                bool(db.get_open_flags() & _db.DB_MULTIVERSION))
+
+        # The database is opened with DB_INIT_LOCK and DB_THREAD to be
+        # thread safe, so a positioned cursor holds a lock that makes
+        # the writes done with another locker wait.  Every thread gets
+        # its own cursors (see _ThreadCursors) and writes through them,
+        # unless the writes are transactional (see _writeCursor).  A
+        # write closes the cursors of the other threads, saving their
+        # position, and they are reopened and repositioned when used
+        # again.  self._lock serializes the cursor operations with the
+        # writes, so a cursor is never closed while another thread is
+        # using it; plain reads don't take it.
+        self._lock = threading.RLock()
+        # The _ThreadCursors of each thread are only referenced by its
+        # thread local storage, so they are closed when the thread ends.
+        self._local = threading.local()
+        self._cursors = WeakSet()  # every thread's _ThreadCursors
+        # Writes in a transactional database are done with the DB handle,
+        # as auto-committed transactions.
+        self._cursor_writes = (db.get_type() != _db.DB_RECNO and
+                               not (dbenv is not None and
+                                    _envflags(dbenv)))
         self._in_iter = 0
         self._kill_iteration = False
 
     def __del__(self):
         self.close()
 
+    def _thread_cursors(self):
+        # Must be called with self._lock held
+        cursors = getattr(self._local, "cursors", None)
+        if cursors is None:
+            cursors = self._local.cursors = _ThreadCursors()
+            self._cursors.add(cursors)
+        if cursors.dbc is None:
+            cursors.dbc = _DeadlockWrap(self.db.cursor)
+        return cursors
+
     def _checkCursor(self):
-        if self.dbc is None:
-            self.dbc = _DeadlockWrap(self.db.cursor)
-            if self.saved_dbc_key is not None:
-                _DeadlockWrap(self.dbc.set, self.saved_dbc_key)
-                self.saved_dbc_key = None
-
-    # This method is needed for all non-cursor DB calls to avoid
-    # Berkeley DB deadlocks (due to being opened with DB_INIT_LOCK
-    # and DB_THREAD to be thread safe) when intermixing database
-    # operations that use the cursor internally with those that don't.
+        # Must be called with self._lock held
+        cursors = self._thread_cursors()
+        if cursors.saved_dbc_key is not None:
+            key = cursors.saved_dbc_key
+            cursors.saved_dbc_key = None
+            _DeadlockWrap(cursors.dbc.set, key,0,0,0)
+        return cursors.dbc
+
+    def _cursorCall(self, name, *args):
+        self._checkOpen()
+        with self._lock:
+            return _DeadlockWrap(getattr(self._checkCursor(), name), *args)
+
     def _closeCursors(self, save=1):
-        if self.dbc:
-            c = self.dbc
-            self.dbc = None
-            if save:
-                try:
-                    self.saved_dbc_key = _DeadlockWrap(c.current, 0,0,0)[0]
-                except db.DBError:
-                    pass
-            _DeadlockWrap(c.close)
-            del c
-        for cref in list(self._cursor_refs.values()):
-            c = cref()
-            if c is not None:
-                _DeadlockWrap(c.close)
+        for cursors in list(self._cursors):
+            cursors.close(save)
+
+    def _writeCursor(self):
+        """Close the cursors of the other threads and return a cursor
+        sharing the locker of this thread's cursors, or None if the
+        write must be done with the DB handle.  This is needed to avoid
+        Berkeley DB deadlocks when intermixing database operations that
+        use the cursors with those that don't.
+
+        Only the cursors of the writing thread survive the write, and
+        only when it is done through a cursor: in a transactional
+        environment, and in Recno databases, the write is done with
+        the DB handle and closes them too.  The closed cursors are
+        reopened and repositioned when used again, so threads that
+        keep both reading with cursors and writing still pay for that.
+        Cursors already closed by a previous write cost nothing."""
+        # Must be called with self._lock held
+        mine = getattr(self._local, "cursors", None)
+        for cursors in list(self._cursors):
+            if cursors is not mine:
+                cursors.close()
+        cursors = mine
+        if cursors is None or cursors.dbc is None:
+            return None
+        if not self._cursor_writes:
+            cursors.close()
+            return None
+        return _DeadlockWrap(cursors.dbc.dup)
 
     def _checkOpen(self):
         if self.db is None:
@@ -242,31 +353,51 @@ class _DBWithCursor(_iter_mixin):
 
     def __setitem__(self, key, value):
         self._checkOpen()
-        self._closeCursors()
-        if self._in_iter and key not in self:
-            self._kill_iteration = True
-        def wrapF():
-            self.db[key] = value
-        _DeadlockWrap(wrapF)  # self.db[key] = value
+        with self._lock:
+            if self._in_iter and key not in self:
+                self._kill_iteration = True
+            c = self._writeCursor()
+            if c is None:
+                def wrapF():
+                    self.db[key] = value
+            else:
+                def wrapF():
+                    c.put(key, value, db.DB_KEYLAST)
+            try:
+                _DeadlockWrap(wrapF)  # self.db[key] = value
+            finally:
+                if c is not None:
+                    _DeadlockWrap(c.close)
 
     def __delitem__(self, key):
         self._checkOpen()
-        self._closeCursors()
-        if self._in_iter and key in self:
-            self._kill_iteration = True
-        def wrapF():
-            del self.db[key]
-        _DeadlockWrap(wrapF)  # del self.db[key]
+        with self._lock:
+            if self._in_iter and key in self:
+                self._kill_iteration = True
+            c = self._writeCursor()
+            if c is None:
+                def wrapF():
+                    del self.db[key]
+            else:
+                def wrapF():
+                    # Position the cursor without reading the data
+                    c.set(key, 0,0,0)
+                    c.delete()
+            try:
+                _DeadlockWrap(wrapF)  # del self.db[key]
+            finally:
+                if c is not None:
+                    _DeadlockWrap(c.close)
 
     def close(self):
-        self._closeCursors(save=0)
-        if self.dbc is not None:
-            _DeadlockWrap(self.dbc.close)
         v = 0
-        if self.db is not None:
-            v = _DeadlockWrap(self.db.close)
-        self.dbc = None
-        self.db = None
+        with self._lock:
+            self._closeCursors(save=0)
+            self._cursors.clear()
+            self._local = threading.local()
+            if self.db is not None:
+                v = _DeadlockWrap(self.db.close)
+            self.db = None
         return v
 
     def keys(self):
@@ -278,40 +409,30 @@ class _DBWithCursor(_iter_mixin):
         return _DeadlockWrap(self.db.has_key, key)
 
     def set_location(self, key):
-        self._checkOpen()
-        self._checkCursor()
-        return _DeadlockWrap(self.dbc.set_range, key)
+        return self._cursorCall("set_range", key)
 
     def __next__(self):  # Renamed by "2to3"
-        self._checkOpen()
-        self._checkCursor()
-        rv = _DeadlockWrap(getattr(self.dbc, "next"))
-        return rv
+        return self._cursorCall("next")
 
     if sys.version_info[0] >= 3 :  # For "2to3" conversion
         next = __next__
 
     def previous(self):
-        self._checkOpen()
-        self._checkCursor()
-        rv = _DeadlockWrap(self.dbc.prev)
-        return rv
+        return self._cursorCall("prev")
 
     def first(self):
         self._checkOpen()
-        # fix 1725856: don't needlessly try to restore our cursor position
-        self.saved_dbc_key = None
-        self._checkCursor()
-        rv = _DeadlockWrap(self.dbc.first)
-        return rv
+        with self._lock:
+            # fix 1725856: don't needlessly try to restore our cursor position
+            self._thread_cursors().saved_dbc_key = None
+            return self._cursorCall("first")
 
     def last(self):
         self._checkOpen()
-        # fix 1725856: don't needlessly try to restore our cursor position
-        self.saved_dbc_key = None
-        self._checkCursor()
-        rv = _DeadlockWrap(self.dbc.last)
-        return rv
+        with self._lock:
+            # fix 1725856: don't needlessly try to restore our cursor position
+            self._thread_cursors().saved_dbc_key = None
+            return self._cursorCall("last")
 
     def sync(self):
         self._checkOpen()
@@ -322,45 +443,46 @@ class _DBWithCursor(_iter_mixin):
 # Compatibility object factory functions
 
 def hashopen(file, flag='c', mode=0o666, pgsize=None, ffactor=None, nelem=None,
-            cachesize=None, lorder=None, hflags=0):
+            cachesize=None, lorder=None, hflags=0, snapshot=False,
+            dbenv=None):
 
-    flags = _checkflag(flag, file)
-    e = _openDBEnv(cachesize)
+    flags = _checkflag(flag, file, snapshot, dbenv)
+    e = _getDBEnv(dbenv, cachesize, snapshot)
     d = db.DB(e)
     d.set_flags(hflags)
     if pgsize is not None:    d.set_pagesize(pgsize)
     if lorder is not None:    d.set_lorder(lorder)
     if ffactor is not None:   d.set_h_ffactor(ffactor)
     if nelem is not None:     d.set_h_nelem(nelem)
-    d.open(file, db.DB_HASH, flags, mode)
-    return _DBWithCursor(d)
+    d.open(file, db.DB_HASH, flags | _envflags(e), mode)
+    return _DBWithCursor(d, e)
 
 #----------------------------------------------------------------------
 
 def btopen(file, flag='c', mode=0o666,
             btflags=0, cachesize=None, maxkeypage=None, minkeypage=None,
-            pgsize=None, lorder=None):
+            pgsize=None, lorder=None, snapshot=False, dbenv=None):
 
-    flags = _checkflag(flag, file)
-    e = _openDBEnv(cachesize)
+    flags = _checkflag(flag, file, snapshot, dbenv)
+    e = _getDBEnv(dbenv, cachesize, snapshot)
     d = db.DB(e)
     if pgsize is not None: d.set_pagesize(pgsize)
     if lorder is not None: d.set_lorder(lorder)
     d.set_flags(btflags)
     if minkeypage is not None: d.set_bt_minkey(minkeypage)
     if maxkeypage is not None: d.set_bt_maxkey(maxkeypage)
-    d.open(file, db.DB_BTREE, flags, mode)
-    return _DBWithCursor(d)
+    d.open(file, db.DB_BTREE, flags | _envflags(e), mode)
+    return _DBWithCursor(d, e)
 
 #----------------------------------------------------------------------
 
 
 def rnopen(file, flag='c', mode=0o666,
             rnflags=0, cachesize=None, pgsize=None, lorder=None,
-            rlen=None, delim=None, source=None, pad=None):
+            rlen=None, delim=None, source=None, pad=None, dbenv=None):
 
-    flags = _checkflag(flag, file)
-    e = _openDBEnv(cachesize)
+    flags = _checkflag(flag, file, dbenv=dbenv)
+    e = _getDBEnv(dbenv, cachesize)
     d = db.DB(e)
     if pgsize is not None: d.set_pagesize(pgsize)
     if lorder is not None: d.set_lorder(lorder)
@@ -369,23 +491,68 @@ def rnopen(file, flag='c', mode=0o666,
     if rlen is not None: d.set_re_len(rlen)
     if source is not None: d.set_re_source(source)
     if pad is not None: d.set_re_pad(pad)
-    d.open(file, db.DB_RECNO, flags, mode)
-    return _DBWithCursor(d)
+    d.open(file, db.DB_RECNO, flags | _envflags(e), mode)
+    return _DBWithCursor(d, e)
 
 #----------------------------------------------------------------------
 
-def _openDBEnv(cachesize):
+def envopen(home='.', cachesize=None, mmapsize=None, lk_partitions=None,
+            transactional=False):
+    """Open a private environment to be shared by the databases opened
+    with hashopen(), btopen() and rnopen(), given as their 'dbenv'
+    argument, instead of each one creating its own.
+
+    'cachesize' is the size in bytes of the cache used by all of them,
+    'mmapsize' the size of the biggest read only file mapped in memory
+    instead of being read through the cache, and 'lk_partitions' the
+    number of partitions of the lock table, more partitions meaning
+    less contention between threads.  By default the environment has
+    no log.  If 'transactional' is true every write is a transaction,
+    with the log kept in memory, as needed by databases opened with
+    'snapshot'.
+    """
     e = db.DBEnv()
     if cachesize is not None:
         if cachesize >= 20480:
-            e.set_cachesize(0, cachesize)
+            e.set_cachesize(cachesize >> 30, cachesize & ((1 << 30) - 1))
         else:
             raise error("cachesize must be >= 20480")
+    if mmapsize is not None:
+        e.set_mp_mmapsize(mmapsize)
+    if lk_partitions is not None:
+        e.set_lk_partitions(lk_partitions)
     e.set_lk_detect(db.DB_LOCK_DEFAULT)
-    e.open('.', db.DB_PRIVATE | db.DB_CREATE | db.DB_THREAD | db.DB_INIT_LOCK | db.DB_INIT_MPOOL)
+    flags = (db.DB_PRIVATE | db.DB_CREATE | db.DB_THREAD | db.DB_INIT_LOCK |
+             db.DB_INIT_MPOOL)
+    if transactional:
+        # There is nothing to recover in a private environment, so the
+        # log is only needed in memory
+        e.log_set_config(db.DB_LOG_IN_MEMORY, 1)
+        flags |= db.DB_INIT_TXN | db.DB_INIT_LOG
+    e.open(home, flags)
     return e
 
-def _checkflag(flag, file):
+def _openDBEnv(cachesize, snapshot=False):
+    # Multiversion concurrency control needs transactions
+    return envopen('.', cachesize, transactional=snapshot)
+
+def _getDBEnv(dbenv, cachesize, snapshot=False):
+    if dbenv is None:
+        return _openDBEnv(cachesize, snapshot)
+    if cachesize is not None:
+        raise error("cachesize is set by the shared environment")
+    if snapshot and not dbenv.get_open_flags() & db.DB_INIT_TXN:
+        raise error("snapshot needs a transactional environment")
+    return dbenv
+
+def _envflags(dbenv):
+    # Writes to the databases of a transactional environment are
+    # transactions
+    if dbenv.get_open_flags() & db.DB_INIT_TXN:
+        return db.DB_AUTO_COMMIT
+    return 0
+
+def _checkflag(flag, file, snapshot=False, dbenv=None):
     if flag == 'r':
         flags = db.DB_RDONLY
     elif flag == 'rw':
@@ -399,10 +566,21 @@ def _checkflag(flag, file):
         #flags = db.DB_CREATE | db.DB_TRUNCATE
         # we used db.DB_TRUNCATE flag for this before but Berkeley DB
         # 4.2.52 changed to disallowed truncate with txn environments.
-        if file is not None and os.path.isfile(file):
+        if file is None:
+            pass
+        elif dbenv is not None:
+            # The file is relative to the home of the shared environment,
+            # and Berkeley DB knows about the handles open on it there
+            try:
+                dbenv.dbremove(file, flags=_envflags(dbenv))
+            except db.DBNoSuchFileError:
+                pass
+        elif os.path.isfile(file):
             os.unlink(file)
     else:
         raise error("flags should be one of 'r', 'w', 'c' or 'n'")
+    if snapshot:
+        flags |= db.DB_MULTIVERSION
     return flags | db.DB_THREAD
 
 #----------------------------------------------------------------------
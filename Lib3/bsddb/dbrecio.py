@@ -1,27 +1,45 @@
-
 """
 File-like objects that read from or write to a bsddb record.
 
-This implements (nearly) all stdio methods.
+This implements the io.BufferedIOBase interface.
 
 f = DBRecIO(db, key, txn=None)
-f.close()           # explicitly release resources held
+f.close()           # flush and release resources held
 flag = f.isatty()   # always false
 pos = f.tell()      # get current position
 f.seek(pos)         # set current position
 f.seek(pos, mode)   # mode 0: absolute; 1: relative; 2: relative to EOF
 buf = f.read()      # read until EOF
 buf = f.read(n)     # read up to n bytes
+n = f.readinto(b)   # read into a writable buffer
+v = f.view(offset, length)  # memoryview of part of the record
+line = f.readline() # read up to and including the next newline
 f.truncate([size])  # truncate file at to at most size (default: current pos)
 f.write(buf)        # write at current position
 f.writelines(list)  # for line in list: f.write(line)
+f.flush()           # store the buffered writes in the database
 
 Notes:
 - fileno() is left unimplemented so that code which uses it triggers
   an exception early.
+- Reads fetch 'buffersize' bytes at a time (by default the page size of
+  the database) with partial DB.get() calls, and consecutive writes are
+  gathered into partial DB.put() calls of up to 'buffersize' bytes.
+  Buffered writes are stored by flush(), close() and by any operation
+  that needs them, so flush before committing 'txn'.
+- view() and big readinto() calls have Berkeley DB copy the data
+  straight into the destination buffer (see DB.get_into()), e.g. to
+  build a numpy array with numpy.frombuffer() without copies.
+- BlobStore keeps large objects as a set of fixed size chunk records,
+  giving random access through BlobFile handles:
+
+  store = BlobStore(db, chunksize=DEFAULT_CHUNKSIZE)
+  store.put(name, data_or_file)
+  data = store.get(name, workers=4)   # fetch the chunks in parallel
+  f = store.open(name, 'r+')          # 'r', 'r+', 'w' or 'a'
+  digest = store.checksum(name, 'sha256')
 - There's a simple test set (see end of this file) - not yet updated
   for DBRecIO.
-- readline() is not implemented yet.
 
 
 From:
@@ -29,117 +47,625 @@ From:
 """
 
 import errno
-import string
+import hashlib
+import io
+import struct
+import zlib
+from multiprocessing.pool import ThreadPool
+
+import sys
+absolute_import = (sys.version_info[0] >= 3)
+if absolute_import :
+    from . import db as _db
+else :
+    from . import db as _db
+
+def _byteview(buffer):
+    view = memoryview(buffer)
+    if view.itemsize != 1 or view.ndim != 1:
+        view = view.cast('B')
+    return view
 
-class DBRecIO:
-    def __init__(self, db, key, txn=None):
+
+class DBRecIO(io.BufferedIOBase):
+    def __init__(self, db, key, txn=None, buffersize=None):
+        io.BufferedIOBase.__init__(self)
         self.db = db
         self.key = key
         self.txn = txn
-        self.len = None
+        if buffersize is None:
+            buffersize = db.get_pagesize()
+        self.buffersize = max(1, buffersize)
+        try:
+            self.len = db.get_size(key, txn=txn)
+        except _db.DBNotFoundError:
+            self.len = 0
         self.pos = 0
-        self.closed = 0
-        self.softspace = 0
+        # Read-ahead buffer, holding the record bytes at _rpos
+        self._rbuf = b''
+        self._rpos = 0
+        # Pending writes, to be stored at _wpos
+        self._wbuf = bytearray()
+        self._wpos = 0
+        # Buffer reused by view()
+        self._vbuf = None
+
+    def _checkOpen(self):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+
+    def _get(self, offset, size):
+        try:
+            data = self.db.get(self.key, txn=self.txn, dlen=size, doff=offset)
+        except _db.DBNotFoundError:
+            data = None
+        if data is None:
+            return b''
+        return data
+
+    def _get_into(self, buf, offset):
+        # Let Berkeley DB copy the bytes into buf, if the DB handle can
+        get_into = getattr(self.db, "get_into", None)
+        if get_into is None:
+            data = self._get(offset, len(buf))
+            buf[:len(data)] = data
+            return len(data)
+        try:
+            n = get_into(self.key, buf, txn=self.txn, doff=offset)
+        except _db.DBNotFoundError:
+            n = None
+        return n or 0
+
+    def _fill(self):
+        self._rpos = self.pos
+        self._rbuf = self._get(self.pos,
+                               min(self.buffersize, self.len - self.pos))
 
     def close(self):
         if not self.closed:
-            self.closed = 1
-            del self.db, self.txn
+            try:
+                io.BufferedIOBase.close(self)
+            finally:
+                self.db = self.txn = None
 
-    def isatty(self):
-        if self.closed:
-            raise ValueError("I/O operation on closed file")
-        return 0
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
 
     def seek(self, pos, mode = 0):
-        if self.closed:
-            raise ValueError("I/O operation on closed file")
+        self._checkOpen()
         if mode == 1:
-            pos = pos + self.pos
+            pos = max(0, pos + self.pos)
         elif mode == 2:
-            pos = pos + self.len
-        self.pos = max(0, pos)
+            pos = max(0, pos + self.len)
+        elif mode != 0:
+            raise ValueError("invalid whence (%r, should be 0, 1 or 2)" % mode)
+        elif pos < 0:
+            raise ValueError("negative seek position %r" % pos)
+        self.pos = pos
+        return self.pos
 
     def tell(self):
-        if self.closed:
-            raise ValueError("I/O operation on closed file")
+        self._checkOpen()
         return self.pos
 
     def read(self, n = -1):
-        if self.closed:
-            raise ValueError("I/O operation on closed file")
-        if n < 0:
-            newpos = self.len
-        else:
-            newpos = min(self.pos+n, self.len)
+        self._checkOpen()
+        self.flush()
+        remaining = max(0, self.len - self.pos)
+        if n is None or n < 0 or n > remaining:
+            n = remaining
+        chunks = []
+        while n > 0:
+            offset = self.pos - self._rpos
+            if not (0 <= offset < len(self._rbuf)):
+                if n >= self.buffersize:
+                    # Too big to be worth buffering, fetch it at once
+                    data = self._get(self.pos, n)
+                    self.pos += len(data)
+                    chunks.append(data)
+                    break
+                self._fill()
+                offset = 0
+                if not self._rbuf:
+                    break
+            data = self._rbuf[offset:offset+n]
+            self.pos += len(data)
+            n -= len(data)
+            chunks.append(data)
+        return b''.join(chunks)
 
-        dlen = newpos - self.pos
+    read1 = read
 
-        r = self.db.get(self.key, txn=self.txn, dlen=dlen, doff=self.pos)
-        self.pos = newpos
-        return r
+    def readinto(self, b):
+        self._checkOpen()
+        self.flush()
+        target = _byteview(b)
+        n = min(len(target), max(0, self.len - self.pos))
+        offset = self.pos - self._rpos
+        if n >= self.buffersize and not (0 <= offset < len(self._rbuf)):
+            # Too big to be worth buffering, read it in place
+            n = self._get_into(target[:n], self.pos)
+            self.pos += n
+            return n
+        data = self.read(n)
+        target[:len(data)] = data
+        return len(data)
 
-    __fixme = """
-    def readline(self, length=None):
-        if self.closed:
-            raise ValueError, "I/O operation on closed file"
-        if self.buflist:
-            self.buf = self.buf + string.joinfields(self.buflist, '')
-            self.buflist = []
-        i = string.find(self.buf, '\n', self.pos)
-        if i < 0:
-            newpos = self.len
-        else:
-            newpos = i+1
-        if length is not None:
-            if self.pos + length < newpos:
-                newpos = self.pos + length
-        r = self.buf[self.pos:newpos]
-        self.pos = newpos
-        return r
-
-    def readlines(self, sizehint = 0):
-        total = 0
-        lines = []
-        line = self.readline()
-        while line:
-            lines.append(line)
-            total += len(line)
-            if 0 < sizehint <= total:
+    def view(self, offset=0, length=None, buffer=None):
+        """Return a memoryview of 'length' bytes of the record from
+        'offset' (by default, up to its end) without moving the file
+        position.  Changing its contents doesn't change the record.
+
+        If 'buffer', a writable buffer such as a bytearray, is given the
+        bytes are read straight into it.  Otherwise a buffer owned by this
+        object is reused, so the contents of a view are only valid until
+        the next call to view()."""
+        self._checkOpen()
+        self.flush()
+        if offset < 0:
+            raise ValueError("negative offset %r" % offset)
+        available = max(0, self.len - offset)
+        if length is None or length < 0 or length > available:
+            length = available
+        if buffer is None:
+            if self._vbuf is None or len(self._vbuf) < length:
+                # A new buffer, views handed out before stay usable
+                self._vbuf = bytearray(length)
+            buffer = self._vbuf
+        target = _byteview(buffer)
+        if len(target) < length:
+            raise ValueError("buffer too small, %d bytes needed" % length)
+        target = target[:length]
+        n = 0
+        if length:
+            n = self._get_into(target, offset)
+        return target[:n]
+
+    def readline(self, size = -1):
+        self._checkOpen()
+        self.flush()
+        if size is None:
+            size = -1
+        chunks = []
+        while size != 0 and self.pos < self.len:
+            offset = self.pos - self._rpos
+            if not (0 <= offset < len(self._rbuf)):
+                self._fill()
+                offset = 0
+                if not self._rbuf:
+                    break
+            end = len(self._rbuf)
+            if size > 0:
+                end = min(end, offset + size)
+            i = self._rbuf.find(b'\n', offset, end)
+            if i >= 0:
+                end = i + 1
+            data = self._rbuf[offset:end]
+            self.pos += len(data)
+            chunks.append(data)
+            if i >= 0:
                 break
-            line = self.readline()
-        return lines
-    """
+            if size > 0:
+                size -= len(data)
+        return b''.join(chunks)
 
     def truncate(self, size=None):
-        if self.closed:
-            raise ValueError("I/O operation on closed file")
+        self._checkOpen()
+        self.flush()
         if size is None:
             size = self.pos
         elif size < 0:
             raise IOError(errno.EINVAL,
                                       "Negative size not allowed")
-        elif size < self.pos:
-            self.pos = size
-        self.db.put(self.key, "", txn=self.txn, dlen=self.len-size, doff=size)
+        if size != self.len:
+            # A partial put past the end of the record pads it with NULs
+            self.db.put(self.key, b'', txn=self.txn,
+                        dlen=max(0, self.len-size), doff=size)
+            self.len = size
+            self._rbuf = b''
+        return size
 
     def write(self, s):
+        self._checkOpen()
+        if not isinstance(s, bytes):
+            s = memoryview(s).tobytes()
+        if not s: return 0
+        if self._wbuf and self._wpos + len(self._wbuf) != self.pos:
+            self.flush()
+        if not self._wbuf:
+            self._wpos = self.pos
+        self._wbuf.extend(s)
+        self._rbuf = b''
+        self.pos += len(s)
+        self.len = max(self.len, self.pos)
+        if len(self._wbuf) >= self.buffersize:
+            self.flush()
+        return len(s)
+
+    def flush(self):
+        self._checkOpen()
+        if self._wbuf:
+            data = bytes(self._wbuf)
+            self.db.put(self.key, data, txn=self.txn,
+                        dlen=len(data), doff=self._wpos)
+            self._wbuf = bytearray()
+
+
+#---------------------------------------------------------------------------
+
+# Default size of the chunk records of a BlobStore
+DEFAULT_CHUNKSIZE = 256 * 1024
+
+# Blob keys are the length-prefixed name, followed by the chunk number
+# for chunk records; the bare prefix holds the blob metadata.
+_blob_name = struct.Struct('>I')
+_blob_chunk = struct.Struct('>Q')
+# size, chunk size, checksum present, CRC-32 of the contents
+_blob_meta = struct.Struct('>QIBI')
+
+
+class BlobStoreError(_db.DBError):
+    pass
+
+
+def _crc32(data, crc=0):
+    return zlib.crc32(data, crc) & 0xffffffff
+
+
+class BlobStore(object):
+    """Store objects too big to be handled as a single record.
+
+    Each object is split into records of 'chunksize' bytes under keys
+    made of its name and the chunk number, so reading or rewriting a
+    part of it only touches the chunks involved.  A metadata record
+    keeps its size and, when it was written from start to end in one go,
+    the CRC-32 of its contents, checked by get().
+
+    'db' may be a BTREE or HASH database; with a BTREE the chunks of a
+    blob are stored next to each other.  Names are byte strings.
+    """
+    def __init__(self, db, chunksize=DEFAULT_CHUNKSIZE):
+        self.db = db
+        self.chunksize = max(1, chunksize)
+
+    def _meta_key(self, name):
+        return _blob_name.pack(len(name)) + name
+
+    def _chunk_key(self, name, i):
+        return _blob_name.pack(len(name)) + name + _blob_chunk.pack(i)
+
+    def _get_meta(self, name, txn=None):
+        """Return (size, chunksize, crc) for the blob, crc being None if
+        unknown, or None if there is no such blob."""
+        data = self.db.get(self._meta_key(name), txn=txn)
+        if data is None:
+            return None
+        size, chunksize, has_crc, crc = _blob_meta.unpack(data)
+        if not has_crc:
+            crc = None
+        return size, chunksize, crc
+
+    def _put_meta(self, name, size, chunksize, crc, txn=None):
+        data = _blob_meta.pack(size, chunksize, crc is not None, crc or 0)
+        self.db.put(self._meta_key(name), data, txn=txn)
+
+    def _find(self, name, txn):
+        meta = self._get_meta(name, txn)
+        if meta is None:
+            raise IOError(errno.ENOENT, "No such blob", name)
+        return meta
+
+    def _get_chunk(self, name, i, length, txn=None):
+        data = self.db.get(self._chunk_key(name, i), txn=txn) or b''
+        if len(data) < length:
+            # Never written, or shortened by a later truncate()
+            data += b'\0' * (length - len(data))
+        return data[:length]
+
+    def _chunks(self, name, txn=None, workers=1):
+        size, chunksize, crc = self._find(name, txn)
+        count = (size + chunksize - 1) // chunksize
+        def fetch(i):
+            return self._get_chunk(name, i,
+                                   min(chunksize, size - i*chunksize), txn)
+        if (workers > 1 and count > 1 and
+                self.db.get_open_flags() & _db.DB_THREAD):
+            # DB.get() releases the GIL, so the chunks are read in parallel
+            pool = ThreadPool(min(workers, count))
+            try:
+                return pool.map(fetch, list(range(count))), crc
+            finally:
+                pool.close()
+                pool.join()
+        return [fetch(i) for i in range(count)], crc
+
+    def open(self, name, mode='r', txn=None):
+        """Return a BlobFile for the blob.  'mode' is 'r' (read only),
+        'r+' (read and write), 'w' (create or empty, then write) or 'a'
+        (create if missing, every write appends)."""
+        return BlobFile(self, name, mode, txn)
+
+    def put(self, name, data, txn=None):
+        """Store 'data', a byte string or a file-like object read up to
+        EOF, as the contents of the blob.  Return the blob size."""
+        f = self.open(name, 'w', txn)
+        try:
+            if hasattr(data, 'read'):
+                while True:
+                    chunk = data.read(self.chunksize)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            else:
+                f.write(data)
+            return f.tell()
+        finally:
+            f.close()
+
+    def get(self, name, txn=None, workers=1, verify=True):
+        """Return the contents of the blob.  With 'workers' > 1 and a
+        database opened with DB_THREAD the chunks are fetched by that many
+        threads at once.  If 'verify' is true and the blob has a checksum
+        BlobStoreError is raised when the contents don't match it."""
+        chunks, crc = self._chunks(name, txn, workers)
+        if verify and crc is not None:
+            running = 0
+            for chunk in chunks:
+                running = _crc32(chunk, running)
+            if running != crc:
+                raise BlobStoreError("Checksum mismatch in blob %r" % (name,))
+        return b''.join(chunks)
+
+    def checksum(self, name, algorithm='sha256', txn=None):
+        """Return the hex digest of the blob contents, computed one chunk
+        at a time.  'algorithm' is any name accepted by hashlib.new(), or
+        'crc32'."""
+        size, chunksize, crc = self._find(name, txn)
+        if algorithm == 'crc32':
+            running = 0
+        else:
+            h = hashlib.new(algorithm)
+        for i in range((size + chunksize - 1) // chunksize):
+            chunk = self._get_chunk(name, i,
+                                    min(chunksize, size - i*chunksize), txn)
+            if algorithm == 'crc32':
+                running = _crc32(chunk, running)
+            else:
+                h.update(chunk)
+        if algorithm == 'crc32':
+            return '%08x' % running
+        return h.hexdigest()
+
+    def size(self, name, txn=None):
+        return self._find(name, txn)[0]
+
+    def exists(self, name, txn=None):
+        return self._get_meta(name, txn) is not None
+
+    def delete(self, name, txn=None):
+        """Remove the blob and all its chunks."""
+        size, chunksize, crc = self._find(name, txn)
+        self._delete_chunks(name, 0, (size + chunksize - 1) // chunksize, txn)
+        self.db.delete(self._meta_key(name), txn=txn)
+
+    def _delete_chunks(self, name, first, end, txn):
+        for i in range(first, end):
+            try:
+                self.db.delete(self._chunk_key(name, i), txn=txn)
+            except _db.DBNotFoundError:
+                pass
+
+    def names(self, txn=None):
+        """Iterate over the names of the stored blobs."""
+        btree = self.db.get_type() == _db.DB_BTREE
+        cursor = self.db.cursor(txn)
+        try:
+            rec = cursor.first()
+            while rec is not None:
+                key = rec[0]
+                n = _blob_name.unpack(key[:_blob_name.size])[0]
+                is_meta = len(key) == _blob_name.size + n
+                if is_meta:
+                    yield key[_blob_name.size:]
+                if is_meta and btree:
+                    # Skip past the chunks of this blob
+                    skip = key + b'\xff' * (_blob_chunk.size + 1)
+                    rec = cursor.set_range(skip)
+                else:
+                    rec = getattr(cursor, "next")()
+        except _db.DBNotFoundError:
+            pass
+        finally:
+            cursor.close()
+
+
+class BlobFile(io.BufferedIOBase):
+    """File-like access to a blob of a BlobStore, see BlobStore.open().
+
+    Reads and writes go through a DBRecIO on the chunk holding the
+    current position, buffering up to a whole chunk.  Writing past the
+    end leaves a hole that reads as NULs.  The blob size is stored by
+    flush() and close().
+    """
+    def __init__(self, store, name, mode='r', txn=None):
+        if mode not in ('r', 'r+', 'w', 'a'):
+            raise ValueError("invalid mode: %r" % (mode,))
+        io.BufferedIOBase.__init__(self)
+        self.store = store
+        self.name = name
+        self.mode = mode
+        self.txn = txn
+        self._chunk = None
+        self._rec = None
+        meta = store._get_meta(name, txn)
+        if meta is None:
+            if mode in ('r', 'r+'):
+                raise IOError(errno.ENOENT, "No such blob", name)
+            self.len, self.chunksize, crc = 0, store.chunksize, None
+            self._dirty = True
+        else:
+            self.len, self.chunksize, crc = meta
+            self._dirty = False
+        self.pos = 0
+        if mode == 'w':
+            self.truncate(0)
+            # CRC-32 of the bytes written so far, while they are written
+            # sequentially from the start
+            self._crc = (0, 0)
+        else:
+            self._crc = None
+        if mode == 'a':
+            self.pos = self.len
+
+    def _checkOpen(self):
         if self.closed:
             raise ValueError("I/O operation on closed file")
-        if not s: return
-        if self.pos > self.len:
-            self.buflist.append('\0'*(self.pos - self.len))
-            self.len = self.pos
-        newpos = self.pos + len(s)
-        self.db.put(self.key, s, txn=self.txn, dlen=len(s), doff=self.pos)
-        self.pos = newpos
 
-    def writelines(self, list):
-        self.write(string.joinfields(list, ''))
+    def _checkWritable(self):
+        if self.mode == 'r':
+            raise io.UnsupportedOperation("blob not opened for writing")
+
+    def _release(self):
+        if self._rec is not None:
+            self._rec.close()
+            self._rec = self._chunk = None
+
+    def _select(self, i):
+        """Return the DBRecIO of chunk 'i'."""
+        if i != self._chunk:
+            self._release()
+            key = self.store._chunk_key(self.name, i)
+            self._rec = DBRecIO(self.store.db, key, self.txn,
+                                buffersize=self.chunksize)
+            self._chunk = i
+        return self._rec
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.flush()
+                self._release()
+            finally:
+                io.BufferedIOBase.close(self)
+                self.store = self.txn = None
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return self.mode != 'r'
+
+    def seekable(self):
+        return True
+
+    def seek(self, pos, mode = 0):
+        self._checkOpen()
+        if mode == 1:
+            pos = max(0, pos + self.pos)
+        elif mode == 2:
+            pos = max(0, pos + self.len)
+        elif mode != 0:
+            raise ValueError("invalid whence (%r, should be 0, 1 or 2)" % mode)
+        elif pos < 0:
+            raise ValueError("negative seek position %r" % pos)
+        self.pos = pos
+        return self.pos
+
+    def tell(self):
+        self._checkOpen()
+        return self.pos
+
+    def read(self, n = -1):
+        self._checkOpen()
+        remaining = max(0, self.len - self.pos)
+        if n is None or n < 0 or n > remaining:
+            n = remaining
+        chunks = []
+        while n > 0:
+            i, offset = divmod(self.pos, self.chunksize)
+            count = min(n, self.chunksize - offset)
+            rec = self._select(i)
+            rec.seek(offset)
+            data = rec.read(count)
+            if len(data) < count:
+                data += b'\0' * (count - len(data))
+            chunks.append(data)
+            self.pos += count
+            n -= count
+        return b''.join(chunks)
+
+    read1 = read
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+    def write(self, s):
+        self._checkOpen()
+        self._checkWritable()
+        if not isinstance(s, bytes):
+            s = memoryview(s).tobytes()
+        if not s: return 0
+        if self.mode == 'a':
+            self.pos = self.len
+        if self._crc is not None:
+            crc, length = self._crc
+            if length == self.pos:
+                self._crc = (_crc32(s, crc), length + len(s))
+            else:
+                self._crc = None
+        start = 0
+        while start < len(s):
+            i, offset = divmod(self.pos, self.chunksize)
+            count = min(len(s) - start, self.chunksize - offset)
+            rec = self._select(i)
+            rec.seek(offset)
+            rec.write(s[start:start+count])
+            self.pos += count
+            start += count
+        self.len = max(self.len, self.pos)
+        self._dirty = True
+        return len(s)
+
+    def truncate(self, size=None):
+        self._checkOpen()
+        self._checkWritable()
+        if size is None:
+            size = self.pos
+        elif size < 0:
+            raise IOError(errno.EINVAL, "Negative size not allowed")
+        if size != self.len:
+            self._release()
+            if size < self.len:
+                cs = self.chunksize
+                self.store._delete_chunks(self.name, (size + cs - 1) // cs,
+                                          (self.len + cs - 1) // cs, self.txn)
+                if size % cs:
+                    self._select(size // cs).truncate(size % cs)
+            self.len = size
+            self._crc = None
+            self._dirty = True
+        return size
 
     def flush(self):
-        if self.closed:
-            raise ValueError("I/O operation on closed file")
+        self._checkOpen()
+        if self._rec is not None:
+            self._rec.flush()
+        if self._dirty:
+            crc = None
+            if self._crc is not None and self._crc[1] == self.len:
+                crc = self._crc[0]
+            self.store._put_meta(self.name, self.len, self.chunksize, crc,
+                                 self.txn)
+            self._dirty = False
 
 
 """
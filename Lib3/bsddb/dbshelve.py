@@ -30,6 +30,14 @@ storage.
 #------------------------------------------------------------------------
 
 import sys
+import struct
+import threading
+import zlib
+import bz2
+try:
+    import lzma
+except ImportError:
+    lzma = None
 absolute_import = (sys.version_info[0] >= 3)
 if absolute_import :
     from . import db
@@ -48,6 +56,59 @@ HIGHEST_PROTOCOL = pickle.HIGHEST_PROTOCOL
 def _dumps(object, protocol):
     return pickle.dumps(object, protocol=protocol)
 
+# Header bytes of the records written by SchemaCodec and CompressedCodec.
+# Pickles never start with a control character, so every kind of record
+# can coexist in the same database.
+_SCHEMA_MARK = b'\x01'
+_layout_id = struct.Struct('>I')
+
+# method: (header byte, compress(data, level), decompress(data))
+_compressors = {
+    "zlib": (b'\x02',
+             lambda data, level: zlib.compress(data,
+                    zlib.Z_DEFAULT_COMPRESSION if level is None else level),
+             zlib.decompress),
+    "bz2": (b'\x03',
+            lambda data, level: bz2.compress(data,
+                    9 if level is None else level),
+            bz2.decompress),
+}
+if lzma is not None:
+    _compressors["lzma"] = (b'\x04',
+            lambda data, level: lzma.compress(data, preset=level),
+            lzma.decompress)
+_decompressors = dict((mark, decompress)
+        for mark, compress, decompress in list(_compressors.values()))
+
+# Integer secondary keys are stored biased, so they sort numerically
+_index_int = struct.Struct('>Q')
+_index_int_bias = 1 << 63
+
+def index_key(value):
+    """Return the secondary key under which DBShelf.create_index indexes
+    a field value.  Strings are used as they are (text is encoded as
+    UTF-8), integers are stored so they sort in numerical order and any
+    other value is pickled.
+    """
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    if isinstance(value, int) and \
+            -_index_int_bias <= value < _index_int_bias:
+        return _index_int.pack(value + _index_int_bias)
+    return _dumps(value, 2)
+
+def _lookup(value, path):
+    for name in path:
+        if isinstance(value, dict):
+            value = value.get(name)
+        else:
+            value = getattr(value, name, None)
+        if value is None:
+            break
+    return value
+
 if (sys.version_info[0] >= 3):
     from collections.abc import MutableMapping
 else:
@@ -94,17 +155,215 @@ def open(filename, flags=db.DB_CREATE, mode=0o660, filetype=db.DB_HASH,
 class DBShelveError(db.DBError): pass
 
 
+#---------------------------------------------------------------------------
+# Value codecs.  A codec turns the objects stored in a shelf into the
+# strings kept in the database, and back again.
+
+class PickleCodec:
+    """The default codec: every value is stored as a plain pickle."""
+
+    def dumps(self, value, protocol):
+        return _dumps(value, protocol)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+    def extract(self, data, path):
+        """Return the field at 'path', a sequence of dictionary keys or
+        attribute names, of the value encoded in data, or None if the
+        value doesn't have it.
+
+        A pickle can't be read partially, so the whole value is
+        unpickled for every field extracted.  Codecs storing their
+        values in another layout may override this to extract the
+        field more cheaply, as SchemaCodec does.
+        """
+        return _lookup(self.loads(data), path)
+
+
+class SchemaCodec(PickleCodec):
+    """Store dictionaries as a tuple of their values plus a reference to
+    a shared layout (the tuple of their keys), so the field names are
+    written once instead of in every record.
+
+    The layouts are kept in 'layoutdb', a BTREE or HASH database that
+    must be used with the shelf for as long as its data is.  Layouts are
+    stored outside of any transaction; a layout left behind by an
+    aborted write is harmless.  Values that are not dictionaries with
+    string keys, and records written without this codec, are stored and
+    read as regular pickles.
+
+        layouts = db.DB(dbenv)
+        layouts.open(filename, "layouts", db.DB_BTREE, db.DB_CREATE)
+        shelf.codec = dbshelve.SchemaCodec(layouts)
+    """
+    def __init__(self, layoutdb):
+        self.layoutdb = layoutdb
+        self._lock = threading.Lock()
+        self._layouts = {}      # layout id -> tuple of keys
+        self._layout_ids = {}   # tuple of keys -> layout id
+        self._next_layout = 0
+        self._load_layouts()
+
+    def _load_layouts(self):
+        for key, data in list(self.layoutdb.items()):
+            layout = _layout_id.unpack(key)[0]
+            fields = pickle.loads(data)
+            self._layouts[layout] = fields
+            self._layout_ids[fields] = layout
+            self._next_layout = max(self._next_layout, layout + 1)
+
+    def _new_layout(self, fields, protocol):
+        with self._lock:
+            while fields not in self._layout_ids:
+                layout = self._next_layout
+                try:
+                    self.layoutdb.put(_layout_id.pack(layout),
+                            _dumps(fields, protocol),
+                            flags=db.DB_NOOVERWRITE)
+                except db.DBKeyExistError:
+                    # Another handle took this id, pick up its layouts
+                    self._load_layouts()
+                else:
+                    self._layouts[layout] = fields
+                    self._layout_ids[fields] = layout
+                    self._next_layout = layout + 1
+            return self._layout_ids[fields]
+
+    def layouts(self):
+        """Return a dictionary mapping layout ids to tuples of keys."""
+        return dict(self._layouts)
+
+    def dumps(self, value, protocol):
+        if type(value) is not dict or not value:
+            return _dumps(value, protocol)
+        fields = tuple(value)
+        for field in fields:
+            if not isinstance(field, str):
+                return _dumps(value, protocol)
+        layout = self._layout_ids.get(fields)
+        if layout is None:
+            layout = self._new_layout(fields, protocol)
+        return (_SCHEMA_MARK + _layout_id.pack(layout) +
+                _dumps(tuple(value.values()), protocol))
+
+    def _split(self, data):
+        layout = _layout_id.unpack_from(data, 1)[0]
+        fields = self._layouts.get(layout)
+        if fields is None:
+            # Written by another handle after we read the layouts
+            with self._lock:
+                self._load_layouts()
+            fields = self._layouts[layout]
+        return fields, pickle.loads(data[1+_layout_id.size:])
+
+    def loads(self, data):
+        if data[:1] != _SCHEMA_MARK:
+            return pickle.loads(data)
+        fields, values = self._split(data)
+        return dict(list(zip(fields, values)))
+
+    def extract(self, data, path):
+        if data[:1] != _SCHEMA_MARK:
+            return _lookup(pickle.loads(data), path)
+        # Pick the field from the tuple, without building the dictionary
+        fields, values = self._split(data)
+        try:
+            i = fields.index(path[0])
+        except ValueError:
+            return None
+        return _lookup(values[i], path[1:])
+
+
+class CompressedCodec:
+    """Compress the records produced by another codec ('codec', by
+    default a PickleCodec) when they are at least 'threshold' bytes
+    long, using the zlib, bz2 or lzma 'method'.  Compressed records
+    start with a header byte naming their method, so any mix of
+    compressed and plain records, whatever the method, can be read.
+
+        shelf.codec = dbshelve.CompressedCodec(threshold=512)
+    """
+    def __init__(self, codec=None, method="zlib", threshold=1024,
+                 level=None):
+        if method not in _compressors:
+            raise DBShelveError("unknown compression method: %r" % method)
+        if codec is None:
+            codec = PickleCodec()
+        self.codec = codec
+        self.method = method
+        self.threshold = threshold
+        self.level = level
+        self._mark, self._compress, decompress = _compressors[method]
+        # The statistics are updated by every thread using the shelf
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._records = self._compressed = 0
+            self._bytes_in = self._bytes_out = 0
+
+    def stats(self):
+        """Return a dictionary describing the records written so far:
+        'records', how many were 'compressed', their size before
+        ('bytes_in') and after ('bytes_out') compression and the
+        resulting 'ratio'."""
+        with self._stats_lock:
+            stats = {"records": self._records,
+                     "compressed": self._compressed,
+                     "bytes_in": self._bytes_in,
+                     "bytes_out": self._bytes_out}
+        if stats["bytes_out"]:
+            stats["ratio"] = float(stats["bytes_in"]) / stats["bytes_out"]
+        else:
+            stats["ratio"] = 1.0
+        return stats
+
+    def _decompress(self, data):
+        decompress = _decompressors.get(data[:1])
+        if decompress is None:
+            return data
+        return decompress(data[1:])
+
+    def dumps(self, value, protocol):
+        data = self.codec.dumps(value, protocol)
+        size = len(data)
+        compressed = False
+        if size >= self.threshold:
+            packed = self._compress(data, self.level)
+            if len(packed) + 1 < size:
+                compressed = True
+                data = self._mark + packed
+        with self._stats_lock:
+            self._records += 1
+            self._compressed += compressed
+            self._bytes_in += size
+            self._bytes_out += len(data)
+        return data
+
+    def loads(self, data):
+        return self.codec.loads(self._decompress(data))
+
+    def extract(self, data, path):
+        return self.codec.extract(self._decompress(data), path)
+
+
+
 class DBShelf(MutableMapping):
     """A shelf to hold pickled objects, built upon a bsddb DB object.  It
     automatically pickles/unpickles data objects going to/from the DB.
     """
     def __init__(self, dbenv=None):
+        self._indexes = []
+        self._dbenv = dbenv
         self.db = db.DB(dbenv)
         self._closed = True
         if HIGHEST_PROTOCOL:
             self.protocol = HIGHEST_PROTOCOL
         else:
             self.protocol = 1
+        self.codec = PickleCodec()
 
 
     def __del__(self):
@@ -127,11 +386,11 @@ class DBShelf(MutableMapping):
 
     def __getitem__(self, key):
         data = self.db[key]
-        return pickle.loads(data)
+        return self.codec.loads(data)
 
 
     def __setitem__(self, key, value):
-        data = _dumps(value, self.protocol)
+        data = self.codec.dumps(value, self.protocol)
         self.db[key] = data
 
 
@@ -162,6 +421,9 @@ class DBShelf(MutableMapping):
 
 
     def close(self, *args, **kwargs):
+        for index in self._indexes:
+            index.close()
+        self._indexes = []
         self.db.close(*args, **kwargs)
         self._closed = True
 
@@ -181,7 +443,7 @@ class DBShelf(MutableMapping):
         newitems = []
 
         for k, v in items:
-            newitems.append( (k, pickle.loads(v)) )
+            newitems.append( (k, self.codec.loads(v)) )
         return newitems
 
     def values(self, txn=None):
@@ -190,13 +452,13 @@ class DBShelf(MutableMapping):
         else:
             values = list(self.db.values())
 
-        return list(map(pickle.loads, values))
+        return list(map(self.codec.loads, values))
 
     #-----------------------------------
     # Other methods
 
     def __append(self, value, txn=None):
-        data = _dumps(value, self.protocol)
+        data = self.codec.dumps(value, self.protocol)
         return self.db.append(data, txn)
 
     def append(self, value, txn=None):
@@ -206,17 +468,74 @@ class DBShelf(MutableMapping):
 
 
     def associate(self, secondaryDB, callback, flags=0):
-        def _shelf_callback(priKey, priData, realCallback=callback):
+        def _shelf_callback(priKey, priData, realCallback=callback,
+                            codec=self.codec):
             # Safe in Python 2.x because expresion short circuit
             if sys.version_info[0] < 3 or isinstance(priData, bytes) :
-                data = pickle.loads(priData)
+                data = codec.loads(priData)
             else :
-                data = pickle.loads(bytes(priData, "iso8859-1"))  # 8 bits
+                data = codec.loads(bytes(priData, "iso8859-1"))  # 8 bits
             return realCallback(priKey, data)
 
         return self.db.associate(secondaryDB, _shelf_callback, flags)
 
 
+    def create_index(self, name, attr_or_path, unique=False, filename=None,
+                     txn=None):
+        """Create, or open, an index on a field of the values stored in
+        this shelf.  The index is returned as a DBShelf, mapping the
+        index_key() of a field value to the values that have it.
+
+        attr_or_path names the field: a dictionary key or an attribute
+        name, or a dotted path ("address.city") or sequence of names to
+        reach nested values.  Values without the field are not indexed.
+
+        The index is the 'name' database in 'filename'.  By default it
+        is kept in the file holding this shelf when the shelf is itself
+        a named database, else in the "<file>.<name>.idx" file next to
+        it, since a file holding a single unnamed database can't hold
+        others.  When it is created, the values already in the shelf
+        are indexed in a single pass.  The index is closed together
+        with the shelf.
+        """
+        if isinstance(attr_or_path, str):
+            path = tuple(attr_or_path.split("."))
+        else:
+            path = tuple(attr_or_path)
+        if filename is None:
+            filename, dbname = self.db.get_dbname()
+            if dbname is None and filename is not None:
+                filename = "%s.%s.idx" % (filename, name)
+
+        index = DBShelf(self._dbenv)
+        index.protocol = self.protocol
+        index.codec = self.codec
+        if not unique:
+            index.set_flags(db.DB_DUP | db.DB_DUPSORT)
+        flags = db.DB_CREATE | (self.db.get_open_flags() & db.DB_THREAD)
+        if txn is None and self.db.get_transactional():
+            flags |= db.DB_AUTO_COMMIT
+        index.open(filename, name, db.DB_BTREE, flags, txn=txn)
+
+        def _index_callback(priKey, priData, codec=self.codec, path=path):
+            # Safe in Python 2.x because expresion short circuit
+            if sys.version_info[0] >= 3 and not isinstance(priData, bytes) :
+                priData = bytes(priData, "iso8859-1")  # 8 bits
+            value = codec.extract(priData, path)
+            if value is None:
+                return db.DB_DONOTINDEX
+            return index_key(value)
+
+        try:
+            self.db.associate(index.db, _index_callback, db.DB_CREATE,
+                              txn=txn)
+        except:
+            index.close()
+            raise
+        self._indexes.append(index)
+        return index
+
+
     #def get(self, key, default=None, txn=None, flags=0):
     def get(self, *args, **kw):
         # We do it with *args and **kw so if the default value wasn't
@@ -225,30 +544,39 @@ class DBShelf(MutableMapping):
         # off.
         data = self.db.get(*args, **kw)
         try:
-            return pickle.loads(data)
+            return self.codec.loads(data)
         except (EOFError, TypeError, pickle.UnpicklingError):
             return data  # we may be getting the default value, or None,
                          # so it doesn't need unpickled.
 
     def get_both(self, key, value, txn=None, flags=0):
-        data = _dumps(value, self.protocol)
+        data = self.codec.dumps(value, self.protocol)
         data = self.db.get(key, data, txn, flags)
-        return pickle.loads(data)
+        return self.codec.loads(data)
 
 
     def cursor(self, txn=None, flags=0):
         c = DBShelfCursor(self.db.cursor(txn, flags))
         c.protocol = self.protocol
+        c.codec = self.codec
         return c
 
 
     def put(self, key, value, txn=None, flags=0):
-        data = _dumps(value, self.protocol)
+        data = self.codec.dumps(value, self.protocol)
         return self.db.put(key, data, txn, flags)
 
 
     def join(self, cursorList, flags=0):
-        raise NotImplementedError
+        """Return a DBShelfJoinCursor over the items of this shelf that
+        match the current position of every cursor in cursorList.  The
+        cursors may be DBCursor or DBShelfCursor objects.
+        """
+        cursors = [getattr(c, "dbc", c) for c in cursorList]
+        c = DBShelfJoinCursor(self.db.join(cursors, flags), cursorList)
+        c.protocol = self.protocol
+        c.codec = self.codec
+        return c
 
 
     #----------------------------------------------
@@ -281,11 +609,12 @@ class DBShelfCursor:
     def dup(self, flags=0):
         c = DBShelfCursor(self.dbc.dup(flags))
         c.protocol = self.protocol
+        c.codec = self.codec
         return c
 
 
     def put(self, key, value, flags=0):
-        data = _dumps(value, self.protocol)
+        data = self.codec.dumps(value, self.protocol)
         return self.dbc.put(key, data, flags)
 
 
@@ -303,7 +632,7 @@ class DBShelfCursor:
         return self._extract(rec)
 
     def get_3(self, key, value, flags):
-        data = _dumps(value, self.protocol)
+        data = self.codec.dumps(value, self.protocol)
         rec = self.dbc.get(key, flags)
         return self._extract(rec)
 
@@ -320,7 +649,7 @@ class DBShelfCursor:
 
 
     def get_both(self, key, value, flags=0):
-        data = _dumps(value, self.protocol)
+        data = self.codec.dumps(value, self.protocol)
         rec = self.dbc.get_both(key, flags)
         return self._extract(rec)
 
@@ -346,9 +675,9 @@ class DBShelfCursor:
             key, data = rec
             # Safe in Python 2.x because expresion short circuit
             if sys.version_info[0] < 3 or isinstance(data, bytes) :
-                return key, pickle.loads(data)
+                return key, self.codec.loads(data)
             else :
-                return key, pickle.loads(bytes(data, "iso8859-1"))  # 8 bits
+                return key, self.codec.loads(bytes(data, "iso8859-1"))  # 8 bits
 
     #----------------------------------------------
     # Methods allowed to pass-through to self.dbc
@@ -357,3 +686,38 @@ class DBShelfCursor:
 
 
 #---------------------------------------------------------------------------
+
+class DBShelfJoinCursor(DBShelfCursor):
+    """A join cursor returned by DBShelf.join.  Items are unpickled one
+    at a time, as they are fetched, so it can be iterated over without
+    loading the whole result.
+    """
+    def __init__(self, cursor, cursorList):
+        DBShelfCursor.__init__(self, cursor)
+        # The join cursor uses the cursors it was built from, but
+        # doesn't hold references to them.
+        self._cursorList = list(cursorList)
+
+    def get(self, flags=0):
+        rec = self.dbc.get(flags)
+        return self._extract(rec)
+
+    def next(self, flags=0): return self.get(flags)
+
+    def __iter__(self):
+        while True:
+            try:
+                rec = self.get()
+            except db.DBNotFoundError:
+                return
+            if rec is None:
+                return
+            yield rec
+
+    #----------------------------------------------
+    # Methods allowed to pass-through to self.dbc
+    #
+    # close, join_item
+
+
+#---------------------------------------------------------------------------
@@ -188,6 +188,12 @@ class bsdTableDB :
                                 v[1].decode("iso8859-1"))
                     return v
 
+                def scan(self, prefix) :
+                    for key, data in self._dbcursor.scan(
+                            prefix=bytes(prefix, "iso8859-1")) :
+                        yield (key.decode("iso8859-1"),
+                                data.decode("iso8859-1"))
+
             class db_py3k(object) :
                 def __init__(self, db) :
                     self._db = db
@@ -702,31 +708,22 @@ class bsdTableDB :
             else:
                 savethiscolumndata = 0  # data only used for selection
 
-            try:
-                key, data = cur.set_range(searchkey)
-                while key[:len(searchkey)] == searchkey:
-                    # extract the rowid from the key
-                    rowid = key[-_rowid_str_len:]
-
-                    if not rowid in rejected_rowids:
-                        # if no condition was specified or the condition
-                        # succeeds, add row to our match list.
-                        if not condition or condition(data):
-                            if not rowid in matching_rowids:
-                                matching_rowids[rowid] = {}
-                            if savethiscolumndata:
-                                matching_rowids[rowid][column] = data
-                        else:
-                            if rowid in matching_rowids:
-                                del matching_rowids[rowid]
-                            rejected_rowids[rowid] = rowid
-
-                    key, data = next(cur)
-
-            except db.DBError as dberror:
-                if dberror.args[0] != db.DB_NOTFOUND:
-                    raise
-                continue
+            for key, data in cur.scan(prefix=searchkey):
+                # extract the rowid from the key
+                rowid = key[-_rowid_str_len:]
+
+                if not rowid in rejected_rowids:
+                    # if no condition was specified or the condition
+                    # succeeds, add row to our match list.
+                    if not condition or condition(data):
+                        if not rowid in matching_rowids:
+                            matching_rowids[rowid] = {}
+                        if savethiscolumndata:
+                            matching_rowids[rowid][column] = data
+                    else:
+                        if rowid in matching_rowids:
+                            del matching_rowids[rowid]
+                        rejected_rowids[rowid] = rowid
 
         cur.close()
 
@@ -0,0 +1,205 @@
+"""
+Copyright (c) 2008-2020, Jesus Cea Avion <jcea@jcea.es>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+    1. Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+    copyright notice, this list of conditions and the following
+    disclaimer in the documentation and/or other materials provided
+    with the distribution.
+
+    3. Neither the name of Jesus Cea Avion nor the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+    CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+    INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+    EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+    TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+    DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+    TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+    THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+    SUCH DAMAGE.
+    """
+
+
+"""
+Batching reader for the native replication transport.
+
+DBEnv.rep_set_transport_fd(envid, fd) makes Berkeley DB write every
+outgoing replication message to the file descriptor 'fd', usually one
+end of a socketpair or a pipe, as a frame:
+
+    control size, record size, LSN file, LSN offset, envid, flags
+        (big endian 32 bits integers, see FRAME_HEADER)
+    control data
+    record data
+
+without calling Python code or taking the GIL.  A FrameReader drains
+the other end, returning the messages waiting there in batches:
+
+    r, w = os.pipe()
+    env.rep_set_transport_fd(SELF_EID, w)
+    reader = reptransport.FrameReader(r)
+    while True:
+        data = reader.read_raw()        # whole frames, to ship as is
+        if data is None:
+            break                       # the write end was closed
+        send_to_the_other_sites(data)
+
+and on the receiving sites:
+
+    result = reptransport.process_frames(env, data, sender_envid)
+
+read_batch() returns the decoded messages instead of the raw frames.
+'envid' is the destination of the message, or DB_EID_BROADCAST.
+
+FrameReader uses select(), so on Windows it only works with sockets.
+"""
+
+import os
+import sys
+import errno
+import select
+import struct
+
+FRAME_HEADER = struct.Struct(">IIIIiI")
+# Bytes read with a single system call
+DEFAULT_BUFSIZE = 256 * 1024
+# A batch is returned once it holds this many bytes
+DEFAULT_MAX_BATCH = 1024 * 1024
+
+
+def split_frames(data):
+    """Generate the (control, rec, (lsn file, lsn offset), envid, flags)
+    tuples of the frames in 'data', which must hold whole frames."""
+    header = FRAME_HEADER.size
+    offset = 0
+    end = len(data)
+    while offset < end:
+        (control_size, rec_size, lsn_file, lsn_offset, envid,
+         flags) = FRAME_HEADER.unpack_from(data, offset)
+        start = offset + header
+        middle = start + control_size
+        offset = middle + rec_size
+        if offset > end:
+            raise ValueError("truncated replication frame")
+        yield (data[start:middle], data[middle:offset],
+               (lsn_file, lsn_offset), envid, flags)
+
+
+def process_frames(env, data, sender):
+    """Process in a single DBEnv.rep_process_messages() call the messages
+    in the frames 'data', sent by the site with envid 'sender', and
+    return its results.  If a message fails, the results of those
+    before it are the 'result' attribute of the exception raised."""
+    return env.rep_process_messages([(control, rec, sender)
+            for control, rec, lsn, envid, flags in split_frames(data)])
+
+
+def make_frame(control, rec, lsn, envid, flags):
+    """Return the frame of a message, as written by the native
+    transport, e.g. to send messages from a Python transport callback
+    through the same channel."""
+    return FRAME_HEADER.pack(len(control), len(rec), lsn[0], lsn[1],
+                             envid, flags) + control + rec
+
+
+class FrameReader(object):
+    """Read the frames written by the native replication transport to
+    the other end of the file descriptor 'fd'.
+
+    Every call returns all the frames already waiting, up to about
+    'max_batch' bytes, reading 'bufsize' bytes at a time.
+    """
+    def __init__(self, fd, bufsize=DEFAULT_BUFSIZE,
+                 max_batch=DEFAULT_MAX_BATCH):
+        if hasattr(fd, "fileno"):
+            fd = fd.fileno()
+        self.fd = fd
+        self.bufsize = bufsize
+        self.max_batch = max_batch
+        self._buffer = b""
+        self._eof = False
+
+    def fileno(self):
+        return self.fd
+
+    def _readable(self, timeout):
+        while True:
+            try:
+                return bool(select.select([self.fd], [], [], timeout)[0])
+            except select.error:
+                if sys.exc_info()[1].args[0] != errno.EINTR:
+                    raise
+
+    def _complete(self):
+        # Length of the whole frames in the buffer
+        buf = self._buffer
+        header = FRAME_HEADER.size
+        offset = 0
+        while len(buf) - offset >= header:
+            control_size, rec_size = struct.unpack_from(">II", buf, offset)
+            size = header + control_size + rec_size
+            if len(buf) - offset < size:
+                break
+            offset += size
+        return offset
+
+    def read_raw(self, timeout=None):
+        """Return the whole frames waiting, as a byte string, waiting up
+        to 'timeout' seconds (None waits forever) for the first one.
+        Return an empty string if none arrived in time and None once
+        the write end is closed and every frame has been read."""
+        complete = self._complete()
+        wait = timeout
+        while not self._eof and len(self._buffer) < self.max_batch:
+            if complete and wait != 0:
+                # Just take what is already there
+                wait = 0
+            if not self._readable(wait):
+                if complete or wait == 0:
+                    break
+                # Timed out
+                return b""
+            data = os.read(self.fd, self.bufsize)
+            if not data:
+                self._eof = True
+                break
+            self._buffer += data
+            complete = self._complete()
+        if self._eof and not complete:
+            if self._buffer:
+                raise ValueError("truncated replication frame")
+            return None
+        data = self._buffer[:complete]
+        self._buffer = self._buffer[complete:]
+        return data
+
+    def read_batch(self, timeout=None):
+        """Like read_raw(), but return the list of the messages waiting,
+        as tuples (control, rec, (lsn file, lsn offset), envid, flags)."""
+        data = self.read_raw(timeout)
+        if data is None:
+            return None
+        return list(split_frames(data))
+
+    def __iter__(self):
+        """Generate the batches of messages until the write end is
+        closed."""
+        while True:
+            batch = self.read_batch()
+            if batch is None:
+                return
+            yield batch
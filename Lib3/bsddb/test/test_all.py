@@ -119,10 +119,10 @@ if sys.version_info[0] >= 3 :
             v = self._dbcursor.last()
             return self._fix(v)
 
-        def set(self, k) :
+        def set(self, k, flags=0, dlen=-1, doff=-1) :
             if isinstance(k, str) :
                 k = bytes(k, charset)
-            v = self._dbcursor.set(k)
+            v = self._dbcursor.set(k, flags=flags, dlen=dlen, doff=doff)
             return self._fix(v)
 
         def set_recno(self, num) :
@@ -151,7 +151,7 @@ if sys.version_info[0] >= 3 :
             if isinstance(key, str) :
                 key = bytes(key, charset)
             if isinstance(data, str) :
-                value = bytes(data, charset)
+                data = bytes(data, charset)
             return self._dbcursor.put(key, data, flags=flags, dlen=dlen,
                     doff=doff)
 
@@ -471,7 +471,7 @@ if sys.version_info[0] >= 3 :
     do_proxy_db_py3k(True)
 
 from bsddb3 import db, dbtables, dbutils, dbshelve, \
-        hashopen, btopen, rnopen, dbobj
+        hashopen, btopen, rnopen, envopen, dbobj
 
 if sys.version_info[0] < 3 :
     from test import test_support
@@ -600,6 +600,7 @@ else :
 
 def suite(module_prefix='', timing_check=None):
     test_modules = [
+        'test_aio',
         'test_associate',
         'test_basics',
         'test_dbenv',
@@ -608,8 +609,13 @@ def suite(module_prefix='', timing_check=None):
         'test_compat',
         'test_cursor_pget_bug',
         'test_dbobj',
+        'test_dbprofile',
+        'test_dbqueue',
+        'test_dbrecio',
+        'test_dbscan',
         'test_dbshelve',
         'test_dbtables',
+        'test_dbutils',
         'test_distributed_transactions',
         'test_early_close',
         'test_fileid',
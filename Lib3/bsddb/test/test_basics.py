@@ -647,6 +647,50 @@ class BasicTestCase(unittest.TestCase):
                 compact_timeout=50000000,
                 flags=db.DB_FREELIST_ONLY|db.DB_FREE_SPACE)
 
+    def test_compact_incremental(self) :
+        d = self.d
+        for x in range(self._numKeys) :
+            if x % 10 :
+                try :
+                    d.delete('%04d' % x)
+                except db.DBNotFoundError :
+                    pass
+        start = None
+        while True :
+            result = d.compact_incremental(budget_pages=1, start=start)
+            self.assertTrue(result["slices"] >= 1)
+            self.assertTrue(result["elapsed"] >= 0)
+            start = result["next"]
+            if start is None :
+                break
+        self.assertEqual(d.get('0010'), self.makeData('0010'))
+        self.assertEqual(None, d.get('0011'))
+        result = d.compact_incremental(budget_seconds=10)
+        self.assertEqual(None, result["next"])
+        self.assertRaises(ValueError, d.compact_incremental,
+                budget_seconds=-1)
+
+    def test_compact_incremental_budget(self) :
+        if self.dbtype != db.DB_BTREE :
+            return
+        d = self.d
+        for x in range(3000) :
+            d.put('x%05d' % x, 'data')
+        # Nothing to free, the time budget still stops after a slice
+        result = d.compact_incremental(budget_seconds=1e-9)
+        self.assertEqual(1, result["slices"])
+        self.assertNotEqual(None, result["next"])
+        calls = 1
+        while result["next"] is not None :
+            result = d.compact_incremental(budget_seconds=1e-9,
+                    start=result["next"])
+            calls += 1
+        self.assertTrue(calls >= 4)
+        # Down to the stop key
+        result = d.compact_incremental(start=b'x00000', stop=b'x01500')
+        self.assertEqual(None, result["next"])
+        self.assertEqual(2, result["slices"])
+
     #----------------------------------------
 
 #----------------------------------------------------------------------
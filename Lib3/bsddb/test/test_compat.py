@@ -39,10 +39,12 @@ regression test suite.
 """
 
 import os, string
+import gc
 import unittest
+from threading import Thread
 
-from .test_all import db, hashopen, btopen, rnopen, verbose, \
-        get_new_database_path
+from .test_all import db, hashopen, btopen, rnopen, envopen, verbose, \
+        test_support, get_new_database_path, get_new_environment_path
 
 
 class CompatibilityTestCase(unittest.TestCase):
@@ -115,6 +117,141 @@ class CompatibilityTestCase(unittest.TestCase):
         f.close()
 
 
+    def test05_cursor_with_writes(self):
+        for factory in (btopen, hashopen):
+            f = factory(self.filename, 'n')
+            keys = ['%02d' % i for i in range(10)]
+            for key in keys:
+                f[key] = 'old'
+            keys = list(f.keys())
+
+            # Writes don't lose the cursor position
+            self.assertEqual((keys[0], 'old'), f.first())
+            for i in range(1, len(keys)):
+                f[keys[i-1]] = 'new'
+                self.assertEqual((keys[i], 'old'), next(f))
+            del f[keys[0]]
+            self.assertEqual((keys[-2], 'new'), f.previous())
+
+            # Writes from another thread neither
+            def writer():
+                f[keys[-1]] = 'other'
+                self.assertEqual((keys[1], 'new'), f.first())
+            t = Thread(target=writer)
+            t.start()
+            t.join()
+            self.assertEqual((keys[-1], 'other'), next(f))
+
+            # The cursors of the threads that ended are closed and freed
+            threads = [Thread(target=f.first) for i in range(10)]
+            for t in threads:
+                t.start()
+                t.join()
+            del t, threads
+            gc.collect()
+            self.assertEqual(1, len(f._cursors))
+
+            for key in f:
+                f[key] = 'again'
+            self.assertEqual(['again'] * (len(keys) - 1),
+                             [v for k, v in f.items()])
+            f.close()
+
+
+    def test06_snapshot_iteration(self):
+        for factory in (btopen, hashopen):
+            f = factory(self.filename, 'n', snapshot=True)
+            keys = ['%02d' % i for i in range(10)]
+            for key in keys:
+                f[key] = 'old'
+
+            # Changes made while iterating are not seen by the iteration
+            seen = []
+            for key in f:
+                seen.append(key)
+                if len(seen) == 1:
+                    f['zz'] = 'added'
+                    del f['05']
+                    f['06'] = 'new'
+            self.assertEqual(keys, sorted(seen))
+
+            def writer():
+                f['07'] = 'other'
+            items = getattr(f, "iteritems")()
+            first = next(items)
+            t = Thread(target=writer)
+            t.start()
+            t.join()
+            items = dict([first] + list(items))
+            self.assertEqual('new', items['06'])
+            self.assertEqual('old', items['07'])
+            self.assertEqual('other', f['07'])
+            self.assertFalse('05' in f)
+            f.close()
+
+
+    def test07_shared_environment(self):
+        homeDir = get_new_environment_path()
+        filename2 = get_new_database_path()
+        e = envopen(homeDir, cachesize=1024*1024, mmapsize=1024*1024)
+        try:
+            f = hashopen(self.filename, 'c', dbenv=e)
+            g = btopen(filename2, 'c', dbenv=e)
+            f['a'] = 'hash'
+            g['a'] = 'btree'
+            self.assertEqual('hash', f['a'])
+            self.assertEqual(('a', 'btree'), g.first())
+            self.assertRaises(db.DBError, btopen, filename2, 'c',
+                              cachesize=1024*1024, dbenv=e)
+            self.assertRaises(db.DBError, btopen, filename2, 'c',
+                              snapshot=True, dbenv=e)
+            f.close()
+            g.close()
+        finally:
+            e.close()
+            test_support.rmtree(homeDir)
+            os.remove(filename2)
+
+        homeDir = get_new_environment_path()
+        e = envopen(homeDir, transactional=True)
+        try:
+            f = btopen(self.filename, 'n', snapshot=True, dbenv=e)
+            g = rnopen(filename2, 'c', dbenv=e)
+            f['a'] = 'old'
+            g[1] = 'recno'
+            for key in f:
+                f[key] = 'new'
+            self.assertEqual([('a', 'new')], list(f.items()))
+            self.assertEqual('recno', g[1])
+            f.close()
+            g.close()
+        finally:
+            e.close()
+            test_support.rmtree(homeDir)
+            os.remove(filename2)
+
+        # 'n' recreates the file in the home of the environment, not in
+        # the current directory
+        homeDir = get_new_environment_path()
+        name = os.path.basename(get_new_database_path())
+        e = envopen(homeDir)
+        try:
+            f = btopen(name, 'c', dbenv=e)
+            f['a'] = 'old'
+            f.close()
+            sentinel = open(name, 'w')
+            sentinel.close()
+            f = btopen(name, 'n', dbenv=e)
+            self.assertEqual([], list(f.keys()))
+            self.assertTrue(os.path.exists(name))
+            f.close()
+        finally:
+            e.close()
+            test_support.rmtree(homeDir)
+            if os.path.exists(name):
+                os.remove(name)
+
+
     def do_bthash_test(self, factory, what):
         if verbose:
             print('\nTesting: ', what)
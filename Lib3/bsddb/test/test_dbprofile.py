@@ -0,0 +1,179 @@
+"""
+Copyright (c) 2008-2020, Jesus Cea Avion <jcea@jcea.es>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+    1. Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+    copyright notice, this list of conditions and the following
+    disclaimer in the documentation and/or other materials provided
+    with the distribution.
+
+    3. Neither the name of Jesus Cea Avion nor the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+    CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+    INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+    EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+            TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+            DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+    TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+    THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+    SUCH DAMAGE.
+    """
+
+"""
+TestCases for the dbprofile module.
+"""
+
+import sys
+import json
+import csv
+import io
+import unittest
+
+from .test_all import db, test_support, verbose, get_new_environment_path
+from bsddb3 import dbprofile
+
+#----------------------------------------------------------------------
+
+class ProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        if sys.version_info[0] >= 3 :
+            from .test_all import do_proxy_db_py3k
+            self._flag_proxy_db_py3k = do_proxy_db_py3k(False)
+        self.homeDir = get_new_environment_path()
+        self.env = db.DBEnv()
+        self.env.open(self.homeDir, db.DB_CREATE | db.DB_INIT_MPOOL |
+                      db.DB_INIT_LOCK | db.DB_INIT_LOG | db.DB_INIT_TXN |
+                      db.DB_THREAD)
+        self.d = db.DB(self.env)
+        self.d.open("test.db", db.DB_BTREE,
+                    db.DB_CREATE | db.DB_AUTO_COMMIT)
+
+    def tearDown(self):
+        if sys.version_info[0] >= 3 :
+            from .test_all import do_proxy_db_py3k
+            do_proxy_db_py3k(self._flag_proxy_db_py3k)
+        self.d.close()
+        self.env.close()
+        test_support.rmtree(self.homeDir)
+
+    def test01_series(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test01_series..." % \
+                  self.__class__.__name__)
+
+        profiler = dbprofile.Profiler(self.env, max_samples=2)
+        profiler.sample()
+        for i in range(10):
+            self.d.put(("%02d" % i).encode("ascii"), b"data")
+        profiler.sample()
+        self.assertEqual(2, len(profiler.samples()))
+
+        first, second = profiler.series()
+        self.assertTrue("txn.ncommits" in first)
+        self.assertFalse("txn.ncommits.delta" in first)
+        self.assertEqual(10, second["txn.ncommits.delta"])
+        self.assertTrue(second["interval"] >= 0)
+        self.assertTrue("lock.nrequests.delta" in second)
+        self.assertTrue([name for name in second
+                         if name.startswith("mpool[")])
+
+        profiler.sample()
+        self.assertEqual(2, len(profiler.samples()))
+
+    def test02_thread(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test02_thread..." % \
+                  self.__class__.__name__)
+
+        with dbprofile.Profiler(self.env, interval=0.01,
+                                stats=("txn",)) as profiler:
+            self.d.put(b"key", b"data")
+        samples = profiler.samples()
+        self.assertTrue(len(samples) >= 2)
+        self.assertFalse("lock.nrequests" in samples[-1])
+        self.assertRaises(ValueError, dbprofile.Profiler, self.env,
+                          stats=("nothing",))
+
+    def test03_errors(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test03_errors..." % \
+                  self.__class__.__name__)
+
+        profiler = dbprofile.Profiler(self.env)
+        profiler.sample()
+
+        @profiler.watch()
+        def conflict():
+            raise db.DBLockNotGrantedError(db.DB_LOCK_NOTGRANTED,
+                                           "Not granted")
+        for i in range(3):
+            self.assertRaises(db.DBLockNotGrantedError, conflict)
+        # Other exceptions are not counted
+        def other():
+            with profiler.watch():
+                raise ValueError
+        self.assertRaises(ValueError, other)
+
+        errors = profiler.errors()
+        self.assertEqual(1, len(errors))
+        site, count = list(errors.items())[0]
+        self.assertTrue(site.endswith(" conflict"))
+        self.assertEqual(3, count)
+
+        profiler.sample()
+        row = profiler.series()[-1]
+        self.assertEqual(3, row["errors"])
+        self.assertEqual(3, row["errors[%s]" % site])
+        self.assertEqual(3, row["errors.delta"])
+
+    def test04_export(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test04_export..." % \
+                  self.__class__.__name__)
+
+        profiler = dbprofile.Profiler(self.env, stats=("txn", "lock"))
+        profiler.sample()
+        self.d.put(b"key", b"data")
+        profiler.sample()
+
+        f = io.StringIO()
+        profiler.to_json(f)
+        rows = json.loads(f.getvalue())
+        self.assertEqual(2, len(rows))
+        self.assertEqual(1, rows[1]["txn.ncommits.delta"])
+
+        f = io.StringIO()
+        profiler.to_csv(f)
+        f.seek(0)
+        rows = list(csv.DictReader(f))
+        self.assertEqual(2, len(rows))
+        self.assertEqual("", rows[0]["interval"])
+        self.assertEqual("1", rows[1]["txn.ncommits.delta"])
+
+
+#----------------------------------------------------------------------
+
+def test_suite():
+    return unittest.makeSuite(ProfilerTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
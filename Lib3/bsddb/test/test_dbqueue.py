@@ -0,0 +1,214 @@
+"""
+Copyright (c) 2008-2020, Jesus Cea Avion <jcea@jcea.es>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+    1. Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+    copyright notice, this list of conditions and the following
+    disclaimer in the documentation and/or other materials provided
+    with the distribution.
+
+    3. Neither the name of Jesus Cea Avion nor the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+    CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+    INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+    EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+            TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+            DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+    TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+    THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+    SUCH DAMAGE.
+    """
+
+"""
+TestCases for the dbqueue module.
+"""
+
+import sys
+import time
+import unittest
+
+from .test_all import db, test_support, verbose, get_new_environment_path
+from bsddb3 import dbqueue
+
+#----------------------------------------------------------------------
+
+class WorkQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        if sys.version_info[0] >= 3 :
+            from .test_all import do_proxy_db_py3k
+            self._flag_proxy_db_py3k = do_proxy_db_py3k(False)
+        self.homeDir = get_new_environment_path()
+        self.env = db.DBEnv()
+        self.env.set_lk_detect(db.DB_LOCK_DEFAULT)
+        self.env.set_flags(db.DB_TIME_NOTGRANTED, True)
+        self.env.open(self.homeDir, db.DB_CREATE | db.DB_INIT_MPOOL |
+                      db.DB_INIT_LOCK | db.DB_INIT_LOG | db.DB_INIT_TXN |
+                      db.DB_THREAD)
+        self.queue = dbqueue.WorkQueue(self.env, "test", max_size=64,
+                                       reap_interval=0)
+
+    def tearDown(self):
+        if sys.version_info[0] >= 3 :
+            from .test_all import do_proxy_db_py3k
+            do_proxy_db_py3k(self._flag_proxy_db_py3k)
+        self.queue.close()
+        self.env.close()
+        test_support.rmtree(self.homeDir)
+
+    def test01_put_get_ack(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test01_put_get_ack..." % \
+                  self.__class__.__name__)
+
+        self.queue.put(b"first")
+        self.queue.put_many([b"second", b"third", b""])
+        self.assertRaises(ValueError, self.queue.put, b"x" * 65)
+
+        message = self.queue.get(timeout=0)
+        self.assertEqual(b"first", message.data)
+        self.assertEqual(1, message.attempts)
+        messages = self.queue.get_many(10, timeout=0)
+        self.assertEqual([b"second", b"third", b""],
+                         [m.data for m in messages])
+        self.assertEqual({"queued": 0, "leased": 4, "dead": 0},
+                         self.queue.stat())
+
+        self.assertTrue(self.queue.ack(message))
+        self.assertFalse(self.queue.ack(message))
+        for m in messages:
+            self.assertTrue(self.queue.ack(m.id))
+        self.assertEqual({"queued": 0, "leased": 0, "dead": 0},
+                         self.queue.stat())
+
+        # Nothing left
+        start = time.time()
+        self.assertEqual(None, self.queue.get(timeout=0.2))
+        self.assertTrue(time.time() - start >= 0.2)
+
+    def test02_nack(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test02_nack..." % \
+                  self.__class__.__name__)
+
+        self.queue.put(b"job")
+        message = self.queue.get(timeout=0)
+        self.assertTrue(self.queue.nack(message))
+        self.assertFalse(self.queue.ack(message))
+        message = self.queue.get(timeout=0)
+        self.assertEqual(b"job", message.data)
+        self.assertEqual(2, message.attempts)
+
+        # Delivered again after the delay
+        self.assertTrue(self.queue.nack(message, delay=0.2))
+        self.assertEqual(None, self.queue.get(timeout=0))
+        message = self.queue.get(timeout=5)
+        self.assertEqual(3, message.attempts)
+        self.queue.ack(message)
+
+    def test03_visibility_timeout(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test03_visibility_timeout..." % \
+                  self.__class__.__name__)
+
+        self.queue.put(b"job")
+        message = self.queue.get(timeout=0, visibility_timeout=0.1)
+        time.sleep(0.2)
+        self.assertEqual(1, self.queue.requeue_expired())
+        self.assertFalse(self.queue.ack(message))
+        message = self.queue.get(timeout=0)
+        self.assertEqual(b"job", message.data)
+        self.assertEqual(2, message.attempts)
+        self.assertTrue(self.queue.ack(message))
+
+    def test04_dead_letters(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test04_dead_letters..." % \
+                  self.__class__.__name__)
+
+        self.queue.max_attempts = 2
+        self.queue.put(b"poison")
+        for i in range(2):
+            message = self.queue.get(timeout=0, visibility_timeout=0)
+            self.assertEqual(i + 1, message.attempts)
+        # Expired twice
+        self.assertEqual(None, self.queue.get(timeout=0))
+        dead = self.queue.get_dead(10)
+        self.assertEqual([b"poison"], [m.data for m in dead])
+        self.assertEqual(2, dead[0].attempts)
+        self.assertEqual([], self.queue.get_dead())
+
+    def test05_persistence(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test05_persistence..." % \
+                  self.__class__.__name__)
+
+        self.queue.put_many([b"one", b"two"])
+        message = self.queue.get(timeout=0, visibility_timeout=0)
+        self.queue.close()
+
+        # The lease survives the consumer and has expired
+        self.queue = dbqueue.WorkQueue(self.env, "test", max_size=1000)
+        self.assertEqual(64, self.queue.max_size)
+        messages = self.queue.get_many(10, timeout=0)
+        self.assertEqual([b"two", b"one"], [m.data for m in messages])
+        self.assertEqual([1, 2], [m.attempts for m in messages])
+
+    def test06_wait(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test06_wait..." % \
+                  self.__class__.__name__)
+
+        from threading import Thread
+        def producer():
+            time.sleep(0.2)
+            self.queue.put(b"late")
+        t = Thread(target=producer)
+        t.start()
+        message = self.queue.get(timeout=10)
+        t.join()
+        self.assertEqual(b"late", message.data)
+
+    def test07_short_timeout(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test07_short_timeout..." % \
+                  self.__class__.__name__)
+
+        # Timeouts shorter than a wait for the queue don't block
+        for timeout in (1e-7, 0.001, 0.005) :
+            start = time.time()
+            self.assertEqual([], self.queue.get_many(5, timeout=timeout))
+            self.assertTrue(time.time() - start < 5)
+        self.queue.put(b"one")
+        message = self.queue.get(timeout=1e-7)
+        self.assertEqual(b"one", message.data)
+
+
+#----------------------------------------------------------------------
+
+def test_suite():
+    return unittest.makeSuite(WorkQueueTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,317 @@
+"""
+Copyright (c) 2008-2020, Jesus Cea Avion <jcea@jcea.es>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+    1. Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+    copyright notice, this list of conditions and the following
+    disclaimer in the documentation and/or other materials provided
+    with the distribution.
+
+    3. Neither the name of Jesus Cea Avion nor the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+    CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+    INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+    EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+            TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+            DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+    TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+    THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+    SUCH DAMAGE.
+    """
+
+"""
+TestCases for DBRecIO, file-like access to a database record, and for
+BlobStore.
+"""
+
+import os, sys
+import io
+import unittest
+
+from .test_all import db, test_support, verbose, get_new_database_path
+
+from bsddb3 import dbrecio
+
+#----------------------------------------------------------------------
+
+class DBRecIOTestCase(unittest.TestCase):
+    def setUp(self):
+        if sys.version_info[0] >= 3 :
+            from .test_all import do_proxy_db_py3k
+            self._flag_proxy_db_py3k = do_proxy_db_py3k(False)
+        self.filename = get_new_database_path()
+        self.d = db.DB()
+        self.d.set_pagesize(512)
+        self.d.open(self.filename, db.DB_BTREE, db.DB_CREATE)
+        self.lines = [("line %d\n" % i).encode("ascii") for i in range(1000)]
+        self.text = b''.join(self.lines)
+
+    def tearDown(self):
+        if sys.version_info[0] >= 3 :
+            from .test_all import do_proxy_db_py3k
+            do_proxy_db_py3k(self._flag_proxy_db_py3k)
+        self.d.close()
+        test_support.unlink(self.filename)
+
+    def test01_write_read(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test01_write_read..." % \
+                  self.__class__.__name__)
+
+        f = dbrecio.DBRecIO(self.d, b"record")
+        self.assertEqual(0, f.len)
+        for line in self.lines[:-2]:
+            f.write(line)
+        f.writelines(self.lines[-2:])
+        self.assertEqual(len(self.text), f.tell())
+        f.close()
+        self.assertEqual(self.text, self.d.get(b"record"))
+
+        f = dbrecio.DBRecIO(self.d, b"record")
+        self.assertEqual(len(self.text), f.len)
+        self.assertEqual(self.text, f.read())
+        f.seek(len(self.lines[0]))
+        self.assertEqual(self.lines[1], f.read(len(self.lines[1])))
+        f.seek(-len(self.lines[-1]), 2)
+        self.assertEqual(self.lines[-1], f.read())
+        self.assertEqual(b'', f.read())
+        b = bytearray(4)
+        f.seek(0)
+        self.assertEqual(4, f.readinto(b))
+        self.assertEqual(b"line", bytes(b))
+        f.close()
+
+    def test02_readline(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test02_readline..." % \
+                  self.__class__.__name__)
+
+        self.d.put(b"record", self.text)
+        f = dbrecio.DBRecIO(self.d, b"record")
+        self.assertEqual(self.lines[0], f.readline())
+        self.assertEqual(self.lines[1][:3], f.readline(3))
+        self.assertEqual(self.lines[1][3:], f.readline())
+        self.assertEqual(self.lines[2:], f.readlines())
+        f.seek(0)
+        self.assertEqual(self.lines, list(f))
+        f.close()
+
+    def test03_seek_truncate(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test03_seek_truncate..." % \
+                  self.__class__.__name__)
+
+        f = dbrecio.DBRecIO(self.d, b"record")
+        f.write(b"0123456789")
+        f.seek(3)
+        f.write(b"abc")
+        self.assertEqual(6, f.tell())
+        f.seek(0)
+        self.assertEqual(b"012abc6789", f.read())
+        f.seek(15)
+        f.write(b"X")
+        f.flush()
+        self.assertEqual(b"012abc6789\0\0\0\0\0X", self.d.get(b"record"))
+        self.assertEqual(4, f.truncate(4))
+        self.assertEqual(b"012a", self.d.get(b"record"))
+        self.assertRaises(ValueError, f.seek, -1)
+        f.close()
+        self.assertRaises(ValueError, f.read)
+
+    def test04_view(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test04_view..." % \
+                  self.__class__.__name__)
+
+        self.d.put(b"record", self.text)
+        f = dbrecio.DBRecIO(self.d, b"record")
+        v = f.view(7, 10)
+        self.assertEqual(self.text[7:17], v.tobytes())
+        self.assertEqual(0, f.tell())
+        self.assertEqual(self.text[-20:],
+                         f.view(len(self.text) - 20).tobytes())
+        self.assertEqual(self.text, f.view().tobytes())
+        self.assertEqual(0, len(f.view(len(self.text) + 10)))
+        self.assertRaises(ValueError, f.view, -1)
+
+        # Straight into a caller's buffer
+        buf = bytearray(100)
+        v = f.view(14, 50, buffer=buf)
+        self.assertEqual(50, len(v))
+        self.assertEqual(self.text[14:64], bytes(buf[:50]))
+        self.assertRaises(ValueError, f.view, 0, 101, buffer=buf)
+        if hasattr(self.d, "get_into"):
+            self.assertRaises(ValueError, self.d.get_into, b"record", buf,
+                              doff=-1)
+
+        # Unflushed writes are seen
+        f.seek(0)
+        f.write(b"LINE")
+        self.assertEqual(b"LINE 0\n", f.view(0, 7).tobytes())
+
+        # A big readinto() doesn't go through the read-ahead buffer
+        buf = bytearray(2000)
+        f.seek(7)
+        self.assertEqual(2000, f.readinto(buf))
+        self.assertEqual(self.text[7:2007], bytes(buf))
+        self.assertEqual(2007, f.tell())
+        f.close()
+
+
+class BlobStoreTestCase(unittest.TestCase):
+    dbtype = db.DB_BTREE
+    dbopenflags = db.DB_THREAD
+
+    def setUp(self):
+        if sys.version_info[0] >= 3 :
+            from .test_all import do_proxy_db_py3k
+            self._flag_proxy_db_py3k = do_proxy_db_py3k(False)
+        self.filename = get_new_database_path()
+        self.d = db.DB()
+        self.d.open(self.filename, self.dbtype,
+                    db.DB_CREATE | self.dbopenflags)
+        self.store = dbrecio.BlobStore(self.d, chunksize=1000)
+        self.data = b''.join([("%06d" % i).encode("ascii")
+                              for i in range(2000)])
+
+    def tearDown(self):
+        if sys.version_info[0] >= 3 :
+            from .test_all import do_proxy_db_py3k
+            do_proxy_db_py3k(self._flag_proxy_db_py3k)
+        self.d.close()
+        test_support.unlink(self.filename)
+
+    def test01_put_get(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test01_put_get..." % \
+                  self.__class__.__name__)
+
+        self.assertEqual(len(self.data), self.store.put(b"blob", self.data))
+        self.assertTrue(self.store.exists(b"blob"))
+        self.assertFalse(self.store.exists(b"other"))
+        self.assertEqual(len(self.data), self.store.size(b"blob"))
+        self.assertEqual(self.data, self.store.get(b"blob"))
+        self.assertEqual(self.data, self.store.get(b"blob", workers=4))
+        # Twelve chunks and the metadata record
+        self.assertEqual(13, len(list(self.d.keys())))
+
+        self.store.put(b"blob", io.BytesIO(self.data[:2500]))
+        self.assertEqual(self.data[:2500], self.store.get(b"blob"))
+        self.assertEqual(4, len(list(self.d.keys())))
+
+        self.store.put(b"other", b"")
+        self.assertEqual(b"", self.store.get(b"other"))
+        self.assertEqual([b"blob", b"other"], sorted(self.store.names()))
+        self.store.delete(b"blob")
+        self.assertEqual([b"other"], list(self.store.names()))
+        self.assertEqual(1, len(list(self.d.keys())))
+        self.assertRaises(IOError, self.store.get, b"blob")
+        self.assertRaises(IOError, self.store.open, b"blob", 'r')
+
+    def test02_random_access(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test02_random_access..." % \
+                  self.__class__.__name__)
+
+        self.store.put(b"blob", self.data)
+        f = self.store.open(b"blob", 'r+')
+        f.seek(995)
+        self.assertEqual(self.data[995:1010], f.read(15))
+        f.seek(1998)
+        f.write(b"XXXX")
+        f.seek(-6, 2)
+        self.assertEqual(self.data[-6:], f.read())
+        f.seek(len(self.data) + 1500)
+        f.write(b"END")
+        f.close()
+        self.assertRaises(ValueError, f.read)
+
+        expected = (self.data[:1998] + b"XXXX" + self.data[2002:] +
+                    b"\0" * 1500 + b"END")
+        self.assertEqual(expected, self.store.get(b"blob"))
+        self.assertEqual(len(expected), self.store.size(b"blob"))
+
+        f = self.store.open(b"blob", 'r+')
+        self.assertEqual(2500, f.truncate(2500))
+        f.close()
+        self.assertEqual(expected[:2500], self.store.get(b"blob"))
+
+        f = self.store.open(b"blob", 'a')
+        f.write(b"tail")
+        f.seek(0)
+        f.write(b"more")
+        f.close()
+        self.assertEqual(expected[:2500] + b"tailmore",
+                         self.store.get(b"blob"))
+
+        f = self.store.open(b"blob")
+        self.assertRaises(io.UnsupportedOperation, f.write, b"x")
+        f.close()
+
+    def test03_checksums(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test03_checksums..." % \
+                  self.__class__.__name__)
+
+        import hashlib, zlib
+        self.store.put(b"blob", self.data)
+        self.assertEqual(hashlib.sha256(self.data).hexdigest(),
+                         self.store.checksum(b"blob"))
+        self.assertEqual(hashlib.md5(self.data).hexdigest(),
+                         self.store.checksum(b"blob", "md5"))
+        self.assertEqual("%08x" % (zlib.crc32(self.data) & 0xffffffff),
+                         self.store.checksum(b"blob", "crc32"))
+
+        # Corrupt a chunk behind the store's back
+        key = self.store._chunk_key(b"blob", 3)
+        self.d.put(key, b"garbage", dlen=7, doff=0)
+        self.assertRaises(dbrecio.BlobStoreError, self.store.get, b"blob")
+        self.store.get(b"blob", verify=False)
+
+        # Random writes drop the stored checksum
+        f = self.store.open(b"blob", 'r+')
+        f.seek(10)
+        f.write(b"x")
+        f.close()
+        self.assertEqual(None, self.store._get_meta(b"blob")[2])
+        self.store.get(b"blob")
+
+
+class BlobStoreHashTestCase(BlobStoreTestCase):
+    dbtype = db.DB_HASH
+    dbopenflags = 0
+
+
+#----------------------------------------------------------------------
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(DBRecIOTestCase))
+    suite.addTest(unittest.makeSuite(BlobStoreTestCase))
+    suite.addTest(unittest.makeSuite(BlobStoreHashTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
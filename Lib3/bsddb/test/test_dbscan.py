@@ -0,0 +1,246 @@
+"""
+Copyright (c) 2008-2020, Jesus Cea Avion <jcea@jcea.es>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+    1. Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+    copyright notice, this list of conditions and the following
+    disclaimer in the documentation and/or other materials provided
+    with the distribution.
+
+    3. Neither the name of Jesus Cea Avion nor the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+    CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+    INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+    EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+            TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+            DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+    TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+    THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+    SUCH DAMAGE.
+    """
+"""
+TestCases for the dbscan module and the DBCursor.next_many() and
+DBCursor.scan() bulk reads.
+"""
+
+import sys
+import unittest
+
+from .test_all import db, test_support, verbose, get_new_environment_path
+from bsddb3 import dbscan
+
+#----------------------------------------------------------------------
+
+def _count(records):
+    # Module level, to be pickled for the worker processes
+    return sum([1 for key, data in records])
+
+
+class ParallelScanTestCase(unittest.TestCase):
+    records = 20000
+
+    def setUp(self):
+        if sys.version_info[0] >= 3 :
+            from .test_all import do_proxy_db_py3k
+            self._flag_proxy_db_py3k = do_proxy_db_py3k(False)
+        self.homeDir = get_new_environment_path()
+        self.env = db.DBEnv()
+        self.env.open(self.homeDir, db.DB_CREATE | db.DB_INIT_MPOOL |
+                      db.DB_THREAD)
+        self.d = db.DB(self.env)
+        self.d.open("test", db.DB_BTREE, db.DB_CREATE | db.DB_THREAD)
+        for i in range(self.records):
+            key = ("%06d" % (i * 7)).encode("ascii")
+            self.d.put(key, key * 3)
+
+    def tearDown(self):
+        if sys.version_info[0] >= 3 :
+            from .test_all import do_proxy_db_py3k
+            do_proxy_db_py3k(self._flag_proxy_db_py3k)
+        self.d.close()
+        self.env.close()
+        test_support.rmtree(self.homeDir)
+
+    def test01_next_many(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test01_next_many..." % \
+                  self.__class__.__name__)
+
+        c = self.d.cursor()
+        records = []
+        while True:
+            batch = c.next_many(4096)
+            if not batch:
+                break
+            records.extend(batch)
+        self.assertEqual(self.records, len(records))
+        self.assertEqual((b"000000", b"000000" * 3), records[0])
+        self.assertEqual(sorted(records), records)
+
+        # One bulk fetch stops before 'stop'
+        c.set(b"000700")
+        batch = c.next_many(stop=b"000735")
+        self.assertEqual([b"000707", b"000714", b"000721", b"000728"],
+                         [key for key, data in batch])
+        self.assertEqual([], c.next_many(stop=b"000735"))
+        c.close()
+
+    def test02_partition_ranges(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test02_partition_ranges..." % \
+                  self.__class__.__name__)
+
+        ranges = dbscan.partition_ranges(self.d, 4)
+        self.assertEqual(4, len(ranges))
+        self.assertEqual(None, ranges[0][0])
+        self.assertEqual(None, ranges[-1][1])
+        for (start1, stop1), (start2, stop2) in zip(ranges, ranges[1:]):
+            self.assertEqual(stop1, start2)
+        counts = [_count(dbscan.scan_range(self.d, start, stop))
+                  for start, stop in ranges]
+        self.assertEqual(self.records, sum(counts))
+        for count in counts:
+            self.assertTrue(self.records // 8 < count < self.records // 2)
+
+        self.assertEqual([(None, None)], dbscan.partition_ranges(self.d, 1))
+        self.assertRaises(ValueError, dbscan.partition_ranges, self.d, 0)
+
+    def test03_parallel_scan(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test03_parallel_scan..." % \
+                  self.__class__.__name__)
+
+        counts = dbscan.parallel_scan(self.d, _count, 4)
+        self.assertEqual(self.records, sum(counts))
+
+        def get_keys(records):
+            return [key for key, data in records]
+        keys = dbscan.parallel_scan(self.d, get_keys, 2,
+                ranges=dbscan.partition_ranges(self.d, 8))
+        self.assertEqual(8, len(keys))
+        self.assertEqual(list(self.d.keys()), sum(keys, []))
+
+        def fail(records):
+            raise ValueError
+        self.assertRaises(ValueError, dbscan.parallel_scan, self.d, fail)
+
+    def test04_processes(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test04_processes..." % \
+                  self.__class__.__name__)
+
+        try:
+            import multiprocessing
+        except ImportError:
+            return
+        counts = dbscan.parallel_scan(self.d, _count, 2, processes=True,
+                                      env=self.env)
+        self.assertEqual(self.records, sum(counts))
+
+    def test05_scan(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test05_scan..." % \
+                  self.__class__.__name__)
+
+        def keys(**kwargs):
+            c = self.d.cursor()
+            try:
+                return [key for key, data in c.scan(**kwargs)]
+            finally:
+                c.close()
+
+        everything = list(self.d.keys())
+        self.assertEqual(everything, keys())
+        self.assertEqual(everything[::-1], keys(reverse=True))
+        self.assertEqual([b"000700", b"000707", b"000714"],
+                         keys(start=b"000700", stop=b"000721"))
+        self.assertEqual([b"000714", b"000707", b"000700"],
+                         keys(start=b"000699", stop=b"000720", reverse=True))
+        self.assertEqual([b"001001", b"001008", b"001015"],
+                         keys(prefix=b"0010", limit=3))
+        prefixed = [key for key in everything if key.startswith(b"0010")]
+        self.assertEqual(prefixed, keys(prefix=b"0010"))
+        self.assertEqual(prefixed[::-1], keys(prefix=b"0010", reverse=True))
+        self.assertEqual(prefixed[2:5],
+                keys(prefix=b"0010", start=b"001011", stop=b"001036"))
+        self.assertEqual([], keys(prefix=b"9"))
+        self.assertEqual([], keys(prefix=b"9", reverse=True))
+        self.assertEqual([], keys(stop=b"000000", reverse=True))
+        self.assertEqual([], keys(start=b"5"))
+        self.assertEqual([], keys(limit=0))
+
+        c = self.d.cursor()
+        self.assertEqual([b"000000", b"000007"],
+                         list(c.scan(keys_only=True, limit=2)))
+        self.assertEqual([(b"000007", b"000007" * 3)],
+                         list(c.scan(start=b"000007", limit=1)))
+        self.assertRaises(ValueError, c.scan, limit=-1)
+        c.close()
+        self.assertRaises(db.DBCursorClosedError, c.scan)
+
+        # Buffers smaller than a record are enlarged
+        self.d.put(b"000007", b"x" * 100000)
+        c = self.d.cursor()
+        self.assertEqual([b"000000", b"000007", b"000014"],
+                         [key for key, data in c.scan(limit=3, bufsize=0)])
+        self.assertEqual(100000, len(list(c.scan(prefix=b"000007"))[0][1]))
+        c.close()
+
+    def test06_keys_values_only(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test06_keys_values_only..." % \
+                  self.__class__.__name__)
+
+        self.d.put(b"000007", b"x" * 100000)
+        c = self.d.cursor()
+        keys = c.next_many(keys_only=True, stop=b"000021")
+        self.assertEqual([b"000000", b"000007", b"000014"], keys)
+        values = c.next_many(values_only=True, stop=b"000042")
+        self.assertEqual([b"000021" * 3, b"000028" * 3, b"000035" * 3],
+                         values)
+        c.close()
+
+        c = self.d.cursor()
+        self.assertEqual([b"000014", b"000007", b"000000"],
+                         list(c.scan(stop=b"000021", reverse=True,
+                                     keys_only=True)))
+        self.assertEqual([b"000000", b"000007", b"000014"],
+                         list(c.scan(limit=3, keys_only=True, bufsize=0)))
+        self.assertEqual([b"000000" * 3, b"x" * 100000, b"000014" * 3],
+                         list(c.scan(limit=3, values_only=True)))
+        self.assertEqual(list(self.d.keys()), list(c.scan(keys_only=True)))
+        self.assertRaises(ValueError, c.scan, keys_only=True,
+                          values_only=True)
+        self.assertRaises(ValueError, c.next_many, keys_only=True,
+                          values_only=True)
+        c.close()
+
+
+#----------------------------------------------------------------------
+
+def test_suite():
+    return unittest.makeSuite(ParallelScanTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,423 @@
+"""
+Copyright (c) 2008-2020, Jesus Cea Avion <jcea@jcea.es>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+    1. Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+    copyright notice, this list of conditions and the following
+    disclaimer in the documentation and/or other materials provided
+    with the distribution.
+
+    3. Neither the name of Jesus Cea Avion nor the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+    CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+    INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+    MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+    EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+            TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+            DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+    TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+    THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+    SUCH DAMAGE.
+    """
+
+"""
+TestCases for the helpers of the dbutils module.
+"""
+
+import os, sys
+import unittest
+
+from .test_all import db, dbutils, test_support, verbose, \
+        get_new_environment_path
+
+#----------------------------------------------------------------------
+
+def _deadlock():
+    return db.DBLockDeadlockError(db.DB_LOCK_DEADLOCK, "Deadlock")
+
+class Flaky(object):
+    """A callable that raises 'failures' deadlocks before returning."""
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise _deadlock()
+        return args
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+    def setUp(self):
+        dbutils.reset_deadlock_stats()
+
+    def test01_sleeps(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test01_sleeps..." % \
+                  self.__class__.__name__)
+
+        def first(policy, n=8):
+            sleeps = policy.sleeps()
+            return [next(sleeps) for i in range(n)]
+
+        policy = dbutils.RetryPolicy(None, min_sleep=0.5, max_sleep=10)
+        self.assertEqual([0.5, 1, 2, 4, 8, 10, 10, 10], first(policy))
+        policy = dbutils.RetryPolicy("full", min_sleep=0.5, max_sleep=10)
+        for sleeptime, backoff in zip(first(policy),
+                                      [0.5, 1, 2, 4, 8, 10, 10, 10]):
+            self.assertTrue(0 <= sleeptime <= backoff)
+        policy = dbutils.RetryPolicy("decorrelated", min_sleep=0.5,
+                                     max_sleep=10)
+        previous = 0.5
+        for sleeptime in first(policy, 100):
+            self.assertTrue(0.5 <= sleeptime <= min(10, previous * 3))
+            previous = sleeptime
+        self.assertRaises(ValueError, dbutils.RetryPolicy, "none")
+
+    def test02_DeadlockWrap(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test02_DeadlockWrap..." % \
+                  self.__class__.__name__)
+
+        policy = dbutils.RetryPolicy(min_sleep=0.001, max_sleep=0.002)
+        f = Flaky(3)
+        self.assertEqual((1, 2), dbutils.DeadlockWrap(f, 1, 2,
+                                                      retry_policy=policy))
+        self.assertEqual(4, f.calls)
+        stats = dbutils.deadlock_stats()
+        self.assertEqual(3, stats["deadlocks"])
+        self.assertEqual(3, stats["retries"])
+        self.assertEqual(0, stats["failures"])
+        self.assertTrue(0 <= stats["sleep_time"] <= 0.006)
+
+        f = Flaky(3)
+        self.assertRaises(db.DBLockDeadlockError, dbutils.DeadlockWrap, f,
+                          max_retries=2, retry_policy=policy)
+        self.assertEqual(3, f.calls)
+        self.assertEqual(1, dbutils.deadlock_stats()["failures"])
+
+        # Give up when the time budget is spent
+        policy = dbutils.RetryPolicy(None, min_sleep=0.01, budget=0.05)
+        f = Flaky(1000)
+        self.assertRaises(db.DBLockDeadlockError, policy, f)
+        self.assertTrue(3 <= f.calls <= 5)
+
+        # Other exceptions are not retried
+        f = Flaky(0)
+        self.assertRaises(TypeError, dbutils.DeadlockWrap, f, x=1)
+        self.assertEqual(0, f.calls)
+
+        dbutils.reset_deadlock_stats()
+        self.assertEqual(0, dbutils.deadlock_stats()["deadlocks"])
+
+
+class TxnTestCase(unittest.TestCase):
+    def setUp(self):
+        if sys.version_info[0] >= 3 :
+            from .test_all import do_proxy_db_py3k
+            self._flag_proxy_db_py3k = do_proxy_db_py3k(False)
+        self.homeDir = get_new_environment_path()
+        self.env = db.DBEnv()
+        self.env.open(self.homeDir, db.DB_CREATE | db.DB_INIT_MPOOL |
+                      db.DB_INIT_LOCK | db.DB_INIT_LOG | db.DB_INIT_TXN |
+                      db.DB_THREAD)
+        self.d = db.DB(self.env)
+        self.d.open("test", db.DB_BTREE, db.DB_CREATE | db.DB_AUTO_COMMIT)
+        dbutils.reset_deadlock_stats()
+
+    def tearDown(self):
+        if sys.version_info[0] >= 3 :
+            from .test_all import do_proxy_db_py3k
+            do_proxy_db_py3k(self._flag_proxy_db_py3k)
+        self.d.close()
+        self.env.close()
+        test_support.rmtree(self.homeDir)
+
+
+class DeadlockWrapTxnTestCase(TxnTestCase):
+    def test01_retry(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test01_retry..." % \
+                  self.__class__.__name__)
+
+        attempts = []
+        def work(txn, key):
+            attempts.append(txn)
+            data = ("attempt %d" % len(attempts)).encode("ascii")
+            self.d.put(key, data, txn=txn)
+            if len(attempts) < 3:
+                raise _deadlock()
+            return len(attempts)
+
+        policy = dbutils.RetryPolicy(min_sleep=0.001)
+        self.assertEqual(3, dbutils.DeadlockWrapTxn(self.env, work, b"key",
+                                                    retry_policy=policy))
+        self.assertEqual(b"attempt 3", self.d.get(b"key"))
+        self.assertEqual(2, dbutils.deadlock_stats()["retries"])
+
+        # A failure that isn't a deadlock aborts the transaction
+        def fail(txn):
+            self.d.put(b"other", b"data", txn=txn)
+            raise ValueError
+        self.assertRaises(ValueError, dbutils.DeadlockWrapTxn, self.env,
+                          fail)
+        self.assertEqual(None, self.d.get(b"other"))
+
+
+class TransactionalTestCase(TxnTestCase):
+    def test02_decorator(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test02_decorator..." % \
+                  self.__class__.__name__)
+
+        policy = dbutils.RetryPolicy(min_sleep=0.001,
+                                     exceptions=(db.DBLockDeadlockError,))
+        attempts = []
+        @dbutils.transactional(self.env, retries=5, policy=policy)
+        def work(key, data, txn=None):
+            attempts.append(txn)
+            self.d.put(key, data, txn=txn)
+            if len(attempts) < 3:
+                raise _deadlock()
+            return data
+
+        self.assertEqual("work", work.__name__)
+        self.assertEqual(b"data", work(b"key", b"data"))
+        self.assertEqual(3, len(attempts))
+        self.assertEqual(b"data", self.d.get(b"key"))
+
+        @dbutils.transactional(self.env, retries=1, policy=policy)
+        def fail(txn=None):
+            self.d.put(b"other", b"data", txn=txn)
+            raise _deadlock()
+        self.assertRaises(db.DBLockDeadlockError, fail)
+        self.assertEqual(None, self.d.get(b"other"))
+        self.assertEqual(1, dbutils.deadlock_stats()["failures"])
+
+    def test03_context_manager(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test03_context_manager..." % \
+                  self.__class__.__name__)
+
+        with dbutils.transactional(self.env) as txn:
+            self.d.put(b"key", b"data", txn=txn)
+        self.assertEqual(b"data", self.d.get(b"key"))
+
+        def fail():
+            with dbutils.transactional(self.env) as txn:
+                self.d.put(b"key", b"other", txn=txn)
+                raise ValueError
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(b"data", self.d.get(b"key"))
+
+        # Retry a block
+        count = 0
+        for attempt in dbutils.transactional(self.env):
+            with attempt as txn:
+                count += 1
+                self.d.put(b"key", b"retried", txn=txn)
+                if count < 3:
+                    raise db.DBLockNotGrantedError(db.DB_LOCK_NOTGRANTED,
+                                                   "Not granted")
+        self.assertEqual(3, count)
+        self.assertEqual(b"retried", self.d.get(b"key"))
+
+    def test04_nested(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test04_nested..." % \
+                  self.__class__.__name__)
+
+        def fail():
+            with dbutils.transactional(self.env) as parent:
+                self.d.put(b"parent", b"data", txn=parent)
+                with dbutils.transactional(self.env) as child:
+                    self.d.put(b"child", b"data", txn=child)
+                # The child is committed into its parent
+                self.assertEqual(b"data", self.d.get(b"child", txn=parent))
+                raise ValueError
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(None, self.d.get(b"parent"))
+        self.assertEqual(None, self.d.get(b"child"))
+
+        with dbutils.transactional(self.env) as parent:
+            try:
+                with dbutils.transactional(self.env) as child:
+                    self.d.put(b"child", b"data", txn=child)
+                    raise ValueError
+            except ValueError:
+                pass
+            self.d.put(b"parent", b"data", txn=parent)
+        self.assertEqual(b"data", self.d.get(b"parent"))
+        self.assertEqual(None, self.d.get(b"child"))
+
+
+class GroupCommitTestCase(TxnTestCase):
+    def _writers(self, group):
+        from threading import Thread
+        errors = []
+        def writer(i):
+            key = ("%04d" % i).encode("ascii")
+            try:
+                group.put(self.d, key, key)
+                # The write is done when put() returns
+                self.assertEqual(key, self.d.get(key))
+            except Exception as e:
+                errors.append(e)
+        threads = [Thread(target=writer, args=(i,)) for i in range(50)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([], errors)
+        self.assertEqual(50, len(list(self.d.keys())))
+
+    def test01_group(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test01_group..." % \
+                  self.__class__.__name__)
+
+        with dbutils.GroupCommit(self.env, window=0.01) as group:
+            self._writers(group)
+
+            # A failure only undoes its own writes
+            def fail(txn):
+                self.d.put(b"fail", b"data", txn=txn)
+                raise ValueError
+            self.assertRaises(ValueError, group.submit, fail)
+            self.assertEqual(None, self.d.get(b"fail"))
+
+            # Deadlocks retry the whole group
+            attempts = []
+            def flaky(txn):
+                attempts.append(txn)
+                if len(attempts) < 3:
+                    raise _deadlock()
+                self.d.put(b"flaky", b"data", txn=txn)
+                return len(attempts)
+            self.assertEqual(3, group.submit(flaky))
+            self.assertEqual(b"data", self.d.get(b"flaky"))
+        self.assertRaises(ValueError, group.put, self.d, b"key", b"data")
+
+    def test02_nosync(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test02_nosync..." % \
+                  self.__class__.__name__)
+
+        with dbutils.GroupCommit(self.env, window=0.01,
+                                 nosync=True) as group:
+            self._writers(group)
+            group.delete(self.d, b"0000")
+            self.assertEqual(None, self.d.get(b"0000"))
+
+    def test03_flush_error(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test03_flush_error..." % \
+                  self.__class__.__name__)
+
+        class FlakyEnv(object):
+            failures = 1
+            def __init__(self, env):
+                self.env = env
+            def __getattr__(self, name):
+                return getattr(self.env, name)
+            def log_flush(self):
+                if self.failures:
+                    self.failures -= 1
+                    raise db.DBError("flush failed")
+                return self.env.log_flush()
+
+        with dbutils.GroupCommit(FlakyEnv(self.env), window=0.01,
+                                 nosync=True) as group:
+            # Only the commits of the failed flush see its error
+            self.assertRaises(db.DBError, group.put, self.d, b"a", b"a")
+            group.put(self.d, b"b", b"b")
+            self.assertEqual([], group._flush_errors)
+
+    def test04_worker_exit(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test04_worker_exit..." % \
+                  self.__class__.__name__)
+
+        # Exceptions that kill the worker don't leave submitters blocked
+        def exit(txn):
+            raise SystemExit
+        group = dbutils.GroupCommit(self.env, window=0.01)
+        self.assertRaises(SystemExit, group.submit, exit)
+        group.close()
+        self.assertRaises(SystemExit, group.put, self.d, b"key", b"data")
+
+
+class CompactorTestCase(TxnTestCase):
+    def test01_resume(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test01_resume..." % \
+                  self.__class__.__name__)
+
+        for i in range(5000):
+            key = ("%05d" % i).encode("ascii")
+            self.d.put(key, key * 10)
+        for i in range(5000):
+            if i % 10:
+                self.d.delete(("%05d" % i).encode("ascii"))
+        before = dbutils.fill_factor(self.d)
+
+        state = db.DB(self.env)
+        state.open("state", db.DB_BTREE, db.DB_CREATE | db.DB_AUTO_COMMIT)
+        compactor = dbutils.Compactor(self.d, state)
+        self.assertEqual(None, compactor.resume_key())
+        runs = 0
+        while True:
+            result = compactor.run(budget_pages=1, fill=True)
+            runs += 1
+            if result["done"]:
+                break
+            self.assertEqual(result["next"], compactor.resume_key())
+            # A new Compactor resumes from the saved key
+            compactor = dbutils.Compactor(self.d, state)
+        self.assertEqual(None, compactor.resume_key())
+        self.assertTrue(runs > 1)
+        self.assertTrue(result["fill"] > before)
+        self.assertEqual(500, len(list(self.d.keys())))
+        self.assertEqual(b"00010" * 10, self.d.get(b"00010"))
+        state.close()
+
+
+#----------------------------------------------------------------------
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(RetryPolicyTestCase))
+    suite.addTest(unittest.makeSuite(DeadlockWrapTxnTestCase))
+    suite.addTest(unittest.makeSuite(TransactionalTestCase))
+    suite.addTest(unittest.makeSuite(GroupCommitTestCase))
+    suite.addTest(unittest.makeSuite(CompactorTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -38,6 +38,7 @@ are met:
 
 import os
 
+import sys
 import unittest
 
 from .test_all import db, dbshelve, test_support, verbose, \
@@ -126,9 +127,80 @@ class JoinTestCase(unittest.TestCase):
             secDB.close()
 
 
+class ShelfJoinTestCase(unittest.TestCase):
+    def setUp(self):
+        if sys.version_info[0] >= 3 :
+            from .test_all import do_proxy_db_py3k
+            self._flag_proxy_db_py3k = do_proxy_db_py3k(False)
+        self.filename = self.__class__.__name__ + '.db'
+        self.homeDir = get_new_environment_path()
+        self.env = db.DBEnv()
+        self.env.open(self.homeDir, db.DB_CREATE | db.DB_INIT_MPOOL | db.DB_INIT_LOCK )
+
+    def tearDown(self):
+        if sys.version_info[0] >= 3 :
+            from .test_all import do_proxy_db_py3k
+            do_proxy_db_py3k(self._flag_proxy_db_py3k)
+        self.env.close()
+        test_support.rmtree(self.homeDir)
+
+    def mk(self, key):
+        if sys.version_info[0] < 3 :
+            return key
+        else :
+            return bytes(key, "iso8859-1")  # 8 bits
+
+    def test01_join(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test01_join..." % \
+                  self.__class__.__name__)
+
+        priDB = dbshelve.DBShelf(self.env)
+        priDB.open(self.filename, "primary", db.DB_BTREE, db.DB_CREATE)
+        for name, store in ProductIndex:
+            priDB.put(self.mk(name), {'name': name, 'store': store})
+
+        secDB = db.DB(self.env)
+        secDB.set_flags(db.DB_DUP | db.DB_DUPSORT)
+        secDB.open(self.filename, "secondary", db.DB_BTREE, db.DB_CREATE)
+        for color, name in ColorIndex:
+            secDB.put(self.mk(color), self.mk(name))
+
+        sCursor = None
+        jCursor = None
+        try:
+            sCursor = secDB.cursor()
+            tmp = sCursor.set(self.mk('red'))
+            self.assertTrue(tmp)
+
+            jCursor = priDB.join([sCursor])
+            self.assertEqual((self.mk('apple'),
+                              {'name': 'apple', 'store': "Convenience Store"}),
+                             jCursor.get())
+            self.assertEqual(self.mk('chainsaw'), jCursor.join_item())
+            self.assertEqual([self.mk('strawberry')],
+                             [key for key, value in jCursor])
+            jCursor.close()
+
+            sCursor.set(self.mk('red'))
+            jCursor = priDB.join([sCursor])
+            self.assertEqual(["Convenience Store", "S-Mart",
+                              "Farmer's Market"],
+                             [value['store'] for key, value in jCursor])
+        finally:
+            if jCursor:
+                jCursor.close()
+            if sCursor:
+                sCursor.close()
+            priDB.close()
+            secDB.close()
+
+
 def test_suite():
     suite = unittest.TestSuite()
 
     suite.addTest(unittest.makeSuite(JoinTestCase))
+    suite.addTest(unittest.makeSuite(ShelfJoinTestCase))
 
     return suite
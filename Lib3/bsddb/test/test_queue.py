@@ -41,7 +41,8 @@ import os, string
 from pprint import pprint
 import unittest
 
-from .test_all import db, verbose, get_new_database_path
+from .test_all import db, test_support, verbose, get_new_database_path, \
+        get_new_environment_path
 
 #----------------------------------------------------------------------
 
@@ -187,6 +188,82 @@ class SimpleQueueTestCase(unittest.TestCase):
         d.close()
 
 
+    def test03_consume_many(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test03_consume_many..." % \
+                  self.__class__.__name__)
+
+        d = db.DB()
+        d.set_re_len(10)
+        d.set_re_pad(ord("."))
+        d.open(self.filename, db.DB_QUEUE, db.DB_CREATE)
+        for x in range(10):
+            d.append(("%d" % x).encode("ascii"))
+
+        records = d.consume_many(4)
+        self.assertEqual([1, 2, 3, 4], [recno for recno, data in records])
+        self.assertEqual(b"0.........", records[0][1])
+        self.assertEqual(6, len(d.consume_many(100)))
+        self.assertEqual([], d.consume_many(5))
+        self.assertEqual([], d.consume_many(0))
+        # The buffers grow with the records, not with max_items
+        for x in range(200):
+            d.append(("%d" % x).encode("ascii"))
+        records = d.consume_many(2**31 - 1)
+        self.assertEqual(list(range(11, 211)),
+                         [recno for recno, data in records])
+        self.assertEqual(b"199.......", records[-1][1])
+        self.assertRaises(ValueError, d.consume_many, -1)
+        # Waiting with a timeout needs a transaction
+        self.assertRaises(ValueError, d.consume_many, 1, wait=True,
+                          timeout=0.1)
+        d.close()
+
+        d = db.DB()
+        d.open(self.filename + ".btree", db.DB_BTREE, db.DB_CREATE)
+        self.assertRaises(TypeError, d.consume_many, 1)
+        d.close()
+        os.remove(self.filename + ".btree")
+
+    def test04_consume_many_txn(self):
+        if verbose:
+            print('\n', '-=' * 30)
+            print("Running %s.test04_consume_many_txn..." % \
+                  self.__class__.__name__)
+
+        homeDir = get_new_environment_path()
+        env = db.DBEnv()
+        env.set_flags(db.DB_TIME_NOTGRANTED, True)
+        env.open(homeDir, db.DB_CREATE | db.DB_INIT_MPOOL |
+                 db.DB_INIT_LOCK | db.DB_INIT_LOG | db.DB_INIT_TXN |
+                 db.DB_THREAD)
+        try:
+            d = db.DB(env)
+            d.set_re_len(10)
+            d.open("queue", db.DB_QUEUE, db.DB_CREATE | db.DB_AUTO_COMMIT)
+            for x in range(10):
+                d.append(b"data")
+
+            # Aborting the transaction puts the records back
+            txn = env.txn_begin()
+            self.assertEqual(10, len(d.consume_many(20, txn=txn)))
+            txn.abort()
+            self.assertEqual(3, len(d.consume_many(3)))
+            self.assertEqual(7, len(d.consume_many(10, wait=True)))
+
+            # The wait times out
+            self.assertEqual([], d.consume_many(1, wait=True, timeout=0.1))
+            # Tiny timeouts are not taken as no timeout at all
+            self.assertEqual([], d.consume_many(1, wait=True, timeout=0))
+            self.assertEqual([], d.consume_many(1, wait=True, timeout=1e-9))
+            self.assertRaises(OverflowError, d.consume_many, 1, wait=True,
+                              timeout=5000)
+            d.close()
+        finally:
+            env.close()
+            test_support.rmtree(homeDir)
+
 
 #----------------------------------------------------------------------
 
@@ -36,7 +36,8 @@ are met:
 import unittest
 import os
 
-from .test_all import db, test_support, get_new_environment_path, get_new_database_path
+from .test_all import db, dbutils, test_support, get_new_environment_path, \
+        get_new_database_path
 
 
 class DBSequenceTest(unittest.TestCase):
@@ -154,6 +155,54 @@ class DBSequenceTest(unittest.TestCase):
         self.assertEqual(value_minus, self.seq.get(1))
         self.assertEqual(value_minus+1, self.seq.get(1))
 
+    def test_get_block(self):
+        self.seq = db.DBSequence(self.d, flags=0)
+        self.seq.initial_value(10)
+        self.assertEqual(None, self.seq.open(key='id', txn=None,
+            flags=db.DB_CREATE))
+        self.assertEqual((10, 109), self.seq.get_block(100))
+        self.assertEqual((110, 110), self.seq.get_block(1))
+        self.assertEqual(111, self.seq.get())
+        self.assertRaises(ValueError, self.seq.get_block, 0)
+
+        self.seq.close()
+        self.seq = db.DBSequence(self.d, flags=0)
+        self.seq.set_flags(db.DB_SEQ_DEC)
+        self.seq.initial_value(0)
+        self.seq.set_range((-1000, 0))
+        self.assertEqual(None, self.seq.open(key='dec', txn=None,
+            flags=db.DB_CREATE))
+        self.assertEqual((0, -9), self.seq.get_block(10))
+        self.assertEqual(-10, self.seq.get())
+
+    def test_allocator(self):
+        from threading import Thread
+        self.seq = db.DBSequence(self.d, flags=0)
+        self.assertEqual(None, self.seq.open(key='id', txn=None,
+            flags=db.DB_CREATE))
+        allocator = dbutils.SequenceAllocator(self.seq, block_size=100)
+        values = []
+        def worker():
+            got = [allocator.get() for i in range(1000)]
+            values.extend(got)
+        threads = [Thread(target=worker) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        allocator.close()
+        self.assertEqual(list(range(4000)), sorted(values))
+        # What is left of the blocks reserved is still handed out
+        left = []
+        try:
+            while True:
+                left.append(allocator.get())
+        except ValueError:
+            pass
+        self.assertEqual(list(range(4000, 4000 + len(left))), left)
+        self.assertTrue(allocator.refills >= 40)
+        self.assertTrue(allocator.waits >= 1)
+
     def test_multiple_close(self):
         self.seq = db.DBSequence(self.d)
         self.seq.close()  # You can close a Sequence multiple times
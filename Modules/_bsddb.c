@@ -92,6 +92,16 @@
 #define PY_SSIZE_T_CLEAN
 
 #include <Python.h>
+#include "pythread.h"
+
+#ifdef MS_WINDOWS
+#include <io.h>
+#include <windows.h>
+#define write(fd, buf, count) _write(fd, buf, (unsigned int)(count))
+#else
+#include <sys/time.h>
+#include <sys/uio.h>
+#endif
 
 #define COMPILING_BSDDB_C
 #include "bsddb.h"
@@ -195,6 +205,7 @@ static PyObject* DBRepUnavailError;     /* DB_REP_UNAVAIL */
 staticforward PyTypeObject DB_Type, DBCursor_Type, DBEnv_Type, DBTxn_Type,
               DBLock_Type, DBLogCursor_Type;
 staticforward PyTypeObject DBSequence_Type;
+staticforward PyTypeObject DBScan_Type;
 #if (DBVER >= 53)
 staticforward PyTypeObject DBSite_Type;
 #endif
@@ -1084,6 +1095,8 @@ newDBEnvObject(int flags)
     self->private_obj = Py_None;
     Py_INCREF(Py_None);
     self->rep_transport = Py_None;
+    self->rep_transport_fd = -1;
+    self->rep_transport_lock = NULL;
     self->in_weakreflist = NULL;
     self->event_notifyCallback = NULL;
 
@@ -1129,6 +1142,8 @@ DBEnv_dealloc(DBEnvObject* self)
     }
     Py_DECREF(self->private_obj);
     Py_DECREF(self->rep_transport);
+    if (self->rep_transport_lock)
+        PyThread_free_lock((PyThread_type_lock)self->rep_transport_lock);
     PyObject_Del(self);
 }
 
@@ -1731,6 +1746,201 @@ DB_consume_wait(DBObject* self, PyObject* args, PyObject* kwargs,
 }
 
 
+/* Records the buffers of consume_many() have room for at first */
+#define CONSUME_BATCH 64
+
+/* Make room for 'capacity' records of re_len bytes in the buffers of
+ * consume_many().  Called without the GIL. */
+static int _consume_grow(size_t capacity, u_int32_t re_len,
+                         db_recno_t **recnos, u_int32_t **sizes,
+                         char **buffer)
+{
+    void *p;
+
+    if (capacity > ((size_t)-1) / re_len ||
+            capacity > ((size_t)-1) / sizeof(db_recno_t))
+        return ENOMEM;
+    if ((p = realloc(*recnos, capacity * sizeof(db_recno_t))) == NULL)
+        return ENOMEM;
+    *recnos = p;
+    if ((p = realloc(*sizes, capacity * sizeof(u_int32_t))) == NULL)
+        return ENOMEM;
+    *sizes = p;
+    if ((p = realloc(*buffer, capacity * re_len)) == NULL)
+        return ENOMEM;
+    *buffer = p;
+    return 0;
+}
+
+/* Dequeue up to max_items records of a Queue DB, releasing the GIL once.
+ * The records have a fixed length, so they are copied into a single
+ * buffer, grown as they are consumed, and the Python objects are only
+ * built at the end. */
+static PyObject*
+DB_consume_many(DBObject* self, PyObject* args, PyObject* kwargs)
+{
+    int err = 0, type, i, count = 0;
+    int max_items, wait = 0, transactional, timed;
+    size_t capacity = 0;
+    db_timeout_t lock_timeout = 0, wait_timeout = 0;
+    double timeout = 0;
+    PyObject* txnobj = NULL;
+    PyObject* timeoutobj = Py_None;
+    PyObject* list;
+    PyObject* item;
+    DB_ENV *env;
+    DB_TXN *txn = NULL;
+    DB_TXN *own_txn = NULL;
+    DBT key, data;
+    u_int32_t re_len;
+    db_recno_t *recnos = NULL;
+    u_int32_t *sizes = NULL;
+    char *buffer = NULL;
+    static char* kwnames[] = { "max_items", "txn", "wait", "timeout",
+                               NULL };
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|OiO:consume_many",
+                                     kwnames, &max_items, &txnobj, &wait,
+                                     &timeoutobj))
+        return NULL;
+
+    CHECK_DB_NOT_CLOSED(self);
+    type = _DB_get_type(self);
+    if (type == -1)
+        return NULL;
+    if (type != DB_QUEUE) {
+        PyErr_SetString(PyExc_TypeError,
+                        "Consume methods only allowed for Queue DB's");
+        return NULL;
+    }
+    if (max_items < 0) {
+        PyErr_SetString(PyExc_ValueError, "max_items must be >= 0");
+        return NULL;
+    }
+    if (!checkTxnObj(txnobj, &txn))
+        return NULL;
+    transactional = self->db->get_transactional(self->db);
+    if (timeoutobj != Py_None) {
+        timeout = PyFloat_AsDouble(timeoutobj);
+        if (timeout == -1 && PyErr_Occurred())
+            return NULL;
+        if (timeout < 0) {
+            PyErr_SetString(PyExc_ValueError, "timeout must be >= 0");
+            return NULL;
+        }
+        if (txn == NULL && !transactional) {
+            PyErr_SetString(PyExc_ValueError,
+                    "timeout needs a transaction or a transactional DB");
+            return NULL;
+        }
+        /* In microseconds, rounded up: 0 would mean no timeout at all */
+        timeout = ceil(timeout * 1000000);
+        if (timeout > 0xFFFFFFFFU) {
+            PyErr_SetString(PyExc_OverflowError, "timeout too large");
+            return NULL;
+        }
+        wait_timeout = (db_timeout_t)timeout;
+        if (wait_timeout == 0) {
+            /* Don't wait, not even for a lock */
+            wait = 0;
+            wait_timeout = 1;
+        }
+    }
+    if (max_items == 0)
+        return PyList_New(0);
+
+    err = self->db->get_re_len(self->db, &re_len);
+    RETURN_IF_ERR();
+    if (re_len == 0)
+        re_len = 1;
+
+    MYDB_BEGIN_ALLOW_THREADS;
+    env = self->db->get_env(self->db);
+    /* All the records are consumed in the same transaction */
+    if (txn == NULL && transactional) {
+        err = env->txn_begin(env, NULL, &own_txn, 0);
+        txn = own_txn;
+    }
+    /* The timeout only applies to the wait for the first record; the
+     * locks taken afterwards use the timeout of the environment. */
+    timed = (timeoutobj != Py_None);
+    if (!err && timed)
+        err = env->get_timeout(env, &lock_timeout, DB_SET_LOCK_TIMEOUT);
+    if (!err && timed) {
+        err = txn->set_timeout(txn, wait_timeout, DB_SET_LOCK_TIMEOUT);
+    }
+    while (!err && count < max_items) {
+        if ((size_t)count == capacity) {
+            /* Don't allocate max_items records up front */
+            capacity = capacity ? capacity * 2 : CONSUME_BATCH;
+            if (capacity > (size_t)max_items)
+                capacity = max_items;
+            err = _consume_grow(capacity, re_len, &recnos, &sizes, &buffer);
+            if (err)
+                break;
+        }
+        CLEAR_DBT(key);
+        CLEAR_DBT(data);
+        key.flags = DB_DBT_USERMEM;
+        key.data = &recnos[count];
+        key.ulen = sizeof(db_recno_t);
+        data.flags = DB_DBT_USERMEM;
+        data.data = buffer + (size_t)count * re_len;
+        data.ulen = re_len;
+        /* Only wait for the first record */
+        err = self->db->get(self->db, txn, &key, &data,
+                            (wait && count == 0) ? DB_CONSUME_WAIT
+                                                 : DB_CONSUME);
+        if (!err)
+            sizes[count++] = data.size;
+        if (timed) {
+            int err2 = txn->set_timeout(txn, lock_timeout,
+                                        DB_SET_LOCK_TIMEOUT);
+            if (!err)
+                err = err2;
+            timed = 0;
+        }
+    }
+    if (err == DB_NOTFOUND || err == DB_KEYEMPTY)
+        err = 0;
+    /* The wait timed out */
+    if (err == DB_LOCK_NOTGRANTED && count == 0 && timeoutobj != Py_None)
+        err = 0;
+    /* Without a transaction the records got are already gone */
+    if (err && txn == NULL && count > 0)
+        err = 0;
+    if (own_txn != NULL) {
+        if (err)
+            own_txn->abort(own_txn);
+        else
+            err = own_txn->commit(own_txn, 0);
+    }
+    MYDB_END_ALLOW_THREADS;
+
+    if (makeDBError(err)) {
+        free(recnos);
+        free(sizes);
+        free(buffer);
+        return NULL;
+    }
+
+    list = PyList_New(count);
+    for (i = 0; list != NULL && i < count; i++) {
+        item = BuildValue_IS(recnos[i], buffer + (size_t)i * re_len,
+                             sizes[i]);
+        if (item == NULL) {
+            Py_CLEAR(list);
+            break;
+        }
+        PyList_SET_ITEM(list, i, item);
+    }
+    free(recnos);
+    free(sizes);
+    free(buffer);
+    return list;
+}
+
+
 static PyObject*
 DB_cursor(DBObject* self, PyObject* args, PyObject* kwargs)
 {
@@ -1846,6 +2056,276 @@ DB_compact(DBObject* self, PyObject* args, PyObject* kwargs)
 }
 
 
+/* Seconds elapsed from an arbitrary origin, callable without the GIL */
+static double _now(void)
+{
+#ifdef MS_WINDOWS
+    return GetTickCount() / 1000.0;
+#else
+    struct timeval tv;
+
+    gettimeofday(&tv, NULL);
+    return tv.tv_sec + tv.tv_usec / 1000000.0;
+#endif
+}
+
+/* Records covered by every DB->compact() call of DB_compact_incremental()
+ * on Btree and Recno databases */
+#define COMPACT_SLICE_RECORDS 1000
+/* Pages freed by every DB->compact() call on the other databases */
+#define COMPACT_SLICE_PAGES 64
+
+/* Put in 'key' the key 'n' records after the first one >= 'from' (the
+ * first record if NULL), or set *last if the end of the database or the
+ * key 'bound' comes first.  Recno keys are counted, not read.  Called
+ * without the GIL. */
+static int _compact_seek(DB *db, DB_TXN *txn, int recnos, DBT *from,
+                         u_int32_t n, DBT *bound, DBT *key, int *last)
+{
+    DBC *dbc;
+    DBT data;
+    db_recno_t recno, last_recno;
+    u_int32_t i = 0;
+    int err, err2;
+
+    *last = 0;
+    CLEAR_DBT(*key);
+    CLEAR_DBT(data);
+    key->flags = DB_DBT_REALLOC;
+    /* Only the keys are needed, don't read the data */
+    data.flags = DB_DBT_REALLOC | DB_DBT_PARTIAL;
+    err = db->cursor(db, txn, &dbc, 0);
+    if (err)
+        return err;
+    if (recnos) {
+        recno = from ? *((db_recno_t*)from->data) : 1;
+        recno += n;
+        err = _DBC_get(dbc, key, &data, DB_LAST);
+        if (!err) {
+            memcpy(&last_recno, key->data, sizeof(last_recno));
+            if (recno > last_recno ||
+                    (bound && recno >= *((db_recno_t*)bound->data)))
+                *last = 1;
+            else
+                memcpy(key->data, &recno, sizeof(recno));
+        }
+    } else {
+        if (from) {
+            key->data = malloc(from->size + 1);
+            if (key->data == NULL) {
+                _DBC_close(dbc);
+                return ENOMEM;
+            }
+            memcpy(key->data, from->data, from->size);
+            key->size = from->size;
+            err = _DBC_get(dbc, key, &data, DB_SET_RANGE);
+        } else {
+            err = _DBC_get(dbc, key, &data, DB_FIRST);
+        }
+        while (!err) {
+            if (bound && key->size == bound->size &&
+                    !memcmp(key->data, bound->data, key->size)) {
+                *last = 1;
+                break;
+            }
+            if (i++ == n)
+                break;
+            err = _DBC_get(dbc, key, &data, DB_NEXT);
+        }
+    }
+    if (err == DB_NOTFOUND || err == DB_KEYEMPTY) {
+        *last = 1;
+        err = 0;
+    }
+    free(data.data);
+    err2 = _DBC_close(dbc);
+    if (!err)
+        err = err2;
+    if (err || *last) {
+        free(key->data);
+        CLEAR_DBT(*key);
+    }
+    return err;
+}
+
+/* Compact the database in slices, resuming each one where the previous
+ * one stopped, until the end of the range or a budget is reached.  On
+ * Btree and Recno databases a slice covers COMPACT_SLICE_RECORDS records,
+ * whatever the pages it frees, so already compact databases are walked
+ * in small steps too; on the others a slice stops after freeing
+ * COMPACT_SLICE_PAGES pages.  The budgets are checked between slices. */
+static PyObject*
+DB_compact_incremental(DBObject* self, PyObject* args, PyObject* kwargs)
+{
+    PyObject* txnobj = NULL;
+    PyObject *startobj = Py_None, *stopobj = Py_None;
+    PyObject *result, *next;
+    int err = 0, flags = 0, type, done = 0, slices = 0;
+    int by_records, recnos, last = 0;
+    unsigned int budget_pages = 0, slice;
+    double budget_seconds = 0, started, elapsed;
+    DB_TXN *txn = NULL;
+    DBT start, stop, end, bound, slice_stop;
+    DBT *start_p = NULL, *stop_p = NULL, *bound_p = NULL;
+    DB_COMPACT c_data;
+    u_int32_t fillpercent = 0, timeout = 0;
+    u_int32_t pages_free = 0, pages_examine = 0, pages_truncated = 0;
+    u_int32_t levels = 0, deadlock = 0;
+    static char* kwnames[] = { "budget_pages", "budget_seconds", "start",
+                               "stop", "txn", "flags",
+                               "compact_fillpercent", "compact_timeout",
+                               NULL };
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|IdOOOiII:compact_incremental",
+                                     kwnames, &budget_pages, &budget_seconds,
+                                     &startobj, &stopobj, &txnobj, &flags,
+                                     &fillpercent, &timeout))
+        return NULL;
+
+    CHECK_DB_NOT_CLOSED(self);
+    type = _DB_get_type(self);
+    if (type == -1)
+        return NULL;
+    if (budget_seconds < 0) {
+        PyErr_SetString(PyExc_ValueError, "budget_seconds must be >= 0");
+        return NULL;
+    }
+    if (!checkTxnObj(txnobj, &txn))
+        return NULL;
+    recnos = (type == DB_RECNO || type == DB_QUEUE);
+    by_records = (type == DB_BTREE || type == DB_RECNO);
+
+    if (startobj != Py_None) {
+        if (!make_key_dbt(self, startobj, &start, NULL))
+            return NULL;
+        start_p = &start;
+    }
+    if (stopobj != Py_None) {
+        if (!make_key_dbt(self, stopobj, &stop, NULL)) {
+            if (start_p)
+                FREE_DBT(start);
+            return NULL;
+        }
+        stop_p = &stop;
+    }
+
+    MYDB_BEGIN_ALLOW_THREADS;
+    started = _now();
+    CLEAR_DBT(end);
+    CLEAR_DBT(bound);
+    CLEAR_DBT(slice_stop);
+    /* The walk of a slice ends at the first key >= stop */
+    if (by_records && stop_p) {
+        if (recnos) {
+            bound_p = stop_p;
+        } else {
+            err = _compact_seek(self->db, txn, 0, stop_p, 0, NULL, &bound,
+                                &last);
+            if (!err && !last)
+                bound_p = &bound;
+        }
+    }
+    while (!err && !done) {
+        memset(&c_data, 0, sizeof(c_data));
+        c_data.compact_fillpercent = fillpercent;
+        c_data.compact_timeout = timeout;
+        if (by_records) {
+            err = _compact_seek(self->db, txn, recnos, start_p,
+                                COMPACT_SLICE_RECORDS, bound_p, &slice_stop,
+                                &last);
+            if (err)
+                break;
+            /* 0 for no limit */
+            c_data.compact_pages = budget_pages ? budget_pages - pages_free
+                                                : 0;
+        } else {
+            slice = COMPACT_SLICE_PAGES;
+            if (budget_pages && budget_pages - pages_free < slice)
+                slice = budget_pages - pages_free;
+            c_data.compact_pages = slice;
+        }
+        end.flags = DB_DBT_MALLOC;
+        err = self->db->compact(self->db, txn, start_p,
+                                (!by_records || last) ? stop_p : &slice_stop,
+                                &c_data, flags, &end);
+        if (err)
+            break;
+        slices++;
+        pages_free += c_data.compact_pages_free;
+        pages_examine += c_data.compact_pages_examine;
+        pages_truncated += c_data.compact_pages_truncated;
+        levels += c_data.compact_levels;
+        deadlock += c_data.compact_deadlock;
+
+        if (start_p)
+            FREE_DBT(start);
+        start_p = NULL;
+        if (c_data.compact_pages &&
+                c_data.compact_pages_free >= c_data.compact_pages &&
+                end.size) {
+            /* Stopped by the page quota: resume where it stopped */
+            start = end;
+            start_p = &start;
+            CLEAR_DBT(end);
+        } else if (!by_records || last) {
+            /* The rest of the range was compacted */
+            done = 1;
+            break;
+        } else {
+            /* Resume from the end of the slice */
+            start = slice_stop;
+            start_p = &start;
+            CLEAR_DBT(slice_stop);
+        }
+        FREE_DBT(end);
+        FREE_DBT(slice_stop);
+        if (budget_pages && pages_free >= budget_pages)
+            break;
+        if (budget_seconds && _now() - started >= budget_seconds)
+            break;
+    }
+    elapsed = _now() - started;
+    MYDB_END_ALLOW_THREADS;
+
+    FREE_DBT(end);
+    FREE_DBT(slice_stop);
+    FREE_DBT(bound);
+    if (stop_p)
+        FREE_DBT(stop);
+    if (makeDBError(err)) {
+        if (start_p)
+            FREE_DBT(start);
+        return NULL;
+    }
+
+    /* Where the next call resumes, None when the range is done */
+    if (done || start_p == NULL) {
+        Py_INCREF(Py_None);
+        next = Py_None;
+    } else if (recnos) {
+        next = NUMBER_FromLong(*((db_recno_t*)start.data));
+    } else {
+        next = Build_PyString(start.data, start.size);
+    }
+    if (start_p)
+        FREE_DBT(start);
+    if (next == NULL)
+        return NULL;
+
+    result = Py_BuildValue("{s:O,s:I,s:I,s:I,s:I,s:I,s:i,s:d}",
+                           "next", next,
+                           "pages_free", pages_free,
+                           "pages_examine", pages_examine,
+                           "pages_truncated", pages_truncated,
+                           "levels", levels,
+                           "deadlock", deadlock,
+                           "slices", slices,
+                           "elapsed", elapsed);
+    Py_DECREF(next);
+    return result;
+}
+
+
 static PyObject*
 DB_fd(DBObject* self)
 {
@@ -2068,6 +2548,75 @@ DB_pget(DBObject* self, PyObject* args, PyObject* kwargs)
 }
 
 
+/* Read part of a record straight into a writable buffer */
+static PyObject*
+DB_get_into(DBObject* self, PyObject* args, PyObject* kwargs)
+{
+    int err, flags=0;
+    int doff = 0;
+    PyObject* txnobj = NULL;
+    PyObject* keyobj;
+    PyObject* bufobj;
+    PyObject* retval = NULL;
+    Py_buffer view;
+    DBT key, data;
+    DB_TXN *txn = NULL;
+    static char* kwnames[] = { "key", "buffer", "txn", "flags", "doff",
+                               NULL };
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "OO|Oii:get_into", kwnames,
+                                     &keyobj, &bufobj, &txnobj, &flags, &doff))
+        return NULL;
+    CHECK_DB_NOT_CLOSED(self);
+    if (doff < 0) {
+        PyErr_SetString(PyExc_ValueError, "doff must be >= 0");
+        return NULL;
+    }
+    if (PyObject_GetBuffer(bufobj, &view, PyBUF_WRITABLE) == -1)
+        return NULL;
+    if (view.len > (Py_ssize_t)UINT_MAX) {
+        PyBuffer_Release(&view);
+        PyErr_SetString(PyExc_ValueError, "buffer too large");
+        return NULL;
+    }
+    if (!make_key_dbt(self, keyobj, &key, &flags)) {
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+    if (!checkTxnObj(txnobj, &txn)) {
+        FREE_DBT(key);
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+
+    /* Berkeley DB copies the requested bytes into the caller's memory */
+    CLEAR_DBT(data);
+    data.flags = DB_DBT_USERMEM | DB_DBT_PARTIAL;
+    data.data = view.buf;
+    data.ulen = data.dlen = (u_int32_t)view.len;
+    data.doff = (u_int32_t)doff;
+
+    MYDB_BEGIN_ALLOW_THREADS;
+    err = self->db->get(self->db, txn, &key, &data, flags);
+    MYDB_END_ALLOW_THREADS;
+
+    if ((err == DB_NOTFOUND || err == DB_KEYEMPTY)
+	     && self->moduleFlags.getReturnsNone) {
+        err = 0;
+        Py_INCREF(Py_None);
+        retval = Py_None;
+    }
+    else if (!err) {
+        retval = NUMBER_FromLong((long)data.size);
+    }
+    FREE_DBT(key);
+    PyBuffer_Release(&view);
+
+    RETURN_IF_ERR();
+    return retval;
+}
+
+
 /* Return size of entry */
 static PyObject*
 DB_get_size(DBObject* self, PyObject* args, PyObject* kwargs)
@@ -4344,64 +4893,649 @@ DBC_pget(DBCursorObject* self, PyObject* args, PyObject *kwargs)
             Py_DECREF(keyObj);
             FREE_DBT(key);  /* 'make_key_dbt' could do a 'malloc' */
         }
-        else /* return just the pkey and data */
-        {
-            retval = PyTuple_Pack(2, pkeyObj, dataObj);
+        else /* return just the pkey and data */
+        {
+            retval = PyTuple_Pack(2, pkeyObj, dataObj);
+        }
+        Py_DECREF(dataObj);
+        Py_DECREF(pkeyObj);
+        FREE_DBT(pkey);
+    }
+    /* the only time REALLOC should be set is if we used an integer
+     * key that make_key_dbt malloc'd for us.  always free these. */
+    if (key.flags & DB_DBT_REALLOC) {  /* 'make_key_dbt' could do a 'malloc' */
+        FREE_DBT(key);
+    }
+    return retval;
+}
+
+
+static PyObject*
+DBC_get_recno(DBCursorObject* self)
+{
+    int err;
+    db_recno_t recno;
+    DBT key;
+    DBT data;
+
+    CHECK_CURSOR_NOT_CLOSED(self);
+
+    CLEAR_DBT(key);
+    CLEAR_DBT(data);
+
+    MYDB_BEGIN_ALLOW_THREADS;
+    err = _DBC_get(self->dbc, &key, &data, DB_GET_RECNO);
+    MYDB_END_ALLOW_THREADS;
+    RETURN_IF_ERR();
+
+    recno = *((db_recno_t*)data.data);
+    return NUMBER_FromLong(recno);
+}
+
+
+static PyObject*
+DBC_last(DBCursorObject* self, PyObject* args, PyObject *kwargs)
+{
+    return _DBCursor_get(self,DB_LAST,args,kwargs,"|iii:last");
+}
+
+
+static PyObject*
+DBC_next(DBCursorObject* self, PyObject* args, PyObject *kwargs)
+{
+    return _DBCursor_get(self,DB_NEXT,args,kwargs,"|iii:next");
+}
+
+
+static PyObject*
+DBC_prev(DBCursorObject* self, PyObject* args, PyObject *kwargs)
+{
+    return _DBCursor_get(self,DB_PREV,args,kwargs,"|iii:prev");
+}
+
+
+/* Compare a key with the stop key of a scan in the default byte order */
+static int _key_compare(const void *key, u_int32_t size, DBT *stop)
+{
+    int cmp;
+
+    cmp = memcmp(key, stop->data, size < stop->size ? size : stop->size);
+    if (cmp)
+        return cmp;
+    return (size > stop->size) - (size < stop->size);
+}
+
+static int _key_has_prefix(const void *key, u_int32_t size, DBT *prefix)
+{
+    return size >= prefix->size && !memcmp(key, prefix->data, prefix->size);
+}
+
+/* Is the key at or after the stop key (record number for Recno and
+ * Queue DB's)? */
+static int _past_stop(int recnos, const void *key, u_int32_t size,
+                      DBT *stop, db_recno_t stop_recno)
+{
+    db_recno_t recno;
+
+    if (recnos) {
+        memcpy(&recno, key, sizeof(recno));
+        return recno >= stop_recno;
+    }
+    return _key_compare(key, size, stop) >= 0;
+}
+
+/* Records got one at a time are copied to a growable buffer as (key size,
+ * data size, key, data), to build their Python objects once the GIL is
+ * taken again.  Called without the GIL. */
+static int _batch_append(char **buffer, u_int32_t *bufsize, u_int32_t *used,
+                         DBT *key, DBT *data)
+{
+    u_int32_t need = 2 * sizeof(u_int32_t) + key->size + data->size;
+    char *p;
+
+    if (*used + need > *bufsize) {
+        p = realloc(*buffer, *used + need);
+        if (p == NULL)
+            return ENOMEM;
+        *buffer = p;
+        *bufsize = *used + need;
+    }
+    p = *buffer + *used;
+    memcpy(p, &key->size, sizeof(u_int32_t));
+    memcpy(p + sizeof(u_int32_t), &data->size, sizeof(u_int32_t));
+    p += 2 * sizeof(u_int32_t);
+    if (key->size)
+        memcpy(p, key->data, key->size);
+    if (data->size)
+        memcpy(p + key->size, data->data, data->size);
+    *used += need;
+    return 0;
+}
+
+/* Get the record at 'pos' in a buffer filled by _batch_append() */
+static int _batch_record(char *buffer, u_int32_t used, u_int32_t *pos,
+                         void **key, u_int32_t *klen,
+                         void **data, u_int32_t *dlen)
+{
+    if (*pos >= used)
+        return 0;
+    memcpy(klen, buffer + *pos, sizeof(u_int32_t));
+    memcpy(dlen, buffer + *pos + sizeof(u_int32_t), sizeof(u_int32_t));
+    *key = buffer + *pos + 2 * sizeof(u_int32_t);
+    *data = (char *)*key + *klen;
+    *pos += 2 * sizeof(u_int32_t) + *klen + *dlen;
+    return 1;
+}
+
+/* The Python object returned for a record by the scans and bulk reads */
+static PyObject *_build_record(int recnos, int keys_only, int values_only,
+                               void *key, u_int32_t klen,
+                               void *data, u_int32_t dlen)
+{
+    db_recno_t recno;
+
+    if (values_only)
+        return Build_PyString(data, dlen);
+    if (recnos) {
+        memcpy(&recno, key, sizeof(recno));
+        if (keys_only)
+            return NUMBER_FromLong(recno);
+        return BuildValue_IS(recno, data, dlen);
+    }
+    if (keys_only)
+        return Build_PyString(key, klen);
+    return BuildValue_SS(key, klen, data, dlen);
+}
+
+/* Return the list of the records after the cursor got in a single bulk
+ * fetch of up to bufsize bytes, with the GIL released, stopping before
+ * the first key >= stop.  The buffer is grown if a record doesn't fit.
+ * Bulk fetches can't be partial, so with keys_only the keys are got one
+ * at a time, with a zero length partial data. */
+static PyObject*
+DBC_next_many(DBCursorObject* self, PyObject* args, PyObject* kwargs)
+{
+    int err = 0, type, recnos;
+    int keys_only = 0, values_only = 0;
+    unsigned int bufsize = 65536;
+    u_int32_t size, used = 0, pos = 0;
+    PyObject *stopobj = Py_None;
+    PyObject *list, *item;
+    DBT key, data, stop;
+    db_recno_t stop_recno = 0, recno;
+    void *p = NULL, *retkey, *retdata;
+    u_int32_t retklen, retdlen;
+    char *buffer;
+    static char* kwnames[] = { "bufsize", "stop", "keys_only", "values_only",
+                               NULL };
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|IOii:next_many",
+                                     kwnames, &bufsize, &stopobj,
+                                     &keys_only, &values_only))
+        return NULL;
+
+    CHECK_CURSOR_NOT_CLOSED(self);
+    if (keys_only && values_only) {
+        PyErr_SetString(PyExc_ValueError,
+                        "keys_only and values_only are exclusive");
+        return NULL;
+    }
+    type = _DB_get_type(self->mydb);
+    if (type == -1)
+        return NULL;
+    recnos = (type == DB_RECNO || type == DB_QUEUE);
+    CLEAR_DBT(stop);
+    if (stopobj != Py_None) {
+        if (recnos) {
+            stop_recno = (db_recno_t)NUMBER_AsLong(stopobj);
+            if (PyErr_Occurred())
+                return NULL;
+        } else if (!make_dbt(stopobj, &stop)) {
+            return NULL;
+        }
+    }
+    /* The buffer must hold whole pages */
+    if (bufsize < 1024)
+        bufsize = 1024;
+    bufsize = (bufsize + 1023) & ~1023;
+    size = bufsize;
+    buffer = malloc(size);
+    if (buffer == NULL)
+        return PyErr_NoMemory();
+
+    CLEAR_DBT(key);
+    CLEAR_DBT(data);
+    if (keys_only) {
+        key.flags = DB_DBT_REALLOC;
+        data.flags = DB_DBT_REALLOC | DB_DBT_PARTIAL;
+        MYDB_BEGIN_ALLOW_THREADS;
+        while (used < bufsize) {
+            err = _DBC_get(self->dbc, &key, &data, DB_NEXT);
+            if (err)
+                break;
+            err = _batch_append(&buffer, &size, &used, &key, &data);
+            if (err)
+                break;
+            if (stopobj != Py_None &&
+                    _past_stop(recnos, key.data, key.size, &stop, stop_recno))
+                break;
+        }
+        MYDB_END_ALLOW_THREADS;
+        free(key.data);
+        free(data.data);
+        if ((err == DB_NOTFOUND || err == DB_KEYEMPTY) && used)
+            err = 0;
+    } else {
+        data.flags = DB_DBT_USERMEM;
+        for (;;) {
+            data.data = buffer;
+            data.ulen = size;
+            MYDB_BEGIN_ALLOW_THREADS;
+            err = _DBC_get(self->dbc, &key, &data,
+                           DB_NEXT | DB_MULTIPLE_KEY);
+            MYDB_END_ALLOW_THREADS;
+            if (err != DB_BUFFER_SMALL)
+                break;
+            size = (data.size + 1023) & ~1023;
+            free(buffer);
+            buffer = malloc(size);
+            if (buffer == NULL)
+                return PyErr_NoMemory();
+        }
+        if (!err)
+            DB_MULTIPLE_INIT(p, &data);
+    }
+    if (err == DB_NOTFOUND || err == DB_KEYEMPTY) {
+        free(buffer);
+        return PyList_New(0);
+    }
+    if (makeDBError(err)) {
+        free(buffer);
+        return NULL;
+    }
+
+    list = PyList_New(0);
+    if (list == NULL) {
+        free(buffer);
+        return NULL;
+    }
+    for (;;) {
+        if (keys_only) {
+            if (!_batch_record(buffer, used, &pos, &retkey, &retklen,
+                               &retdata, &retdlen))
+                break;
+        } else if (recnos) {
+            DB_MULTIPLE_RECNO_NEXT(p, &data, recno, retdata, retdlen);
+            if (p == NULL)
+                break;
+            retkey = &recno;
+            retklen = sizeof(recno);
+        } else {
+            DB_MULTIPLE_KEY_NEXT(p, &data, retkey, retklen, retdata, retdlen);
+            if (p == NULL)
+                break;
+        }
+        if (stopobj != Py_None &&
+                _past_stop(recnos, retkey, retklen, &stop, stop_recno))
+            break;
+        item = _build_record(recnos, keys_only, values_only,
+                             retkey, retklen, retdata, retdlen);
+        if (item == NULL || PyList_Append(list, item)) {
+            Py_XDECREF(item);
+            Py_CLEAR(list);
+            break;
+        }
+        Py_DECREF(item);
+    }
+    free(buffer);
+    return list;
+}
+
+
+/* Iterator returned by DBCursor.scan() */
+typedef struct {
+    PyObject_HEAD
+    DBCursorObject *cursor;
+    int reverse, keys_only, values_only;
+    int started;    /* The cursor has been positioned */
+    int eof;        /* No record left after the buffer */
+    int done;
+    long limit;     /* -1 for no limit */
+    long count;
+    DBT lower;      /* Keys >= lower, data NULL if not bounded */
+    DBT upper;      /* Keys < upper, data NULL if not bounded */
+    DBT prefix;
+    /* Records fetched and not returned yet.  Forward scans fill it with
+     * a DB_MULTIPLE_KEY bulk fetch and walk it with 'p'.  Bulk fetches
+     * can't go backwards nor be partial, so reverse and keys only scans
+     * copy a batch of records to it with _batch_append(), walked with
+     * 'pos'. */
+    char *buffer;
+    u_int32_t bufsize;
+    DBT data;
+    void *p;
+    u_int32_t used, pos;
+} DBScanObject;
+
+/* Records got one at a time by a reverse or keys only fetch */
+#define SCAN_BATCH 64
+
+#define DBScan_bulk(scan)  (!(scan)->reverse && !(scan)->keys_only)
+
+static int _copy_dbt(DBT *dbt, const void *data, u_int32_t size)
+{
+    CLEAR_DBT(*dbt);
+    /* One byte more, so an empty key is not taken as unbounded */
+    dbt->data = malloc(size + 1);
+    if (dbt->data == NULL) {
+        PyErr_NoMemory();
+        return 0;
+    }
+    memcpy(dbt->data, data, size);
+    dbt->size = size;
+    return 1;
+}
+
+/* Fetch the next records into the buffer.  Called without the GIL. */
+static int _DBScan_fill(DBScanObject *self)
+{
+    DBC *dbc = self->cursor->dbc;
+    DBT key, data, *bound;
+    int err = 0, flags, n;
+
+    if (DBScan_bulk(self)) {
+        for (;;) {
+            CLEAR_DBT(key);
+            if (self->started) {
+                flags = DB_NEXT;
+            } else if (self->lower.data) {
+                key.data = self->lower.data;
+                key.size = self->lower.size;
+                flags = DB_SET_RANGE;
+            } else {
+                flags = DB_FIRST;
+            }
+            CLEAR_DBT(self->data);
+            self->data.flags = DB_DBT_USERMEM;
+            self->data.data = self->buffer;
+            self->data.ulen = self->bufsize;
+            err = _DBC_get(dbc, &key, &self->data, flags | DB_MULTIPLE_KEY);
+            if (err != DB_BUFFER_SMALL)
+                break;
+            free(self->buffer);
+            self->bufsize = (self->data.size + 1023) & ~1023;
+            self->buffer = malloc(self->bufsize);
+            if (self->buffer == NULL)
+                return ENOMEM;
+        }
+        if (!err) {
+            self->started = 1;
+            DB_MULTIPLE_INIT(self->p, &self->data);
         }
-        Py_DECREF(dataObj);
-        Py_DECREF(pkeyObj);
-        FREE_DBT(pkey);
+        return err;
     }
-    /* the only time REALLOC should be set is if we used an integer
-     * key that make_key_dbt malloc'd for us.  always free these. */
-    if (key.flags & DB_DBT_REALLOC) {  /* 'make_key_dbt' could do a 'malloc' */
-        FREE_DBT(key);
+
+    self->used = self->pos = 0;
+    CLEAR_DBT(key);
+    CLEAR_DBT(data);
+    key.flags = DB_DBT_REALLOC;
+    data.flags = DB_DBT_REALLOC;
+    if (self->keys_only) {
+        /* Read no data, nor its overflow pages */
+        data.flags |= DB_DBT_PARTIAL;
+    }
+    for (n = 0; n < SCAN_BATCH && self->used < self->bufsize; n++) {
+        if (self->started) {
+            err = _DBC_get(dbc, &key, &data,
+                           self->reverse ? DB_PREV : DB_NEXT);
+        } else {
+            bound = self->reverse ? &self->upper : &self->lower;
+            if (bound->data) {
+                key.data = malloc(bound->size + 1);
+                if (key.data == NULL) {
+                    err = ENOMEM;
+                    break;
+                }
+                memcpy(key.data, bound->data, bound->size);
+                key.size = bound->size;
+                err = _DBC_get(dbc, &key, &data, DB_SET_RANGE);
+                /* Step back from the first key >= upper, if any */
+                if (self->reverse) {
+                    if (!err)
+                        err = _DBC_get(dbc, &key, &data, DB_PREV);
+                    else if (err == DB_NOTFOUND)
+                        err = _DBC_get(dbc, &key, &data, DB_LAST);
+                }
+            } else {
+                err = _DBC_get(dbc, &key, &data,
+                               self->reverse ? DB_LAST : DB_FIRST);
+            }
+            self->started = 1;
+        }
+        if (err)
+            break;
+        err = _batch_append(&self->buffer, &self->bufsize, &self->used,
+                            &key, &data);
+        if (err)
+            break;
+        /* Don't read past the range */
+        if (self->prefix.data &&
+                !_key_has_prefix(key.data, key.size, &self->prefix))
+            break;
+        if (self->reverse) {
+            if (self->lower.data &&
+                    _key_compare(key.data, key.size, &self->lower) < 0)
+                break;
+        } else if (self->upper.data &&
+                   _key_compare(key.data, key.size, &self->upper) >= 0) {
+            break;
+        }
     }
-    return retval;
+    free(key.data);
+    free(data.data);
+    /* The end was found after some records */
+    if ((err == DB_NOTFOUND || err == DB_KEYEMPTY) && self->used) {
+        self->eof = 1;
+        err = 0;
+    }
+    return err;
 }
 
+/* Get the next record of the buffer, if any */
+static int _DBScan_record(DBScanObject *self, void **key, u_int32_t *klen,
+                          void **data, u_int32_t *dlen)
+{
+    if (DBScan_bulk(self)) {
+        if (self->p == NULL)
+            return 0;
+        DB_MULTIPLE_KEY_NEXT(self->p, &self->data, *key, *klen, *data,
+                             *dlen);
+        return self->p != NULL;
+    }
+    return _batch_record(self->buffer, self->used, &self->pos,
+                         key, klen, data, dlen);
+}
 
 static PyObject*
-DBC_get_recno(DBCursorObject* self)
+DBScan_iternext(DBScanObject *self)
 {
     int err;
-    db_recno_t recno;
-    DBT key;
-    DBT data;
-
-    CHECK_CURSOR_NOT_CLOSED(self);
+    void *key, *data;
+    u_int32_t klen, dlen;
 
-    CLEAR_DBT(key);
-    CLEAR_DBT(data);
-
-    MYDB_BEGIN_ALLOW_THREADS;
-    err = _DBC_get(self->dbc, &key, &data, DB_GET_RECNO);
-    MYDB_END_ALLOW_THREADS;
-    RETURN_IF_ERR();
+    for (;;) {
+        if (self->done)
+            return NULL;
+        if (self->limit >= 0 && self->count >= self->limit) {
+            self->done = 1;
+            return NULL;
+        }
+        if (_DBScan_record(self, &key, &klen, &data, &dlen))
+            break;
+        if (self->eof) {
+            self->done = 1;
+            return NULL;
+        }
+        CHECK_CURSOR_NOT_CLOSED(self->cursor);
+        MYDB_BEGIN_ALLOW_THREADS;
+        err = _DBScan_fill(self);
+        MYDB_END_ALLOW_THREADS;
+        if (err == DB_NOTFOUND || err == DB_KEYEMPTY) {
+            self->done = 1;
+            return NULL;
+        }
+        if (makeDBError(err)) {
+            self->done = 1;
+            return NULL;
+        }
+    }
 
-    recno = *((db_recno_t*)data.data);
-    return NUMBER_FromLong(recno);
+    /* Stop at the first key out of the range */
+    if ((self->upper.data && _key_compare(key, klen, &self->upper) >= 0) ||
+        (self->lower.data && _key_compare(key, klen, &self->lower) < 0) ||
+        (self->prefix.data && !_key_has_prefix(key, klen, &self->prefix))) {
+        self->done = 1;
+        return NULL;
+    }
+    self->count++;
+    return _build_record(0, self->keys_only, self->values_only,
+                         key, klen, data, dlen);
 }
 
-
-static PyObject*
-DBC_last(DBCursorObject* self, PyObject* args, PyObject *kwargs)
+static void
+DBScan_dealloc(DBScanObject *self)
 {
-    return _DBCursor_get(self,DB_LAST,args,kwargs,"|iii:last");
+    free(self->lower.data);
+    free(self->upper.data);
+    free(self->prefix.data);
+    free(self->buffer);
+    Py_DECREF(self->cursor);
+    PyObject_Del(self);
 }
 
-
 static PyObject*
-DBC_next(DBCursorObject* self, PyObject* args, PyObject *kwargs)
+DBC_scan(DBCursorObject* self, PyObject* args, PyObject* kwargs)
 {
-    return _DBCursor_get(self,DB_NEXT,args,kwargs,"|iii:next");
-}
+    PyObject *startobj = Py_None, *stopobj = Py_None;
+    PyObject *prefixobj = Py_None, *limitobj = Py_None;
+    int reverse = 0, keys_only = 0, values_only = 0, type;
+    unsigned int bufsize = 65536;
+    long limit = -1;
+    DBT start, stop, prefix, *bound;
+    DBScanObject *scan;
+    u_int32_t i;
+    static char* kwnames[] = { "start", "stop", "prefix", "reverse",
+                               "limit", "keys_only", "values_only",
+                               "bufsize", NULL };
 
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|OOOiOiiI:scan", kwnames,
+                                     &startobj, &stopobj, &prefixobj,
+                                     &reverse, &limitobj, &keys_only,
+                                     &values_only, &bufsize))
+        return NULL;
 
-static PyObject*
-DBC_prev(DBCursorObject* self, PyObject* args, PyObject *kwargs)
-{
-    return _DBCursor_get(self,DB_PREV,args,kwargs,"|iii:prev");
+    CHECK_CURSOR_NOT_CLOSED(self);
+    if (keys_only && values_only) {
+        PyErr_SetString(PyExc_ValueError,
+                        "keys_only and values_only are exclusive");
+        return NULL;
+    }
+    type = _DB_get_type(self->mydb);
+    if (type == -1)
+        return NULL;
+    if (type != DB_BTREE && type != DB_HASH) {
+        PyErr_SetString(PyExc_TypeError,
+                        "scan() is only allowed for Btree and Hash DB's");
+        return NULL;
+    }
+    if (startobj != Py_None || stopobj != Py_None || prefixobj != Py_None) {
+        if (type != DB_BTREE || self->mydb->btCompareCallback != NULL) {
+            PyErr_SetString(PyExc_TypeError,
+                    "scan() ranges need a Btree DB with the default "
+                    "key order");
+            return NULL;
+        }
+    }
+    if (limitobj != Py_None) {
+        limit = NUMBER_AsLong(limitobj);
+        if (limit == -1 && PyErr_Occurred())
+            return NULL;
+        if (limit < 0) {
+            PyErr_SetString(PyExc_ValueError, "limit must be >= 0");
+            return NULL;
+        }
+    }
+    if (!make_dbt(startobj, &start) || !make_dbt(stopobj, &stop) ||
+        !make_dbt(prefixobj, &prefix))
+        return NULL;
+
+    scan = PyObject_New(DBScanObject, &DBScan_Type);
+    if (scan == NULL)
+        return NULL;
+    Py_INCREF(self);
+    scan->cursor = self;
+    scan->reverse = reverse;
+    scan->keys_only = keys_only;
+    scan->values_only = values_only;
+    scan->started = scan->eof = scan->done = 0;
+    scan->limit = limit;
+    scan->count = 0;
+    CLEAR_DBT(scan->lower);
+    CLEAR_DBT(scan->upper);
+    CLEAR_DBT(scan->prefix);
+    CLEAR_DBT(scan->data);
+    scan->p = NULL;
+    scan->used = scan->pos = 0;
+    if (bufsize < 1024)
+        bufsize = 1024;
+    scan->bufsize = (bufsize + 1023) & ~1023;
+    scan->buffer = malloc(scan->bufsize);
+    if (scan->buffer == NULL) {
+        Py_DECREF(scan);
+        return PyErr_NoMemory();
+    }
+
+    /* The range is the keys >= max(start, prefix) and
+     * < min(stop, first key after the prefix) */
+    bound = NULL;
+    if (startobj != Py_None)
+        bound = &start;
+    if (prefixobj != Py_None &&
+            (bound == NULL ||
+             _key_compare(prefix.data, prefix.size, bound) > 0))
+        bound = &prefix;
+    if (bound && !_copy_dbt(&scan->lower, bound->data, bound->size)) {
+        Py_DECREF(scan);
+        return NULL;
+    }
+    if (prefixobj != Py_None) {
+        if (!_copy_dbt(&scan->prefix, prefix.data, prefix.size)) {
+            Py_DECREF(scan);
+            return NULL;
+        }
+        /* Increment the last byte below 0xff, dropping the ones after */
+        for (i = prefix.size; i > 0; i--) {
+            if (((unsigned char *)prefix.data)[i - 1] != 0xff)
+                break;
+        }
+        if (i > 0) {
+            if (!_copy_dbt(&scan->upper, prefix.data, i)) {
+                Py_DECREF(scan);
+                return NULL;
+            }
+            ((unsigned char *)scan->upper.data)[i - 1]++;
+        }
+    }
+    if (stopobj != Py_None &&
+            (scan->upper.data == NULL ||
+             _key_compare(stop.data, stop.size, &scan->upper) < 0)) {
+        free(scan->upper.data);
+        if (!_copy_dbt(&scan->upper, stop.data, stop.size)) {
+            Py_DECREF(scan);
+            return NULL;
+        }
+    }
+    return (PyObject *)scan;
 }
 
 
@@ -7192,6 +8326,175 @@ DBEnv_rep_process_message(DBEnvObject* self, PyObject* args)
     return PyTuple_Pack(2, Py_None, Py_None);
 }
 
+/* Process a batch of messages with the GIL released, aggregating the
+ * results.  If a message fails, the results of the messages processed
+ * before it are attached to the exception raised, as its 'result'. */
+static PyObject*
+DBEnv_rep_process_messages(DBEnvObject* self, PyObject* args)
+{
+    int err = 0;
+    PyObject *messages, *seq, *item, *control_py, *rec_py;
+    PyObject *keep = NULL, *newsites = NULL, *result = NULL, *tmp;
+    PyObject *newmaster_py = NULL, *isperm_py = NULL, *notperm_py = NULL;
+    Py_ssize_t count, i, processed;
+    DBT *controls = NULL, *recs = NULL;
+    int *envids = NULL, *rets = NULL;
+    DB_LSN lsn, isperm, notperm;
+    int have_isperm = 0, have_notperm = 0;
+    int have_newmaster = 0, newmaster = 0;
+    int dupmaster = 0, holdelection = 0, join_failure = 0;
+
+    if (!PyArg_ParseTuple(args, "O:rep_process_messages", &messages))
+        return NULL;
+    CHECK_ENV_NOT_CLOSED(self);
+
+    seq = PySequence_Fast(messages,
+            "rep_process_messages() needs a sequence of messages");
+    if (!seq)
+        return NULL;
+    count = PySequence_Fast_GET_SIZE(seq);
+    /* The data must stay alive while the GIL is released */
+    if (!(keep = PyList_New(0)))
+        goto exit;
+    controls = PyMem_Malloc((count ? count : 1) * sizeof(DBT));
+    recs = PyMem_Malloc((count ? count : 1) * sizeof(DBT));
+    envids = PyMem_Malloc((count ? count : 1) * sizeof(int));
+    rets = PyMem_Malloc((count ? count : 1) * sizeof(int));
+    if (!controls || !recs || !envids || !rets) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+    for (i = 0; i < count; i++) {
+        item = PySequence_Fast_GET_ITEM(seq, i);
+        if (!PyArg_ParseTuple(item, "OOi:rep_process_messages",
+                    &control_py, &rec_py, &envids[i]))
+            goto exit;
+        if (!make_dbt(control_py, &controls[i]) ||
+                !make_dbt(rec_py, &recs[i]))
+            goto exit;
+        if (PyList_Append(keep, control_py) || PyList_Append(keep, rec_py))
+            goto exit;
+    }
+
+    MYDB_BEGIN_ALLOW_THREADS;
+    for (i = 0; i < count; i++) {
+        err = self->db_env->rep_process_message(self->db_env, &controls[i],
+                &recs[i], envids[i], &lsn);
+        rets[i] = err;
+        switch (err) {
+            case 0 :
+            case DB_REP_IGNORE :
+            case DB_REP_NEWSITE :
+                break;
+            case DB_REP_NEWMASTER :
+                have_newmaster = 1;
+                newmaster = envids[i];
+                break;
+            case DB_REP_DUPMASTER :
+                dupmaster = 1;
+                break;
+            case DB_REP_HOLDELECTION :
+                holdelection = 1;
+                break;
+            case DB_REP_JOIN_FAILURE :
+                join_failure = 1;
+                break;
+            case DB_REP_ISPERM :
+                if (!have_isperm || (log_compare(&lsn, &isperm) > 0)) {
+                    isperm = lsn;
+                    have_isperm = 1;
+                }
+                break;
+            case DB_REP_NOTPERM :
+                if (!have_notperm || (log_compare(&lsn, &notperm) > 0)) {
+                    notperm = lsn;
+                    have_notperm = 1;
+                }
+                break;
+            default :
+                goto stop;
+        }
+        err = 0;
+    }
+stop:
+    processed = i;
+    MYDB_END_ALLOW_THREADS;
+
+    if (!(newsites = PyList_New(0)))
+        goto exit;
+    for (i = 0; i < processed; i++) {
+        if (rets[i] != DB_REP_NEWSITE)
+            continue;
+        tmp = PyBytes_FromStringAndSize(recs[i].data, recs[i].size);
+        if (!tmp || PyList_Append(newsites, tmp)) {
+            Py_XDECREF(tmp);
+            goto exit;
+        }
+        Py_DECREF(tmp);
+    }
+    if (have_newmaster)
+        newmaster_py = NUMBER_FromLong(newmaster);
+    else {
+        Py_INCREF(Py_None);
+        newmaster_py = Py_None;
+    }
+    if (have_isperm)
+        isperm_py = Py_BuildValue("(ll)", (long)isperm.file,
+                                  (long)isperm.offset);
+    else {
+        Py_INCREF(Py_None);
+        isperm_py = Py_None;
+    }
+    if (have_notperm)
+        notperm_py = Py_BuildValue("(ll)", (long)notperm.file,
+                                   (long)notperm.offset);
+    else {
+        Py_INCREF(Py_None);
+        notperm_py = Py_None;
+    }
+    if (!newmaster_py || !isperm_py || !notperm_py)
+        goto exit;
+
+    result = Py_BuildValue("{s:n,s:O,s:O,s:O,s:O,s:N,s:N,s:N}",
+            "processed", processed,
+            "newmaster", newmaster_py,
+            "isperm", isperm_py,
+            "notperm", notperm_py,
+            "newsites", newsites,
+            "holdelection", PyBool_FromLong(holdelection),
+            "dupmaster", PyBool_FromLong(dupmaster),
+            "join_failure", PyBool_FromLong(join_failure));
+    if (result && makeDBError(err)) {
+        PyObject *type, *value, *traceback;
+
+        /* The messages already processed can't be taken back: give
+         * their results, so the permanent LSNs can be acknowledged */
+        PyErr_Fetch(&type, &value, &traceback);
+        PyErr_NormalizeException(&type, &value, &traceback);
+        if (value && PyObject_SetAttrString(value, "result", result)) {
+            Py_XDECREF(type);
+            Py_XDECREF(value);
+            Py_XDECREF(traceback);
+        } else {
+            PyErr_Restore(type, value, traceback);
+        }
+        Py_CLEAR(result);
+    }
+
+exit:
+    Py_XDECREF(newmaster_py);
+    Py_XDECREF(isperm_py);
+    Py_XDECREF(notperm_py);
+    Py_XDECREF(newsites);
+    Py_XDECREF(keep);
+    Py_DECREF(seq);
+    PyMem_Free(controls);
+    PyMem_Free(recs);
+    PyMem_Free(envids);
+    PyMem_Free(rets);
+    return result;
+}
+
 static int
 _DBEnv_rep_transportCallback(DB_ENV* db_env, const DBT* control, const DBT* rec,
         const DB_LSN *lsn, int envid, u_int32_t flags)
@@ -7261,6 +8564,140 @@ DBEnv_rep_set_transport(DBEnvObject* self, PyObject* args)
     RETURN_NONE();
 }
 
+/*
+** Native transport: every message is written to a file descriptor as a
+** frame with the control size, the record size, the LSN file and offset,
+** the envid and the flags as big endian 32 bits integers, followed by
+** the control and record data.  No Python code runs, so the GIL is not
+** needed.
+*/
+#define REP_FRAME_HEADER 24
+
+static void
+_rep_frame_put(unsigned char *p, u_int32_t value)
+{
+    p[0] = (unsigned char)(value >> 24);
+    p[1] = (unsigned char)(value >> 16);
+    p[2] = (unsigned char)(value >> 8);
+    p[3] = (unsigned char)value;
+}
+
+#ifdef MS_WINDOWS
+struct iovec {
+    void *iov_base;
+    size_t iov_len;
+};
+
+/* No writev() in Windows: write the first buffer, the caller loops */
+static long
+writev(int fd, const struct iovec *iov, int iovcnt)
+{
+    return (long)write(fd, iov->iov_base, iov->iov_len);
+}
+#endif
+
+/* Write the 'iovcnt' buffers of 'iov', which are updated.  Called
+ * without the GIL. */
+static int
+_rep_write_all(int fd, struct iovec *iov, int iovcnt)
+{
+    long n;
+
+    while (iovcnt) {
+        if (iov->iov_len == 0) {
+            iov++;
+            iovcnt--;
+            continue;
+        }
+        n = (long)writev(fd, iov, iovcnt);
+        if (n < 0) {
+            if (errno == EINTR)
+                continue;
+            return errno;
+        }
+        /* Skip what was written */
+        while (n > 0) {
+            if ((size_t)n >= iov->iov_len) {
+                n -= (long)iov->iov_len;
+                iov++;
+                iovcnt--;
+            } else {
+                iov->iov_base = (char *)iov->iov_base + n;
+                iov->iov_len -= n;
+                n = 0;
+            }
+        }
+    }
+    return 0;
+}
+
+static int
+_DBEnv_rep_transportFd(DB_ENV* db_env, const DBT* control, const DBT* rec,
+        const DB_LSN *lsn, int envid, u_int32_t flags)
+{
+    DBEnvObject *dbenv;
+    unsigned char header[REP_FRAME_HEADER];
+    struct iovec iov[3];
+    int ret;
+
+    dbenv = (DBEnvObject *)db_env->app_private;
+    _rep_frame_put(header, control->size);
+    _rep_frame_put(header + 4, rec->size);
+    _rep_frame_put(header + 8, lsn->file);
+    _rep_frame_put(header + 12, lsn->offset);
+    _rep_frame_put(header + 16, (u_int32_t)envid);
+    _rep_frame_put(header + 20, flags);
+    /* The message is written from the DBTs, without copying it */
+    iov[0].iov_base = header;
+    iov[0].iov_len = REP_FRAME_HEADER;
+    iov[1].iov_base = control->data;
+    iov[1].iov_len = control->size;
+    iov[2].iov_base = rec->data;
+    iov[2].iov_len = rec->size;
+
+    /* Frames sent by several threads must not be interleaved */
+    PyThread_acquire_lock((PyThread_type_lock)dbenv->rep_transport_lock,
+                          WAIT_LOCK);
+    ret = _rep_write_all(dbenv->rep_transport_fd, iov, 3);
+    PyThread_release_lock((PyThread_type_lock)dbenv->rep_transport_lock);
+    return ret;
+}
+
+static PyObject*
+DBEnv_rep_set_transport_fd(DBEnvObject* self, PyObject* args)
+{
+    int err;
+    int envid, fd;
+
+    if (!PyArg_ParseTuple(args, "ii:rep_set_transport_fd", &envid, &fd))
+        return NULL;
+    CHECK_ENV_NOT_CLOSED(self);
+    if (fd < 0) {
+        PyErr_SetString(PyExc_ValueError, "invalid file descriptor");
+        return NULL;
+    }
+    if (!self->rep_transport_lock) {
+        if (!(self->rep_transport_lock = PyThread_allocate_lock()))
+            return PyErr_NoMemory();
+    }
+
+    /* Don't change the descriptor while a message is being written */
+    MYDB_BEGIN_ALLOW_THREADS;
+    PyThread_acquire_lock((PyThread_type_lock)self->rep_transport_lock,
+                          WAIT_LOCK);
+    self->rep_transport_fd = fd;
+    PyThread_release_lock((PyThread_type_lock)self->rep_transport_lock);
+    err = self->db_env->rep_set_transport(self->db_env, envid,
+            &_DBEnv_rep_transportFd);
+    MYDB_END_ALLOW_THREADS;
+    RETURN_IF_ERR();
+
+    Py_DECREF(self->rep_transport);
+    Py_INCREF(Py_None);
+    self->rep_transport = Py_None;
+    RETURN_NONE();
+}
+
 static PyObject*
 DBEnv_rep_set_request(DBEnvObject* self, PyObject* args)
 {
@@ -8235,6 +9672,46 @@ DBSequence_get(DBSequenceObject* self, PyObject* args, PyObject* kwargs)
     return PyLong_FromLongLong(value);
 }
 
+/* Reserve n consecutive values with a single call, returning the first
+ * and the last one */
+static PyObject*
+DBSequence_get_block(DBSequenceObject* self, PyObject* args,
+                     PyObject* kwargs)
+{
+    int err, flags = 0;
+    int n;
+    u_int32_t seq_flags;
+    db_seq_t first, last;
+    PyObject *txnobj = NULL;
+    DB_TXN *txn = NULL;
+    static char* kwnames[] = {"n", "txn", "flags", NULL };
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|Oi:get_block",
+                                     kwnames, &n, &txnobj, &flags))
+        return NULL;
+    CHECK_SEQUENCE_NOT_CLOSED(self)
+
+    if (n < 1) {
+        PyErr_SetString(PyExc_ValueError, "n must be >= 1");
+        return NULL;
+    }
+    if (!checkTxnObj(txnobj, &txn))
+        return NULL;
+
+    MYDB_BEGIN_ALLOW_THREADS
+    err = self->sequence->get_flags(self->sequence, &seq_flags);
+    if (!err)
+        err = self->sequence->get(self->sequence, txn, n, &first, flags);
+    MYDB_END_ALLOW_THREADS
+
+    RETURN_IF_ERR();
+    if (seq_flags & DB_SEQ_DEC)
+        last = first - (n - 1);
+    else
+        last = first + (n - 1);
+    return Py_BuildValue("(LL)", (PY_LONG_LONG)first, (PY_LONG_LONG)last);
+}
+
 static PyObject*
 DBSequence_get_dbp(DBSequenceObject* self)
 {
@@ -8546,8 +10023,11 @@ static PyMethodDef DB_methods[] = {
     {"associate",       (PyCFunction)DB_associate,      METH_VARARGS|METH_KEYWORDS},
     {"close",           (PyCFunction)DB_close,          METH_VARARGS},
     {"compact",         (PyCFunction)DB_compact,        METH_VARARGS|METH_KEYWORDS},
+    {"compact_incremental", (PyCFunction)DB_compact_incremental,
+        METH_VARARGS|METH_KEYWORDS},
     {"consume",         (PyCFunction)DB_consume,        METH_VARARGS|METH_KEYWORDS},
     {"consume_wait",    (PyCFunction)DB_consume_wait,   METH_VARARGS|METH_KEYWORDS},
+    {"consume_many",    (PyCFunction)DB_consume_many,   METH_VARARGS|METH_KEYWORDS},
     {"cursor",          (PyCFunction)DB_cursor,         METH_VARARGS|METH_KEYWORDS},
     {"delete",          (PyCFunction)DB_delete,         METH_VARARGS|METH_KEYWORDS},
     {"fd",              (PyCFunction)DB_fd,             METH_NOARGS},
@@ -8557,6 +10037,7 @@ static PyMethodDef DB_methods[] = {
     {"pget",            (PyCFunction)DB_pget,           METH_VARARGS|METH_KEYWORDS},
     {"get_both",        (PyCFunction)DB_get_both,       METH_VARARGS|METH_KEYWORDS},
     {"get_byteswapped", (PyCFunction)DB_get_byteswapped,METH_NOARGS},
+    {"get_into",        (PyCFunction)DB_get_into,       METH_VARARGS|METH_KEYWORDS},
     {"get_size",        (PyCFunction)DB_get_size,       METH_VARARGS|METH_KEYWORDS},
     {"get_type",        (PyCFunction)DB_get_type,       METH_NOARGS},
     {"join",            (PyCFunction)DB_join,           METH_VARARGS},
@@ -8650,6 +10131,8 @@ static PyMethodDef DBCursor_methods[] = {
     {"get_recno",       (PyCFunction)DBC_get_recno,     METH_NOARGS},
     {"last",            (PyCFunction)DBC_last,          METH_VARARGS|METH_KEYWORDS},
     {"next",            (PyCFunction)DBC_next,          METH_VARARGS|METH_KEYWORDS},
+    {"next_many",       (PyCFunction)DBC_next_many,     METH_VARARGS|METH_KEYWORDS},
+    {"scan",            (PyCFunction)DBC_scan,          METH_VARARGS|METH_KEYWORDS},
     {"prev",            (PyCFunction)DBC_prev,          METH_VARARGS|METH_KEYWORDS},
     {"put",             (PyCFunction)DBC_put,           METH_VARARGS|METH_KEYWORDS},
     {"set",             (PyCFunction)DBC_set,           METH_VARARGS|METH_KEYWORDS},
@@ -8819,8 +10302,12 @@ static PyMethodDef DBEnv_methods[] = {
     {"rep_start",       (PyCFunction)DBEnv_rep_start,
         METH_VARARGS|METH_KEYWORDS},
     {"rep_set_transport", (PyCFunction)DBEnv_rep_set_transport, METH_VARARGS},
+    {"rep_set_transport_fd", (PyCFunction)DBEnv_rep_set_transport_fd,
+        METH_VARARGS},
     {"rep_process_message", (PyCFunction)DBEnv_rep_process_message,
         METH_VARARGS},
+    {"rep_process_messages", (PyCFunction)DBEnv_rep_process_messages,
+        METH_VARARGS},
     {"rep_elect",       (PyCFunction)DBEnv_rep_elect,         METH_VARARGS},
     {"rep_set_config",  (PyCFunction)DBEnv_rep_set_config,    METH_VARARGS},
     {"rep_get_config",  (PyCFunction)DBEnv_rep_get_config,    METH_VARARGS},
@@ -8888,6 +10375,7 @@ static PyMethodDef DBTxn_methods[] = {
 static PyMethodDef DBSequence_methods[] = {
     {"close",           (PyCFunction)DBSequence_close,          METH_VARARGS},
     {"get",             (PyCFunction)DBSequence_get,            METH_VARARGS|METH_KEYWORDS},
+    {"get_block",       (PyCFunction)DBSequence_get_block,      METH_VARARGS|METH_KEYWORDS},
     {"get_dbp",         (PyCFunction)DBSequence_get_dbp,        METH_NOARGS},
     {"get_key",         (PyCFunction)DBSequence_get_key,        METH_NOARGS},
     {"initial_value",   (PyCFunction)DBSequence_initial_value,  METH_VARARGS},
@@ -9015,6 +10503,47 @@ statichere PyTypeObject DBCursor_Type = {
 };
 
 
+statichere PyTypeObject DBScan_Type = {
+#if (PY_VERSION_HEX < 0x03000000)
+    PyObject_HEAD_INIT(NULL)
+    0,                  /*ob_size*/
+#else
+    PyVarObject_HEAD_INIT(NULL, 0)
+#endif
+    "DBCursorScan",     /*tp_name*/
+    sizeof(DBScanObject),  /*tp_basicsize*/
+    0,          /*tp_itemsize*/
+    /* methods */
+    (destructor)DBScan_dealloc,/*tp_dealloc*/
+    0,          /*tp_print*/
+    0,          /*tp_getattr*/
+    0,          /*tp_setattr*/
+    0,          /*tp_compare*/
+    0,          /*tp_repr*/
+    0,          /*tp_as_number*/
+    0,          /*tp_as_sequence*/
+    0,          /*tp_as_mapping*/
+    0,          /*tp_hash*/
+    0,          /*tp_call*/
+    0,          /*tp_str*/
+    0,          /*tp_getattro*/
+    0,          /*tp_setattro*/
+    0,          /*tp_as_buffer*/
+#if (PY_VERSION_HEX < 0x03000000)
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_ITER,      /* tp_flags */
+#else
+    Py_TPFLAGS_DEFAULT,      /* tp_flags */
+#endif
+    0,          /* tp_doc */
+    0,          /* tp_traverse */
+    0,          /* tp_clear */
+    0,          /* tp_richcompare */
+    0,          /* tp_weaklistoffset */
+    PyObject_SelfIter,  /*tp_iter*/
+    (iternextfunc)DBScan_iternext,  /*tp_iternext*/
+};
+
+
 statichere PyTypeObject DBLogCursor_Type = {
 #if (PY_VERSION_HEX < 0x03000000)
     PyObject_HEAD_INIT(NULL)
@@ -9418,6 +10947,7 @@ PyMODINIT_FUNC  PyInit__bsddb(void)    /* Note the two underscores */
     /* Initialize object types */
     if ((PyType_Ready(&DB_Type) < 0)
         || (PyType_Ready(&DBCursor_Type) < 0)
+        || (PyType_Ready(&DBScan_Type) < 0)
         || (PyType_Ready(&DBLogCursor_Type) < 0)
         || (PyType_Ready(&DBEnv_Type) < 0)
         || (PyType_Ready(&DBTxn_Type) < 0)
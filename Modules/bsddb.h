@@ -144,6 +144,9 @@ typedef struct {
     PyObject        *private_obj;
     PyObject        *rep_transport;
     PyObject        *in_weakreflist; /* List of weak references */
+    /* New fields go last, to keep the layout seen by the C API users */
+    int             rep_transport_fd;   /* for rep_set_transport_fd() */
+    void            *rep_transport_lock;
 } DBEnvObject;
 
 typedef struct DBObject {